@@ -0,0 +1 @@
+"""Prestandamätning av RFID CSV Konverteraren med syntetiska flottfiler."""
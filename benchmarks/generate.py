@@ -0,0 +1,105 @@
+"""
+Generator för syntetiska flottfiler (huvudfil + matchande MER-fil).
+
+Samma parametrar och seed ger alltid samma filer, så att mätningar
+kan jämföras mellan körningar.
+"""
+
+import os
+import random
+from typing import Dict, List, NamedTuple
+
+from openpyxl import Workbook
+
+HEX_SHEET = 'HEX'
+TAGG_SHEET = 'TAGG'
+MAIN_COLUMNS = {
+    HEX_SHEET: ['RFID HEX', 'Regnummer', 'Företag'],
+    TAGG_SHEET: ['TAGG ID', 'Regnummer', 'Företag'],
+}
+MER_COLUMNS = ['Visible Number', 'Key/Card number']
+
+class FleetSpec(NamedTuple):
+    """Parametrar för en syntetisk flottfil."""
+    rows: int
+    tagg_ratio: float = 0.2       # Andel rader med TAGG ID i stället för HEX
+    invalid_rate: float = 0.01    # Andel ogiltiga HEX / okända TAGG ID
+    duplicate_rate: float = 0.02  # Andel rader som upprepar ett tidigare RFID
+    missing_id_rate: float = 0.01 # Andel rader utan regnummer
+    companies: int = 50           # Antal olika företag
+    seed: int = 42
+
+    @property
+    def name(self) -> str:
+        return (f"fleet_{self.rows}_t{self.tagg_ratio}_i{self.invalid_rate}_d{self.duplicate_rate}"
+                f"_m{self.missing_id_rate}_c{self.companies}_s{self.seed}")
+
+    def to_dict(self) -> Dict:
+        return self._asdict()
+
+def _hex(rng: random.Random) -> str:
+    return f"{rng.getrandbits(32):08X}"
+
+def _plate(rng: random.Random) -> str:
+    letters = ''.join(rng.choice('ABCDEFGHJKLMNOPRSTUWXYZ') for _ in range(3))
+    return f"{letters}{rng.randrange(1000):03d}"
+
+def fleet_rows(spec: FleetSpec) -> Dict[str, List[List]]:
+    """Rader per flik i huvudfilen samt MER-filen (nyckel 'MER')."""
+    rng = random.Random(spec.seed)
+    companies = [f"Företag {i:04d} AB" for i in range(spec.companies)]
+    sheets = {HEX_SHEET: [], TAGG_SHEET: [], 'MER': []}
+    seen = []
+    
+    for i in range(spec.rows):
+        plate = None if rng.random() < spec.missing_id_rate else _plate(rng)
+        company = rng.choice(companies)
+        
+        if seen and rng.random() < spec.duplicate_rate:
+            rfid = rng.choice(seen)
+        else:
+            rfid = _hex(rng)
+            seen.append(rfid)
+        invalid = rng.random() < spec.invalid_rate
+        
+        if rng.random() < spec.tagg_ratio:
+            tagg = f"SE-MER-C{i:08d}-{rng.choice('ABCDEFGHJK')}"
+            if not invalid:
+                sheets['MER'].append([tagg, rfid])
+            sheets[TAGG_SHEET].append([tagg, plate, company])
+        else:
+            if invalid:
+                rfid = rng.choice(['XYZ', rfid + 'G', rfid[:4] + ' ' + rfid[4:], '-'])
+            sheets[HEX_SHEET].append([rfid, plate, company])
+    return sheets
+
+def _write_workbook(path: str, sheets: Dict[str, List[List]], columns: Dict[str, List[str]]):
+    """Skriv med openpyxl i write_only-läge (snabbt och med låg minnesanvändning)."""
+    wb = Workbook(write_only=True)
+    for title, rows in sheets.items():
+        ws = wb.create_sheet(title)
+        ws.append(columns[title])
+        for row in rows:
+            ws.append(row)
+    tmp_path = path + '.tmp'
+    wb.save(tmp_path)
+    os.replace(tmp_path, path)
+
+def generate_fleet(spec: FleetSpec, directory: str) -> Dict[str, str]:
+    """
+    Skapa huvudfil och MER-fil för spec i directory (återanvänds om de redan finns).
+    Returnerar {'main': sökväg, 'mer': sökväg}
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        'main': os.path.join(directory, f"{spec.name}.xlsx"),
+        'mer': os.path.join(directory, f"{spec.name}_mer.xlsx"),
+    }
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+    
+    sheets = fleet_rows(spec)
+    mer_rows = sheets.pop('MER')
+    _write_workbook(paths['main'], sheets, MAIN_COLUMNS)
+    _write_workbook(paths['mer'], {'MER': mer_rows}, {'MER': MER_COLUMNS})
+    return paths
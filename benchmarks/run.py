@@ -0,0 +1,170 @@
+"""
+Mät varje steg i konverteringskedjan på syntetiska flottfiler utan webbgränssnitt.
+
+Stegen motsvarar upload_step (förhandsgranskning), auto_detect_columns,
+validation_step (inläsning av mappade kolumner, MER-mappning, HEX-validering, dubbletter,
+förslag för TAGG ID utan träff) och
+result_step (CSV per företag och ZIP).
+
+    python -m benchmarks.run --rows 10000 100000 1000000 -o bench.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+import rfid_converter as rc
+from benchmarks.generate import HEX_SHEET, MAIN_COLUMNS, TAGG_SHEET, FleetSpec, generate_fleet
+
+DEFAULT_ROWS = [10000, 100000, 1000000]
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Mappningen som mäts (samma varje körning). Auto-detekteringen tidmäts och kontrolleras mot den.
+EXPECTED_MAPPINGS = {
+    HEX_SHEET: {'rfid': 'RFID HEX', 'tagg_id': None, 'identifier': 'Regnummer', 'company': 'Företag'},
+    TAGG_SHEET: {'rfid': None, 'tagg_id': 'TAGG ID', 'identifier': 'Regnummer', 'company': 'Företag'},
+}
+
+class StageTimer:
+    """Samlar väggtid per steg i körordning."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, stage: str, func: Callable, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+        return result
+
+def bench_sheet(data: bytes, sheet: str, mer_table: rc.MerTable) -> Dict:
+    """Kör hela kedjan för en flik och returnera tid per steg."""
+    timer = StageTimer()
+
+    # Fas ett: rubrikrad och förhandsgranskning för auto-detekteringen
+    preview = timer('excel_preview', rc.read_input_preview, data, 'excel', sheet)
+    preview.columns = preview.columns.str.strip()
+
+    detected = timer('auto_detect', rc.auto_detect_columns, preview)
+    mapping = EXPECTED_MAPPINGS[sheet]
+    detected_ok = all(detected.get(key) == col for key, col in mapping.items() if col)
+
+    # Fas två: bara de mappade kolumnerna
+    df = timer('excel_parse', rc.read_input_columns, data, 'excel', rc.mapped_columns(mapping), sheet)
+
+    # Valideringsstegen körs ett i taget - tidigare steg återanvänds från grafen
+    pipeline = rc.ValidationPipeline(df)
+    for stage, name in [('RFID_RAW', 'mer_mapping'), ('RFID_CLEAN', 'hex_validation'),
+                        ('Identifieringsnummer', 'identifier_cleaning'), ('Företag', 'company_cleaning'),
+                        ('duplicates', 'duplicate_detection')]:
+        timer(name, pipeline.run, mapping, mer_table, [stage])
+    results = pipeline.run(mapping, mer_table)
+
+    columns = rc.stage_columns(results)
+    df_filtered = rc.non_empty_rows(pd.DataFrame({name: columns[name] for name in rc.RESULT_COLUMNS}))
+    errors, warnings = timer('issue_tables', rc.stage_issues, df, mapping, results)
+    errors, _ = timer('suggestions', rc.suggest_unmatched, errors, mer_table)
+
+    df_valid = df_filtered[df_filtered['RFID_VALID']]
+    csv_files = timer('csv_export', rc.build_company_csvs, df_valid)
+    timer('zip_export', rc.write_export_zip, csv_files, io.BytesIO())
+
+    return {
+        'sheet': sheet,
+        'rows': len(df),
+        'valid_rows': len(df_valid),
+        'errors': len(errors),
+        'warnings': len(warnings) + len(results['duplicates']['warnings']),
+        'duplicate_groups': len(results['duplicates']['summary']),
+        'files': len(csv_files),
+        'auto_detect_ok': detected_ok,
+        'stages': {stage: round(seconds, 4) for stage, seconds in timer.timings.items()},
+        'total': round(sum(timer.timings.values()), 4),
+    }
+
+def bench_fleet(spec: FleetSpec, data_dir: str) -> Dict:
+    """Generera (eller återanvänd) filerna för spec och mät båda flikarna."""
+    start = time.perf_counter()
+    paths = generate_fleet(spec, data_dir)
+    generate_seconds = time.perf_counter() - start
+
+    timer = StageTimer()
+    with open(paths['main'], 'rb') as f:
+        data = f.read()
+    with open(paths['mer'], 'rb') as f:
+        df_mer = timer('mer_parse', rc.read_input_columns, f.read(), 'excel', rc.MER_COLUMNS)
+    mer_index = rc.MerIndex(':memory:')
+    mer_hash = rc.file_hash(data)
+    timer('mer_ingest', mer_index.ingest, df_mer, mer_hash, os.path.basename(paths['mer']))
+
+    sheets = [bench_sheet(data, sheet, mer_index.table(mer_hash)) for sheet in MAIN_COLUMNS]
+    return {
+        'spec': spec.to_dict(),
+        'file_bytes': len(data),
+        'generate_seconds': round(generate_seconds, 4),
+        'mer': {'rows': len(df_mer), 'stages': {k: round(v, 4) for k, v in timer.timings.items()}},
+        'sheets': sheets,
+    }
+
+def environment() -> Dict:
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'excel_engine': rc.excel_engine(),
+    }
+
+def print_summary(result: Dict):
+    spec = result['spec']
+    for sheet in result['sheets']:
+        stages = ', '.join(f"{stage} {seconds:.3f}s" for stage, seconds in sheet['stages'].items())
+        print(f"{spec['rows']:>8} rader | {sheet['sheet']:<4} {sheet['rows']:>8} rader | "
+              f"totalt {sheet['total']:.3f}s | {stages}", file=sys.stderr)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Prestandamätning per steg på syntetiska flottfiler')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='Antal rader per fil')
+    parser.add_argument('--tagg-ratio', type=float, default=FleetSpec._field_defaults['tagg_ratio'])
+    parser.add_argument('--invalid-rate', type=float, default=FleetSpec._field_defaults['invalid_rate'])
+    parser.add_argument('--duplicate-rate', type=float, default=FleetSpec._field_defaults['duplicate_rate'])
+    parser.add_argument('--missing-id-rate', type=float, default=FleetSpec._field_defaults['missing_id_rate'])
+    parser.add_argument('--companies', type=int, default=FleetSpec._field_defaults['companies'])
+    parser.add_argument('--seed', type=int, default=FleetSpec._field_defaults['seed'])
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Katalog för genererade filer')
+    parser.add_argument('-o', '--output', help='JSON-fil för resultatet (standard: stdout)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for rows in args.rows:
+        spec = FleetSpec(rows=rows, tagg_ratio=args.tagg_ratio, invalid_rate=args.invalid_rate,
+                         duplicate_rate=args.duplicate_rate, missing_id_rate=args.missing_id_rate,
+                         companies=args.companies, seed=args.seed)
+        result = bench_fleet(spec, args.data_dir)
+        print_summary(result)
+        results.append(result)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
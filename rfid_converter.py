@@ -1,14 +1,68 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import argparse
+import asyncio
+import csv
+import email.policy
+import glob
 import io
+import json
+import logging
+import math
+import os
 import re
-from typing import Dict, List, Tuple, Optional
+import shutil
+import signal
+import sys
+import hashlib
+import importlib.util
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager, suppress
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from email.parser import BytesFeedParser
+from http import HTTPStatus
+from typing import Callable, Dict, Iterator, List, NamedTuple, Tuple, Optional
+from openpyxl import load_workbook
+from streamlit import runtime
 
 # ChargeNode färgschema
 CHARGENODE_GREEN = "#00B894"
 CHARGENODE_DARK = "#2D3436"
 CHARGENODE_LIGHT = "#DFE6E9"
 
+# Katalog för lokala, beständiga data (MER-index m.m.)
+DATA_DIR = os.environ.get(
+    'RFID_CONVERTER_DATA',
+    os.path.join(os.path.expanduser('~'), '.rfid_converter')
+)
+
+# Minnesbudget för cache av inlästa Excel-flikar (delas av alla sessioner)
+PARSE_CACHE_MB = int(os.environ.get('RFID_CONVERTER_CACHE_MB', '512'))
+
+# Minnesbudget för inlästa MER-filer som inte används av någon session (delas av alla sessioner)
+MER_CACHE_MB = int(os.environ.get('RFID_CONVERTER_MER_CACHE_MB', '256'))
+
+# Trådar för bakgrundsjobb (validering och export), delas av alla sessioner
+JOB_WORKERS = int(os.environ.get('RFID_CONVERTER_JOB_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Mätvärden per körning loggas som en JSON-rad. Sätt en fil för att även skriva dem dit.
+METRICS_LOG = os.environ.get('RFID_CONVERTER_METRICS_LOG')
+metrics_logger = logging.getLogger('rfid_converter.metrics')
+if METRICS_LOG and not metrics_logger.handlers:
+    _metrics_handler = logging.FileHandler(METRICS_LOG, encoding='utf-8')
+    _metrics_handler.setFormatter(logging.Formatter('%(message)s'))
+    metrics_logger.addHandler(_metrics_handler)
+    metrics_logger.setLevel(logging.INFO)
+
 # Custom CSS för ChargeNode-stil
 def load_custom_css():
     st.markdown(f"""
@@ -187,6 +241,49 @@ def validate_hex(hex_str: str) -> Tuple[bool, str]:
     
     return True, hex_str
 
+# Orsakskoder från validate_hex_series
+HEX_OK = 'ok'
+HEX_MISSING = 'missing'
+HEX_EMPTY = 'empty'
+HEX_TAGG_ID = 'tagg_id'
+HEX_CHARSET = 'charset'
+HEX_LENGTH = 'length'
+
+def validate_hex_series(values: pd.Series) -> Tuple[pd.Series, pd.Series, pd.Series]:
+    """
+    Validera HEX-format för en hel kolumn med vektoriserade strängoperationer.
+    Ger samma resultat som validate_hex rad för rad.
+    Returnerar (rensat_hex, är_giltig, orsakskod)
+    """
+    present = values.notna()
+    text = values[present].astype(str).str.strip().str.upper()
+
+    # Ta bort eventuella prefix (samma som i validate_hex, alla förekomster)
+    stripped = text.str.replace('0X', '', regex=False)
+
+    empty = text == ''
+    tagg = text.str.startswith('SE-MER-')
+    # re.match med '$' tillåter en avslutande radbrytning, därav '\n?'
+    charset_ok = stripped.str.fullmatch(r'[0-9A-F]+\n?')
+    length = stripped.str.len()
+    length_ok = (length >= 6) & (length <= 10)
+
+    # Rensat värde: TAGG ID behåller sin form, tomma blir ''
+    clean = pd.Series('', index=values.index, dtype=object)
+    clean[present] = stripped.where(~tagg, text).where(~empty, '').astype(object)
+
+    # Orsakskod - tilldelas i omvänd prioritetsordning
+    reason = pd.Series(HEX_MISSING, index=values.index, dtype=object)
+    sub_reason = pd.Series(HEX_OK, index=text.index, dtype=object)
+    sub_reason[~length_ok] = HEX_LENGTH
+    sub_reason[~charset_ok] = HEX_CHARSET
+    sub_reason[tagg] = HEX_TAGG_ID
+    sub_reason[empty] = HEX_EMPTY
+    reason[present] = sub_reason
+
+    valid = reason == HEX_OK
+    return clean, valid, reason
+
 def clean_data(value: str) -> str:
     """Rensa data från extra mellanslag och specialtecken."""
     if pd.isna(value):
@@ -198,258 +295,2579 @@ def find_duplicates(df: pd.DataFrame, column: str) -> pd.DataFrame:
     duplicates = df[df.duplicated(subset=[column], keep=False)]
     return duplicates.sort_values(by=column)
 
-def show_instructions():
-    """Visa instruktioner på startsidan."""
-    st.title("🔌 RFID CSV Konverterare")
-    st.markdown(f"<h3 style='color: {CHARGENODE_GREEN};'>ChargeNode - RFID Data Formatting Tool</h3>", 
-                unsafe_allow_html=True)
-    
-    st.markdown("---")
-    
-    col1, col2 = st.columns([2, 1])
-    
-    with col1:
-        st.markdown("""
-        ### 📋 Om programmet
-        
-        Detta verktyg hjälper dig att konvertera Excel-filer med RFID-data till standardiserat 
-        CSV-format för ChargeNodes laddstolpar.
-        
-        ### ⚙️ Funktioner
-        
-        - ✅ Konvertera RFID-data från olika Excel-format
-        - ✅ Hantera både HEX-nummer och TAGG ID
-        - ✅ Validera och rensa data automatiskt
-        - ✅ Dela upp per företag (om flera finns)
-        - ✅ Detektera och rapportera fel
-        
-        ### 📊 Stödda format
-        
-        **Indatafiler:**
-        - Excel (.xlsx) med en eller flera flikar
-        - RFID-nummer (HEX) eller TAGG ID
-        - Regnummer/Referens (Identifieringsnummer)
-        - Företagsnamn (valfritt)
+def file_hash(data: bytes) -> str:
+    """Beräkna SHA-256 för filinnehåll."""
+    return hashlib.sha256(data).hexdigest()
+
+def normalize_tagg_series(values: pd.Series) -> pd.Series:
+    """Normalisera TAGG ID för matchning (trimma och versaler, tomma blir '')."""
+    normalized = pd.Series('', index=values.index, dtype=object)
+    present = values.notna()
+    normalized[present] = values[present].astype(str).str.strip().str.upper().astype(object)
+    return normalized
+
+# Kolumnerna i MER-filen (de enda som läses)
+MER_COLUMNS = ['Visible Number', 'Key/Card number']
+
+# Förslag för TAGG ID som saknas i MER-filen
+SUGGEST_GRAM = 4              # n-gram-längd i förslagsindexet
+SUGGEST_MAX_POSTINGS = 2000   # n-gram i fler MER-ID än så (t.ex. 'SEME') säger inget och hoppas över
+SUGGEST_CANDIDATES = 5        # kandidater per ID som avståndsberäknas
+SUGGEST_MAX_DISTANCE = 3      # största redigeringsavstånd för ett förslag
+SUGGEST_REASON_FORMAT = 'Samma ID med annan formatering'
+SUGGEST_REASON_SUFFIX = 'Kontrollsuffix saknas'
+SUGGEST_REASON_SIMILAR = 'Liknande ID'
+SUGGESTION_COLUMNS = ['TAGG ID', 'Förslag', 'Avstånd', 'Orsak']
+SUGGEST_UI_ROWS = 25          # TAGG ID med egen acceptera-knapp i valideringssteget
+
+def canonical_tagg(values: pd.Series) -> pd.Series:
+    """Jämförelseform för TAGG ID: versaler utan blanksteg och bindestreck, O ersatt med 0."""
+    return (values.astype(str).str.upper()
+            .str.replace(r'[\s\-_.]', '', regex=True)
+            .str.replace('O', '0', regex=False))
+
+def _code_points(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Strängar som matris av Unicode-kodpunkter (nollutfyllda) plus längd per sträng."""
+    fixed = np.asarray(values, dtype=str)
+    width = max(fixed.dtype.itemsize // 4, 1)
+    return fixed.astype(f'U{width}').view(np.uint32).reshape(len(fixed), width), np.char.str_len(fixed)
+
+def edit_distances(left, right) -> np.ndarray:
+    """
+    Levenshtein-avstånd parvis för två lika långa strängsekvenser. Dynamisk
+    programmering över alla par samtidigt: en numpy-operation per teckenposition.
+    """
+    a, len_a = _code_points(left)
+    b, len_b = _code_points(right)
+    rows = np.arange(len(a))
+    previous = np.tile(np.arange(b.shape[1] + 1), (len(a), 1))
+    distances = len_b.copy()
+    for i in range(1, a.shape[1] + 1):
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        for j in range(1, b.shape[1] + 1):
+            current[:, j] = np.minimum(np.minimum(previous[:, j], current[:, j - 1]) + 1,
+                                       previous[:, j - 1] + (a[:, i - 1] != b[:, j - 1]))
+        done = len_a == i
+        distances[done] = current[rows[done], len_b[done]]
+        previous = current
+    return distances
+
+def _ngrams(canonical: pd.Series) -> Tuple[pd.Series, np.ndarray]:
+    """Alla n-gram per värde (vektoriserat per position). Returnerar (n-gram, radnummer)."""
+    lengths = canonical.str.len().to_numpy()
+    grams, owners = [], []
+    for pos in range(max(int(lengths.max(initial=0)) - SUGGEST_GRAM + 1, 0)):
+        rows = np.flatnonzero(lengths >= pos + SUGGEST_GRAM)
+        grams.append(canonical.iloc[rows].str.slice(pos, pos + SUGGEST_GRAM))
+        owners.append(rows)
+    if not grams:
+        return pd.Series([], dtype=object), np.zeros(0, dtype=np.int64)
+    return pd.concat(grams, ignore_index=True), np.concatenate(owners)
+
+def _sorted_unique(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Unika heltal med antal, via sortering (snabbare än np.unique för miljontals int64)."""
+    values = np.sort(values)
+    starts = np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]))
+    return values[starts], np.diff(np.append(starts, len(values)))
+
+class TaggSuggester:
+    """
+    Index över MER-ID för förslag till TAGG ID utan exakt träff.
+    Formateringsfel (blanksteg, bindestreck, O/0) och saknat kontrollsuffix
+    hittas med uppslag i hashtabeller. Övriga slås upp i ett inverterat
+    n-gram-index och bara de bästa kandidaterna avståndsberäknas - ingen
+    jämförelse mot hela MER-filen.
+    """
+
+    def __init__(self, keys):
+        self.keys = np.asarray(keys, dtype=object)
+        canonical = canonical_tagg(pd.Series(self.keys, dtype=object))
+        self._canonical = canonical.to_numpy(dtype=object)
+        positions = np.arange(len(canonical))
+        self._by_canonical = pd.Series(positions, index=canonical.to_numpy()).groupby(level=0).first()
+        # MER-ID som slutar med en kontrollbokstav (t.ex. ...-F) indexeras även utan den
+        suffixed = canonical.str.contains(r'\d[A-Z]$', regex=True).to_numpy()
+        self._by_base = pd.Series(
+            positions[suffixed], index=canonical[suffixed].str.slice(0, -1).to_numpy()
+        ).groupby(level=0).first()
         
-        **Utdataformat:**
-        ```
-        RFID;Identifieringsnummer
-        1A2B3C4D;ABC123
-        5E6F7890;XYZ789
-        ```
-        """)
-    
-    with col2:
-        st.info("""
-        **💡 Tips**
+        grams, owners = _ngrams(canonical)
+        codes, uniques = pd.factorize(grams)
+        # Ett MER-ID per n-gram räcker även om n-grammet förekommer flera gånger i ID:t
+        width = max(len(self.keys), 1)
+        pairs, _ = _sorted_unique(codes.astype(np.int64) * width + owners)
+        codes, owners = pairs // width, pairs % width
+        self._gram_index = pd.Index(uniques)
+        self._postings = owners
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(uniques)))])
+
+    def _similar(self, canonical: pd.Series) -> pd.DataFrame:
+        """Kandidater via n-gram-indexet. Returnerar fråga (radnummer), MER-ID (position) och gemensamma n-gram."""
+        grams, queries = _ngrams(canonical)
+        codes = self._gram_index.get_indexer(grams)
+        known = codes >= 0
+        codes, queries = codes[known], queries[known]
+        sizes = self._offsets[codes + 1] - self._offsets[codes]
+        useful = sizes <= SUGGEST_MAX_POSTINGS
+        codes, queries, sizes = codes[useful], queries[useful], sizes[useful]
+        if sizes.sum() == 0:
+            return pd.DataFrame({'query': [], 'key': [], 'shared': []}, dtype=np.int64)
+        # Postningslistorna för alla n-gram hämtas i ett svep
+        starts = np.repeat(self._offsets[codes] - np.concatenate([[0], np.cumsum(sizes)[:-1]]), sizes)
+        keys = self._postings[starts + np.arange(sizes.sum())]
+        pairs, shared = _sorted_unique(np.repeat(queries, sizes).astype(np.int64) * len(self.keys) + keys)
+        candidates = pd.DataFrame({'query': pairs // len(self.keys), 'key': pairs % len(self.keys),
+                                   'shared': shared})
+        candidates = candidates.sort_values(['query', 'shared'], ascending=[True, False], kind='stable')
+        return candidates.groupby('query', sort=False).head(SUGGEST_CANDIDATES)
+
+    def suggest(self, tagg_ids: pd.Series, limit: int = 3) -> pd.DataFrame:
+        """
+        Förslag för normaliserade TAGG ID, bästa först (högst limit per ID).
+        Returnerar TAGG ID, Förslag, Avstånd och Orsak.
+        """
+        queries = pd.Series(pd.unique(tagg_ids.dropna()), dtype=object)
+        if len(queries) == 0 or len(self.keys) == 0:
+            return pd.DataFrame(columns=SUGGESTION_COLUMNS)
+        canonical = canonical_tagg(queries)
+        found = []
         
-        1. Förbered din Excel-fil
-        2. Se till att data är i rätt kolumner
-        3. Kontrollera företagsnamn om det finns flera
-        4. Följ stegen i sidomenyn
-        """)
+        for lookup, reason in [(self._by_canonical, SUGGEST_REASON_FORMAT), (self._by_base, SUGGEST_REASON_SUFFIX)]:
+            hits = lookup.reindex(canonical.to_numpy())
+            matched = np.flatnonzero(hits.notna().to_numpy())
+            found.append(pd.DataFrame({'query': matched, 'key': hits.iloc[matched].to_numpy(dtype=np.int64),
+                                       'reason': reason, 'priority': len(found)}))
         
-        st.success("""
-        **📥 CSV-format**
+        rest = np.setdiff1d(np.arange(len(queries)), np.concatenate([frame['query'] for frame in found]))
+        similar = self._similar(canonical.iloc[rest].reset_index(drop=True))
+        similar['query'] = rest[similar['query'].to_numpy()]
+        found.append(similar.drop(columns='shared').assign(reason=SUGGEST_REASON_SIMILAR, priority=len(found)))
         
-        - Semikolon (;) som separator
-        - UTF-8 encoding
-        - Två kolumner: RFID & Identifieringsnummer
+        suggestions = pd.concat(found, ignore_index=True).drop_duplicates(['query', 'key'])
+        suggestions['distance'] = edit_distances(canonical.to_numpy(dtype=object)[suggestions['query'].to_numpy()],
+                                                 self._canonical[suggestions['key'].to_numpy()])
+        suggestions = suggestions[(suggestions['distance'] <= SUGGEST_MAX_DISTANCE)
+                                  | (suggestions['reason'] != SUGGEST_REASON_SIMILAR)]
+        suggestions = suggestions.sort_values(['query', 'priority', 'distance'], kind='stable')
+        suggestions = suggestions.groupby('query', sort=False).head(limit)
+        return pd.DataFrame({
+            'TAGG ID': queries.to_numpy()[suggestions['query'].to_numpy()],
+            'Förslag': self.keys[suggestions['key'].to_numpy()],
+            'Avstånd': suggestions['distance'].to_numpy(),
+            'Orsak': suggestions['reason'].to_numpy(),
+        })
+
+# Beständigt MER-index
+MER_KEEP_SOURCES = 10      # MER-filer som sparas i indexet (de äldsta tas bort)
+MER_TABLES_CACHED = 4      # uppslagstabeller som hålls i minnet per process
+MER_PIN_SECONDS = 24 * 3600      # en fastlåst MER-fil rensas inte förrän låset är så här gammalt
+MER_PIN_REFRESH_SECONDS = 3600   # hur ofta långlivade processer förnyar sitt lås
+MER_CONFLICT_COLUMNS = ['TAGG ID', 'Befintligt RFID', 'Nytt RFID', 'Källa']
+
+class MerTable:
+    """
+    Uppslagstabell (TAGG ID → RFID) för en MER-fil. Ändras aldrig - en ny
+    fil ger en ny tabell. Accepterade förslag (alias: TAGG ID → MER-ID)
+    läggs ovanpå med with_aliases och gäller bara den som har tabellen.
+    """
+
+    def __init__(self, mapping: pd.Series, source: str, path: Optional[str] = None,
+                 aliases: Optional[Dict[str, str]] = None):
+        self.mapping = mapping
+        self.source = source
+        self.path = path
+        self.aliases = {tagg: key for tagg, key in (aliases or {}).items() if key in mapping.index}
+        self._base = None
+        self._suggester = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Förslagsindexet byggs om vid behov i processen som tar emot tabellen
+        return {'mapping': self.mapping, 'source': self.source, 'path': self.path, 'aliases': self.aliases}
+
+    def __setstate__(self, state):
+        self.__init__(state['mapping'], state['source'], state['path'], state['aliases'])
+
+    def __len__(self) -> int:
+        return len(self.mapping)
+
+    @property
+    def key(self) -> Tuple:
+        """Identitet för memoiserade resultat: MER-filens hash och accepterade alias."""
+        return (self.source, tuple(sorted(self.aliases.items())))
+
+    @property
+    def ref(self) -> Optional[Tuple[str, str, Dict[str, str]]]:
+        """Liten referens (index, hash, alias) för processpooler. None för tabeller som bara finns i minnet."""
+        if not self.path or self.path == ':memory:':
+            return None
+        return (self.path, self.source, self.aliases)
+
+    def with_aliases(self, aliases: Dict[str, str]) -> 'MerTable':
+        """Ny tabell med alias ovanpå (delar mappning och förslagsindex med den här)."""
+        table = MerTable(self.mapping, self.source, self.path, {**self.aliases, **aliases})
+        table._base = self._base or self
+        return table
+
+    def lookup(self, normalized_tagg: pd.Series) -> pd.Series:
+        """Slå upp en hel kolumn med normaliserade TAGG ID. Saknade blir NaN."""
+        rfid = normalized_tagg.map(self.mapping)
+        if self.aliases:
+            aliases = pd.Series({tagg: self.mapping[key] for tagg, key in self.aliases.items()}, dtype=object)
+            rfid = rfid.fillna(normalized_tagg.map(aliases))
+        return rfid
+
+    def suggest(self, normalized_tagg: pd.Series, limit: int = 3) -> pd.DataFrame:
+        """Förslag på MER-ID för TAGG ID utan träff (se TaggSuggester). Indexet byggs vid behov."""
+        owner = self._base or self
+        with owner._lock:
+            if owner._suggester is None:
+                owner._suggester = TaggSuggester(owner.mapping.index)
+            suggester = owner._suggester
+        return suggester.suggest(normalized_tagg, limit)
+
+class MerIndex:
+    """
+    Beständigt MER-index i SQLite. Varje MER-fil sparas för sig (nyckel =
+    innehållets SHA-256) och slås upp som en egen MerTable, så en körning
+    matchar bara mot sin egen MER-fil. En fil som redan finns läses inte in
+    igen; de senaste MER_KEEP_SOURCES filerna sparas. Filer som en process har
+    låst med pin (t.ex. watch --mer eller serve --mer) rensas inte så länge låset förnyas.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        if self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mer_entries'"
+        ).fetchone():
+            # Tidigare format (ett gemensamt index utan filgränser) - filerna läses in igen vid nästa uppladdning
+            self._conn.executescript("DROP TABLE mer_entries; DROP TABLE IF EXISTS mer_sources;")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mer_pairs (
+                source TEXT NOT NULL,
+                tagg TEXT NOT NULL,
+                rfid TEXT NOT NULL,
+                PRIMARY KEY (source, tagg)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS mer_sources (
+                hash TEXT PRIMARY KEY,
+                name TEXT,
+                rows INTEGER,
+                loaded_at TEXT,
+                seq INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS mer_pins (
+                owner TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                seen REAL NOT NULL
+            );
         """)
+        self._tables = OrderedDict()
 
-def main():
-    # Ladda custom CSS
-    load_custom_css()
-    
-    # Sidebar navigation
-    st.sidebar.markdown(f"""
-        <div style='padding: 1rem 0; text-align: center; border-bottom: 2px solid {CHARGENODE_GREEN};'>
-            <h2 style='color: {CHARGENODE_GREEN}; margin: 0;'>ChargeNode</h2>
-            <p style='color: {CHARGENODE_DARK}; margin: 0; font-size: 0.9rem;'>RFID CSV Konverterare</p>
-        </div>
-    """, unsafe_allow_html=True)
-    st.sidebar.markdown("")
-    
-    # Session state initiering
-    if 'step' not in st.session_state:
-        st.session_state.step = 'instructions'
-    if 'df_main' not in st.session_state:
-        st.session_state.df_main = None
-    if 'df_mer' not in st.session_state:
-        st.session_state.df_mer = None
-    if 'column_mapping' not in st.session_state:
-        st.session_state.column_mapping = {}
-    
-    # Navigation
-    menu_options = {
-        '📋 Instruktioner': 'instructions',
-        '📤 Ladda upp fil': 'upload',
-        '🗺️ Kolumnmappning': 'mapping',
-        '✅ Validering': 'validation',
-        '📥 Resultat': 'result'
-    }
-    
-    st.sidebar.markdown("### Navigation")
-    selected = st.sidebar.radio(
-        "Välj steg:",
-        list(menu_options.keys()),
-        index=list(menu_options.values()).index(st.session_state.step),
-        label_visibility="collapsed"
-    )
-    st.session_state.step = menu_options[selected]
-    
-    # Visa rätt steg
-    if st.session_state.step == 'instructions':
-        show_instructions()
-    elif st.session_state.step == 'upload':
-        upload_step()
-    elif st.session_state.step == 'mapping':
-        mapping_step()
-    elif st.session_state.step == 'validation':
-        validation_step()
-    elif st.session_state.step == 'result':
-        result_step()
+    def has_source(self, source_hash: str) -> bool:
+        """Kontrollera om en MER-fil (per innehållshash) redan finns i indexet."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM mer_sources WHERE hash = ?", (source_hash,)
+            ).fetchone()
+        return row is not None
 
-def upload_step():
-    st.title("📤 Ladda upp fil")
-    
-    st.markdown("""
-    Ladda upp din Excel-fil (.xlsx) som innehåller RFID-data.
-    """)
-    
-    uploaded_file = st.file_uploader(
-        "Välj Excel-fil",
-        type=['xlsx'],
-        help="Endast .xlsx format stöds"
-    )
-    
-    if uploaded_file is not None:
-        try:
-            # Läs Excel-fil
-            xls = pd.ExcelFile(uploaded_file)
-            
-            st.success(f"✅ Fil uppladdad: {uploaded_file.name}")
-            
-            # Visa tillgängliga flikar
-            st.markdown("### 📑 Tillgängliga flikar")
-            sheet_name = st.selectbox(
-                "Välj flik att processera",
-                xls.sheet_names
+    def latest_source(self) -> Optional[str]:
+        """Hash för den senast inlästa MER-filen (jämförelsegrund för motstridiga mappningar)."""
+        with self._lock:
+            row = self._conn.execute("SELECT hash FROM mer_sources ORDER BY seq DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def pin(self, source_hash: str, owner: str) -> None:
+        """Lås (eller förnya låset på) en MER-fil för en process. En ägare har en fil åt gången."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO mer_pins (owner, source, seen) VALUES (?, ?, ?)",
+                               (owner, source_hash, time.time()))
+
+    def unpin(self, owner: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM mer_pins WHERE owner = ?", (owner,))
+
+    def ingest(self, df_mer: pd.DataFrame, source_hash: str, name: str = '') -> pd.DataFrame:
+        """
+        Lägg in en MER-fil i indexet som den senaste filen (finns den redan skrivs inget om).
+        Returnerar en DataFrame med motstridiga mappningar: ett TAGG ID med flera RFID
+        i filen, eller ett annat RFID än i den tidigare senaste filen.
+        """
+        pairs = pd.DataFrame({
+            'tagg': normalize_tagg_series(df_mer['Visible Number']),
+            'rfid': normalize_tagg_series(df_mer['Key/Card number']),
+        })
+        pairs = pairs[(pairs['tagg'] != '') & (pairs['rfid'] != '')]
+
+        conflicts = []
+
+        # Konflikter inom filen - senaste raden vinner (som tidigare dict-logik)
+        rfid_counts = pairs.groupby('tagg', sort=False)['rfid'].nunique()
+        in_file = rfid_counts[rfid_counts > 1].index
+        if len(in_file) > 0:
+            grouped = pairs[pairs['tagg'].isin(in_file)].groupby('tagg', sort=False)['rfid']
+            conflicts.append(pd.DataFrame({
+                'TAGG ID': grouped.last().index,
+                'Befintligt RFID': grouped.agg(
+                    lambda values: ', '.join(v for v in pd.unique(values) if v != values.iloc[-1])
+                ).values,
+                'Nytt RFID': grouped.last().values,
+                'Källa': 'Samma MER-fil'
+            }))
+
+        new_mapping = pairs.drop_duplicates(subset='tagg', keep='last').set_index('tagg')['rfid']
+        new_mapping = pd.Series(new_mapping.to_numpy(dtype=object),
+                                index=pd.Index(new_mapping.index.to_numpy(dtype=object), dtype=object),
+                                dtype=object)
+
+        with self._lock:
+            # Ändrade kort jämfört med föregående fil (informativt - varje fil slås upp för sig)
+            previous_source = self.latest_source()
+            previous = self.table(previous_source) if previous_source not in (None, source_hash) else None
+            if previous is not None:
+                existing = previous.mapping.reindex(new_mapping.index)
+                changed = existing.notna() & (existing != new_mapping)
+                if changed.any():
+                    conflicts.append(pd.DataFrame({
+                        'TAGG ID': new_mapping.index[changed],
+                        'Befintligt RFID': existing[changed].values,
+                        'Nytt RFID': new_mapping[changed].values,
+                        'Källa': 'Tidigare MER-fil'
+                    }))
+
+            now = datetime.now().isoformat(timespec='seconds')
+            with self._conn:
+                if not self.has_source(source_hash):
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO mer_pairs (source, tagg, rfid) VALUES (?, ?, ?)",
+                        ((source_hash, tagg, rfid) for tagg, rfid in new_mapping.items())
+                    )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO mer_sources (hash, name, rows, loaded_at, seq) "
+                    "VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM mer_sources))",
+                    (source_hash, name, len(df_mer), now)
+                )
+                self._prune()
+            self._cache(MerTable(new_mapping, source_hash, self.path))
+
+        if conflicts:
+            return pd.concat(conflicts, ignore_index=True)
+        return pd.DataFrame(columns=MER_CONFLICT_COLUMNS)
+
+    def table(self, source_hash: str) -> Optional[MerTable]:
+        """
+        Uppslagstabellen för en MER-fil. None om filen inte finns i indexet
+        (aldrig inläst eller borttagen som för gammal).
+        """
+        with self._lock:
+            if source_hash in self._tables:
+                self._tables.move_to_end(source_hash)
+                return self._tables[source_hash]
+            if not self.has_source(source_hash):
+                return None
+            rows = self._conn.execute(
+                "SELECT tagg, rfid FROM mer_pairs WHERE source = ?", (source_hash,)
+            ).fetchall()
+            mapping = pd.Series(
+                [rfid for _, rfid in rows],
+                index=pd.Index([tagg for tagg, _ in rows], dtype=object),
+                dtype=object
             )
-            
-            # Läs vald flik
-            df = pd.read_excel(uploaded_file, sheet_name=sheet_name)
-            
-            # Spara i session state
-            st.session_state.df_main = df
-            st.session_state.selected_sheet = sheet_name
-            
-            # Visa förhandsgranskning
-            st.markdown("### 👀 Förhandsgranskning")
-            st.info(f"**Antal rader:** {len(df)} | **Antal kolumner:** {len(df.columns)}")
-            st.dataframe(df.head(10), use_container_width=True)
-            
-            # Nästa-knapp
-            if st.button("➡️ Fortsätt till Kolumnmappning", type="primary"):
-                st.session_state.step = 'mapping'
-                st.rerun()
-                
-        except Exception as e:
-            st.error(f"❌ Fel vid uppladdning av fil: {str(e)}")
-    else:
-        st.info("👆 Vänligen ladda upp en Excel-fil för att fortsätta")
+            return self._cache(MerTable(mapping, source_hash, self.path))
 
-def auto_detect_columns(df: pd.DataFrame) -> Dict[str, str]:
-    """Försök automatiskt detektera vilka kolumner som innehåller vad."""
-    detected = {
-        'rfid': None,
-        'tagg_id': None,
-        'identifier': None,
-        'company': None
-    }
-    
-    # Trimma kolumnnamn (ta bort mellanslag i början/slut)
-    df.columns = df.columns.str.strip()
-    
-    for col in df.columns:
-        col_lower = col.lower()
-        
-        # Kolla första värdet som inte är NaN
-        sample_values = df[col].dropna().head(5)
-        
-        if len(sample_values) > 0:
-            first_val = str(sample_values.iloc[0])
-            
-            # Detektera TAGG ID
-            if is_tagg_id(first_val):
-                if 'rfid' in col_lower or 'tagg' in col_lower or 'visible' in col_lower:
-                    detected['tagg_id'] = col
-                    continue
-            
-            # Detektera HEX
-            is_hex, _ = validate_hex(first_val)
-            if is_hex and ('hex' in col_lower or 'rfid' in col_lower or 'card' in col_lower):
-                detected['rfid'] = col
-                continue
-        
-        # Detektera identifieringsnummer
-        if any(keyword in col_lower for keyword in ['reg', 'licens', 'plate', 'referens', 'identifiering']):
-            detected['identifier'] = col
-        
-        # Detektera företagsnamn
-        if any(keyword in col_lower for keyword in ['företag', 'company', 'customer', 'name', 'namn', 'anläggning']):
-            if detected['company'] is None:  # Ta första matchningen
-                detected['company'] = col
-    
-    return detected
+    def _cache(self, table: MerTable) -> MerTable:
+        self._tables[table.source] = table
+        self._tables.move_to_end(table.source)
+        while len(self._tables) > MER_TABLES_CACHED:
+            self._tables.popitem(last=False)
+        return table
 
-def mapping_step():
-    st.title("🗺️ Kolumnmappning")
-    
-    if st.session_state.df_main is None:
-        st.warning("⚠️ Ingen fil uppladdad. Vänligen gå tillbaka till 'Ladda upp fil'.")
-        return
-    
-    df = st.session_state.df_main
-    # Trimma kolumnnamn
-    df.columns = df.columns.str.strip()
-    st.session_state.df_main = df
-    
-    columns = [''] + list(df.columns)
-    
-    # Auto-detektera kolumner
-    if 'auto_detected' not in st.session_state:
-        st.session_state.auto_detected = auto_detect_columns(df)
-    
-    detected = st.session_state.auto_detected
-    
-    st.markdown("""
-    Ange vilka kolumner som innehåller respektive data.
-    """)
-    
-    # Visa auto-detekterade kolumner om några hittades
-    if any(detected.values()):
-        with st.expander("🤖 Auto-detekterade kolumner (klicka för att se)", expanded=False):
-            if detected['rfid']:
-                st.success(f"✅ HEX-nummer: **{detected['rfid']}**")
-            if detected['tagg_id']:
-                st.success(f"✅ TAGG ID: **{detected['tagg_id']}**")
-            if detected['identifier']:
-                st.success(f"✅ Identifieringsnummer: **{detected['identifier']}**")
-            if detected['company']:
-                st.info(f"ℹ️ Företagsnamn: **{detected['company']}**")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown("#### Obligatoriska fält")
-        
-        # RFID eller TAGG ID (måste välja ett)
-        # Försök auto-detektera vad filen innehåller
-        default_match_type = 0  # RFID/HEX
-        if detected['tagg_id'] and not detected['rfid']:
-            default_match_type = 1  # TAGG ID
-        
+    def _prune(self):
+        """
+        Ta bort de äldsta filerna utöver MER_KEEP_SOURCES (anropas i en transaktion).
+        Låsta filer rensas aldrig och räknas inte in; lås som inte förnyats tas bort först.
+        """
+        self._conn.execute("DELETE FROM mer_pins WHERE seen < ?", (time.time() - MER_PIN_SECONDS,))
+        old = [row[0] for row in self._conn.execute(
+            "SELECT hash FROM mer_sources WHERE hash NOT IN (SELECT source FROM mer_pins) "
+            "ORDER BY seq DESC LIMIT -1 OFFSET ?", (MER_KEEP_SOURCES,)
+        )]
+        for source_hash in old:
+            self._conn.execute("DELETE FROM mer_pairs WHERE source = ?", (source_hash,))
+            self._conn.execute("DELETE FROM mer_sources WHERE hash = ?", (source_hash,))
+
+@st.cache_resource
+def get_mer_index() -> MerIndex:
+    """Delat MER-index för hela servern (laddas en gång)."""
+    return MerIndex(os.path.join(DATA_DIR, 'mer_index.sqlite'))
+
+def session_mer_table() -> Optional[MerTable]:
+    """Sessionens MER-fil som uppslagstabell med förslag som accepterats i sessionen."""
+    mer_hash = st.session_state.get('mer_hash')
+    if not mer_hash:
+        return None
+    table = get_mer_index().table(mer_hash)
+    aliases = st.session_state.get('mer_aliases', {}).get(mer_hash)
+    if table is not None and aliases:
+        table = table.with_aliases(aliases)
+    return table
+
+class FrameCache:
+    """
+    Trådsäker LRU-cache med budget i byte.
+    Används för inlästa flikar, nyckel = (SHA-256 av filen, flik[, kolumner eller 'preview']).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        """Hämta ett värde (None om det saknas) och markera det som senast använt."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes: int):
+        """Lägg till ett värde och kasta äldsta poster tills budgeten håller."""
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._size += nbytes
+            while self._size > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._size -= evicted_bytes
+
+@st.cache_resource
+def get_parse_cache() -> FrameCache:
+    """Delad cache för inlästa Excel-flikar (över alla sessioner)."""
+    return FrameCache(PARSE_CACHE_MB * 1024 * 1024)
+
+# En sessions referens till en MER-fil räknas som släppt om sessionen inte använt den på så här länge
+# (Streamlit meddelar inte när en session stängs)
+MER_CACHE_LEASE_SECONDS = 3600
+
+class MerCacheEntry(NamedTuple):
+    """En inläst MER-fil: kolumnerna, förhandsgranskning och motstridiga mappningar från inläsningen."""
+    hash: str
+    name: str
+    frame: pd.DataFrame
+    preview: pd.DataFrame
+    conflicts: pd.DataFrame
+    parser: str
+    parse_seconds: float
+    nbytes: int
+
+class MerCache:
+    """
+    Innehållsadresserad cache (SHA-256) för inlästa MER-filer, delad av alla sessioner.
+    En session som laddar upp en byte-identisk fil kopplas direkt till posten
+    i stället för att läsa in filen igen. Sessioner håller en referens till sin
+    MER-fil; bara poster utan referenser kastas (minst nyligen använd först)
+    när budgeten överskrids.
+    """
+
+    def __init__(self, max_bytes: int, lease_seconds: float = MER_CACHE_LEASE_SECONDS):
+        self.max_bytes = max_bytes
+        self.lease_seconds = lease_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._refs = {}   # hash → {session: senast använd}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def attach(self, key: str, owner: str) -> Optional[MerCacheEntry]:
+        """Koppla sessionen till en inläst fil. None om filen inte finns i cachen."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            self._reference(key, owner)
+            return entry
+
+    def put(self, entry: MerCacheEntry, owner: str) -> MerCacheEntry:
+        """Lägg till en nyinläst fil med sessionen som första referens."""
+        with self._lock:
+            if entry.hash in self._entries:
+                self._size -= self._entries.pop(entry.hash).nbytes
+            self._entries[entry.hash] = entry
+            self._size += entry.nbytes
+            self._reference(entry.hash, owner)
+            self._evict()
+        return entry
+
+    def release(self, owner: str):
+        """Sessionen använder inte längre någon MER-fil."""
+        with self._lock:
+            self._release(owner)
+            self._evict()
+
+    def refcount(self, key: str) -> int:
+        with self._lock:
+            return self._live_refs(key)
+
+    def _reference(self, key: str, owner: str):
+        # En session har en MER-fil åt gången
+        self._release(owner, keep=key)
+        self._refs.setdefault(key, {})[owner] = time.time()
+
+    def _release(self, owner: str, keep: Optional[str] = None):
+        for key, refs in list(self._refs.items()):
+            if key != keep and refs.pop(owner, None) is not None and not refs:
+                del self._refs[key]
+
+    def _live_refs(self, key: str) -> int:
+        limit = time.time() - self.lease_seconds
+        return sum(1 for seen in self._refs.get(key, {}).values() if seen >= limit)
+
+    def _evict(self):
+        for key in list(self._entries):
+            if self._size <= self.max_bytes:
+                break
+            if self._live_refs(key) == 0:
+                self._size -= self._entries.pop(key).nbytes
+                self._refs.pop(key, None)
+
+@st.cache_resource
+def get_mer_cache() -> MerCache:
+    """Delad cache för inlästa MER-filer (över alla sessioner)."""
+    return MerCache(MER_CACHE_MB * 1024 * 1024)
+
+def _arrow_string_dtype():
+    """Arrow-baserad strängtyp med NaN som saknat värde (som object-kolumner), eller None."""
+    try:
+        import pyarrow  # noqa: F401 - följer med streamlit
+    except ImportError:
+        return None
+    try:
+        return pd.StringDtype('pyarrow', na_value=float('nan'))
+    except TypeError:  # pandas < 2.3
+        return pd.StringDtype('pyarrow_numpy')
+
+STRING_DTYPE = _arrow_string_dtype()
+
+def compact_strings(values: pd.Series) -> pd.Series:
+    """Lagra en ren textkolumn som Arrow-strängar i stället för Python-objekt."""
+    if STRING_DTYPE is None or values.dtype != object:
+        return values
+    if pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'empty'):
+        # Blandade typer (t.ex. tal och text) lämnas orörda
+        return values
+    return values.astype(STRING_DTYPE)
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Textkolumner som Arrow-strängar (kolumnerna byts ut, ingen kopia av övriga kolumner)."""
+    for pos in range(len(df.columns)):
+        column = df.iloc[:, pos]
+        compacted = compact_strings(column)
+        if compacted is not column:
+            df.isetitem(pos, compacted)
+    return df
+
+def compact_result(df_filtered: pd.DataFrame) -> pd.DataFrame:
+    """Resultatkolumnerna i kompakt form: text som Arrow-strängar och Företag som kategori."""
+    for column in ['RFID_CLEAN', 'Identifieringsnummer']:
+        df_filtered[column] = compact_strings(df_filtered[column])
+    if df_filtered['Företag'].dtype != 'category':
+        df_filtered['Företag'] = df_filtered['Företag'].astype('category')
+    return df_filtered
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    """Minnesanvändning för en DataFrame i byte."""
+    return int(df.memory_usage(deep=True).sum())
+
+def excel_sheet_names(data: bytes, data_hash: str) -> Tuple[List[str], bool]:
+    """
+    Hämta fliknamn för en Excel-fil via parse-cachen.
+    Returnerar (fliknamn, cache_träff)
+    """
+    cache = get_parse_cache()
+    key = (data_hash, None)
+    names = cache.get(key)
+    if names is not None:
+        return names, True
+    try:
+        names = pd.ExcelFile(io.BytesIO(data), engine=excel_engine()).sheet_names
+    except Exception:
+        names = pd.ExcelFile(io.BytesIO(data), engine='openpyxl').sheet_names
+    cache.put(key, names, sum(len(name) for name in names))
+    return names, False
+
+# Excel-motorer i prioritetsordning: calamine (Rust, paketet python-calamine) och openpyxl.
+# Kan låsas med miljövariabeln RFID_CONVERTER_EXCEL_ENGINE.
+EXCEL_ENGINES = {'calamine': 'python_calamine', 'openpyxl': 'openpyxl'}
+
+def excel_engine() -> str:
+    """Den Excel-motor som används: vald via miljövariabel, annars snabbaste installerade."""
+    forced = os.environ.get('RFID_CONVERTER_EXCEL_ENGINE')
+    if forced:
+        if forced not in EXCEL_ENGINES:
+            raise ValueError(f"Okänd Excel-motor: {forced} (stöds: {', '.join(EXCEL_ENGINES)})")
+        return forced
+    for engine, module in EXCEL_ENGINES.items():
+        if importlib.util.find_spec(module) is not None:
+            return engine
+    return 'openpyxl'
+
+def read_excel_frame(data: bytes, sheet_name=0, engine: Optional[str] = None, **options) -> pd.DataFrame:
+    """
+    Läs en Excel-flik med vald motor (options skickas till pd.read_excel).
+    Om calamine inte klarar filen används openpyxl. Motorn som faktiskt
+    användes sparas i df.attrs['parser'].
+    """
+    engine = engine or excel_engine()
+    try:
+        df = pd.read_excel(io.BytesIO(data), sheet_name=sheet_name, engine=engine, **options)
+    except Exception:
+        if engine == 'openpyxl':
+            raise
+        engine = 'openpyxl'
+        df = pd.read_excel(io.BytesIO(data), sheet_name=sheet_name, engine=engine, **options)
+    df.attrs['parser'] = engine
+    return df
+
+# Filformat som kan laddas upp (huvudfil och MER-fil)
+INPUT_TYPES = ['xlsx', 'csv', 'tsv', 'txt', 'parquet']
+
+# CSV, TSV och Parquet har bara en "flik"
+TABLE_SHEET = 'Data'
+
+# Teckenkodningar som provas i tur och ordning (utf-8-sig klarar UTF-8 med och utan BOM)
+CSV_ENCODINGS = ['utf-8-sig', 'cp1252', 'latin-1']
+CSV_DELIMITERS = ';,\t|'
+CSV_SNIFF_BYTES = 64 * 1024
+
+def input_kind(filename: str) -> str:
+    """Filformat utifrån filändelsen: 'excel', 'csv', 'tsv' eller 'parquet'."""
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    kinds = {'xlsx': 'excel', 'csv': 'csv', 'txt': 'csv', 'tsv': 'tsv', 'parquet': 'parquet', 'pq': 'parquet'}
+    if extension not in kinds:
+        raise ValueError(f"Filformatet .{extension} stöds inte (stöds: {', '.join(INPUT_TYPES)})")
+    return kinds[extension]
+
+def sniff_csv(data: bytes) -> Tuple[str, str]:
+    """
+    Gissa teckenkodning och avgränsare från början av en CSV-fil.
+    Returnerar (kodning, avgränsare)
+    """
+    sample = data[:CSV_SNIFF_BYTES]
+    for encoding in CSV_ENCODINGS:
+        try:
+            text = sample.decode(encoding)
+            break
+        except UnicodeDecodeError as e:
+            # Provet kan sluta mitt i ett flerbytestecken
+            if len(sample) == CSV_SNIFF_BYTES and e.start >= len(sample) - 3:
+                text = sample[:e.start].decode(encoding)
+                break
+    
+    lines = text.splitlines()[:50]
+    try:
+        delimiter = csv.Sniffer().sniff('\n'.join(lines), delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        # Välj det tecken som förekommer flest gånger i rubrikraden
+        header = lines[0] if lines else ''
+        delimiter = max(CSV_DELIMITERS, key=header.count) if header else ','
+    return encoding, delimiter
+
+def read_csv_bytes(data: bytes, delimiter: Optional[str] = None, **options) -> pd.DataFrame:
+    """
+    Läs CSV/TSV med gissad kodning och avgränsare. Alla kolumner läses som text
+    så att t.ex. inledande nollor i HEX-nummer behålls. Arrow-läsaren
+    (flertrådad) används när pyarrow finns och klarar options (t.ex. inte nrows).
+    """
+    encoding, sniffed = sniff_csv(data)
+    options.update({'sep': delimiter or sniffed, 'encoding': encoding, 'dtype': str})
+    try:
+        return pd.read_csv(io.BytesIO(data), engine='pyarrow', **options)
+    except (ImportError, ValueError):
+        # pyarrow saknas eller klarar inte filen (t.ex. ojämnt antal kolumner)
+        return pd.read_csv(io.BytesIO(data), **options)
+
+def read_input(data: bytes, kind: str, sheet_name: Optional[str] = None) -> pd.DataFrame:
+    """
+    Läs en uppladdad fil (Excel-flik, CSV, TSV eller Parquet) till en kompakt DataFrame.
+    Läsaren som användes sparas i df.attrs['parser'].
+    """
+    if kind == 'excel':
+        return compact_frame(read_excel_frame(data, sheet_name if sheet_name is not None else 0))
+    if kind == 'csv':
+        df = read_csv_bytes(data)
+    elif kind == 'tsv':
+        df = read_csv_bytes(data, '\t')
+    elif kind == 'parquet':
+        # pyarrow läser kolumnerna parallellt
+        df = pd.read_parquet(io.BytesIO(data))
+    else:
+        raise ValueError(f"Okänt filformat: {kind}")
+    df.attrs['parser'] = 'pyarrow' if STRING_DTYPE is not None else 'pandas'
+    return compact_frame(df)
+
+def input_sheet_names(data: bytes, data_hash: str, kind: str) -> Tuple[List[str], bool]:
+    """Fliknamn för en uppladdad fil (en enda för CSV och Parquet). Returnerar (fliknamn, cache_träff)"""
+    if kind == 'excel':
+        return excel_sheet_names(data, data_hash)
+    return [TABLE_SHEET], False
+
+def read_input_cached(data: bytes, data_hash: str, sheet_name: str, kind: str = 'excel',
+                      columns: Optional[List[str]] = None,
+                      cache: Optional[FrameCache] = None) -> Tuple[pd.DataFrame, bool]:
+    """
+    Läs en flik (eller hela CSV-/Parquet-filen) via parse-cachen. Med columns
+    läses bara de kolumnerna (se read_input_columns). Bakgrundsjobb skickar
+    med cachen eftersom de inte kan anropa Streamlit själva.
+    Returnerar (dataframe, cache_träff). Returnerad frame är en ytlig kopia
+    så att cachens objekt inte ändras av anroparen.
+    """
+    if cache is None:
+        cache = get_parse_cache()
+    key = (data_hash, sheet_name) if columns is None else (data_hash, sheet_name, tuple(columns))
+    df = cache.get(key)
+    hit = df is not None
+    if not hit:
+        df = read_input(data, kind, sheet_name) if columns is None else read_input_columns(data, kind, columns, sheet_name)
+        cache.put(key, df, frame_nbytes(df))
+    return df.copy(deep=False), hit
+
+# Antal rader som läses för förhandsgranskning och auto-detektering
+# (täcker urvalet i profile_columns)
+PREVIEW_ROWS = 2000
+
+# Blockstorlek vid strömmande inläsning av stora Excel-filer
+STREAM_CHUNK_ROWS = 50000
+
+# Samma strängar som pd.read_excel tolkar som saknade värden
+EXCEL_NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+    'n/a', 'nan', 'null'
+}
+
+# Arbetskolumner som resultatsteget behöver
+RESULT_COLUMNS = ['RFID_CLEAN', 'RFID_VALID', 'Identifieringsnummer', 'Företag']
+
+# Vid sammanslagning av flera flikar: källflik och Excel-radnummer per rad
+SHEET_COLUMN = 'Flik'
+SOURCE_ROW = '_Rad'
+
+def mapped_columns(mapping: Dict[str, str]) -> List[str]:
+    """Lista de källkolumner som används av mappningen (utan dubbletter)."""
+    columns = []
+    for key in ['rfid', 'tagg_id', 'identifier', 'company']:
+        col = mapping.get(key)
+        if col and col not in columns:
+            columns.append(col)
+    return columns
+
+def _excel_cell_value(value):
+    """Konvertera ett cellvärde på samma sätt som pd.read_excel (openpyxl)."""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in EXCEL_NA_VALUES:
+        return None
+    return value
+
+def _unique_header(header: tuple) -> List[str]:
+    """Kolumnnamn från rubrikraden, namngivna och avdubblade som i pandas."""
+    names = []
+    for idx, name in enumerate(header):
+        name = f'Unnamed: {idx}' if name is None else str(name).strip()
+        base, counter = name, 1
+        while name in names:
+            name = f'{base}.{counter}'
+            counter += 1
+        names.append(name)
+    return names
+
+def iter_excel_chunks(data: bytes, sheet_name: str, columns: Optional[List[str]] = None,
+                      chunk_size: int = STREAM_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Läs en Excel-flik strömmande (openpyxl read_only) i block om chunk_size rader.
+    Endast angivna kolumner behålls. Radindex motsvarar pd.read_excel så att
+    radnummer i felrapporter blir desamma.
+    """
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        yield from _iter_sheet_chunks(wb[sheet_name], columns, chunk_size)
+    finally:
+        wb.close()
+
+def _iter_sheet_chunks(ws, columns: Optional[List[str]], chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Blockläsningen i iter_excel_chunks för en redan öppnad flik."""
+    # read_only läser annars bara inom fliken <dimension>, som kan vara inaktuell
+    ws.reset_dimensions()
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    names = _unique_header(header)
+    if columns is None:
+        columns = names
+    missing = [col for col in columns if col not in names]
+    if missing:
+        raise ValueError(f"Kolumner saknas i fliken: {', '.join(missing)}")
+    positions = [names.index(col) for col in columns]
+    
+    buffer = []
+    start = 0
+    pending_blank = 0
+    for values in rows:
+        # Tomma rader i slutet av fliken tas bort, precis som i pd.read_excel
+        if all(value is None for value in values):
+            pending_blank += 1
+            continue
+        buffer.extend([[None] * len(positions)] * pending_blank)
+        pending_blank = 0
+        buffer.append([
+            _excel_cell_value(values[pos]) if pos < len(values) else None
+            for pos in positions
+        ])
+        while len(buffer) >= chunk_size:
+            block, buffer = buffer[:chunk_size], buffer[chunk_size:]
+            yield pd.DataFrame(block, columns=columns, dtype=object,
+                               index=pd.RangeIndex(start, start + len(block)))
+            start += len(block)
+    if buffer:
+        yield pd.DataFrame(buffer, columns=columns, dtype=object,
+                           index=pd.RangeIndex(start, start + len(buffer)))
+
+def read_excel_preview(data: bytes, sheet_name: str, nrows: int = PREVIEW_ROWS) -> Tuple[pd.DataFrame, Optional[int]]:
+    """
+    Läs bara de första nrows raderna av en Excel-flik.
+    Returnerar (förhandsgranskning, uppskattat antal datarader enligt fliken).
+    Antalet är None när fliken saknar storlek eller har en uppenbart inaktuell
+    (t.ex. 'A1:A1' från program som inte skriver <dimension>).
+    """
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name]
+        try:
+            dimension = ws.calculate_dimension()
+        except ValueError:
+            dimension = None
+        total_rows = ws.max_row - 1 if dimension and dimension != 'A1:A1' else None
+        preview = next(_iter_sheet_chunks(ws, None, nrows), None)
+    finally:
+        wb.close()
+    if preview is None:
+        preview = pd.DataFrame()
+    if total_rows is not None and total_rows < len(preview):
+        total_rows = None
+    return preview, total_rows
+
+def read_input_preview(data: bytes, kind: str, sheet_name: Optional[str] = None,
+                       nrows: int = PREVIEW_ROWS) -> pd.DataFrame:
+    """
+    Fas ett av inläsningen: rubrikraden och de första nrows raderna, för
+    förhandsgranskning, mappning och auto-detektering.
+    """
+    if kind == 'excel':
+        return compact_frame(read_excel_frame(data, sheet_name if sheet_name is not None else 0, nrows=nrows))
+    if kind in ('csv', 'tsv'):
+        # nrows stöds bara av pandas egen CSV-läsare
+        df = read_csv_bytes(data, '\t' if kind == 'tsv' else None, nrows=nrows)
+        df.attrs['parser'] = 'pandas'
+    elif kind == 'parquet':
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        batch = next(parquet.iter_batches(batch_size=max(nrows, 1)), None)
+        df = batch.to_pandas().head(nrows) if batch is not None else parquet.schema_arrow.empty_table().to_pandas()
+        df.attrs['parser'] = 'pyarrow'
+    else:
+        raise ValueError(f"Okänt filformat: {kind}")
+    return compact_frame(df)
+
+def input_row_count(data: bytes, kind: str, sheet_name: Optional[str] = None) -> Optional[int]:
+    """
+    Antal datarader (uppskattat för Excel enligt fliken, exakt för Parquet).
+    CSV har inget radantal i filen - där tolkas en kolumn, så att citerade fält
+    med radbrytningar och en sista rad utan radbrytning räknas rätt.
+    """
+    if kind == 'excel':
+        rows = excel_sheet_rows(data)
+        return rows.get(sheet_name) if sheet_name is not None else next(iter(rows.values()), None)
+    if kind in ('csv', 'tsv'):
+        delimiter = '\t' if kind == 'tsv' else None
+        header = read_csv_bytes(data, delimiter, nrows=0).columns
+        return len(read_csv_bytes(data, delimiter, usecols=[header[0]])) if len(header) else 0
+    if kind == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(io.BytesIO(data)).metadata.num_rows
+    return None
+
+def read_input_columns(data: bytes, kind: str, columns: List[str],
+                       sheet_name: Optional[str] = None) -> pd.DataFrame:
+    """
+    Fas två av inläsningen: läs bara kolumnerna i columns (trimmade namn), alla som text.
+    Radindex blir detsamma som i read_input. Kolumner som saknas i filen utelämnas -
+    anroparen kontrollerar. Kolumnnamnen i resultatet är trimmade.
+    """
+    wanted = set(columns)
+    if kind == 'excel':
+        df = read_excel_frame(data, sheet_name if sheet_name is not None else 0,
+                              usecols=lambda name: str(name).strip() in wanted, dtype=str)
+    else:
+        if kind in ('csv', 'tsv'):
+            delimiter = '\t' if kind == 'tsv' else None
+            header = read_csv_bytes(data, delimiter, nrows=0).columns
+        elif kind == 'parquet':
+            import pyarrow.parquet as pq
+            header = pq.read_schema(io.BytesIO(data)).names
+        else:
+            raise ValueError(f"Okänt filformat: {kind}")
+        # Arrow-läsarna tar kolumnlistor (inte funktioner) - använd namnen som de står i filen
+        usecols = [name for name in header if str(name).strip() in wanted]
+        if kind == 'parquet':
+            df = pd.read_parquet(io.BytesIO(data), columns=usecols)
+        elif usecols:
+            df = read_csv_bytes(data, delimiter, usecols=usecols)
+        else:
+            # En tom lista betyder alla kolumner för CSV-läsarna
+            df = pd.DataFrame()
+        df.attrs['parser'] = 'pyarrow' if STRING_DTYPE is not None else 'pandas'
+    df.columns = df.columns.str.strip()
+    return compact_frame(df)
+
+# Problemtyper i fel- och varningsrapporterna
+PROBLEM_UNMATCHED_TAGG = 'TAGG ID saknas i MER-fil'
+PROBLEM_INVALID_HEX = 'Ogiltigt HEX-format'
+PROBLEM_MISSING_ID = 'Identifieringsnummer saknas'
+PROBLEM_DUPLICATE = 'Duplicerat RFID'
+PROBLEM_DUPLICATE_CONFLICT = 'Duplicerat RFID med olika Identifieringsnummer'
+PROBLEM_SHEET_FAILED = 'Fliken kunde inte valideras'
+PROBLEM_REGISTRY_CONFLICT = 'RFID redan exporterat för annat företag'
+
+def clean_data_series(values: pd.Series) -> pd.Series:
+    """Vektoriserad motsvarighet till clean_data för en hel kolumn."""
+    cleaned = pd.Series('', index=values.index, dtype=object)
+    present = values.notna()
+    cleaned[present] = values[present].astype(str).str.strip().astype(object)
+    return cleaned
+
+def _with_default(values: pd.Series, default: str) -> pd.Series:
+    """Ersätt saknade värden med en standardtext."""
+    values = values.astype(object)
+    return values.where(values.notna(), default)
+
+def issue_frame(rows: pd.DataFrame, problem, **columns) -> pd.DataFrame:
+    """
+    Bygg diagnostikrader (fel eller varningar) i ett svep från de rader som
+    matchar problemet. problem kan vara en text eller en Series per rad.
+    Rad = Excel-radnummer (från SOURCE_ROW om raderna kommer från flera flikar).
+    """
+    row_numbers = rows[SOURCE_ROW] if SOURCE_ROW in rows.columns else rows.index + 2
+    frame = pd.DataFrame({'Rad': row_numbers, 'Problem': problem}, index=rows.index)
+    if SHEET_COLUMN in rows.columns:
+        frame.insert(0, SHEET_COLUMN, rows[SHEET_COLUMN])
+    for column, values in columns.items():
+        frame[column] = values
+    return frame.reset_index(drop=True)
+
+def concat_issues(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Slå ihop diagnostikrader till en kolumnär tabell."""
+    frames = [frame for frame in frames if len(frame) > 0]
+    if not frames:
+        return pd.DataFrame(columns=['Rad', 'Problem'])
+    return pd.concat(frames, ignore_index=True)
+
+def issue_counts(issues: pd.DataFrame) -> Dict[str, int]:
+    """Antal rader per problemtyp."""
+    if len(issues) == 0:
+        return {}
+    return {problem: int(count) for problem, count in issues['Problem'].value_counts().items()}
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_memory_mb() -> Optional[float]:
+    """Processens högsta minnesanvändning (RSS) hittills i MB, om plattformen stöder det."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss är i byte på macOS och i kB på Linux
+    return round(peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024, 1)
+
+class RunMetrics:
+    """
+    Instrumentering av en körning: väggtid, antal rader och minnestopp per steg.
+    Minnestoppen är processens högsta RSS när steget är klart (billigt att mäta,
+    och ett steg som höjer toppen syns direkt).
+    on_progress anropas med (rader klara, rader totalt) när arbete blir klart,
+    så att förloppet speglar verkligt arbete i stället för fasta procentsatser.
+    """
+
+    def __init__(self, run: str, total_rows: int = 0,
+                 on_progress: Optional[Callable[[int, int], None]] = None):
+        self.run = run
+        self.total_rows = total_rows
+        self.rows_done = 0
+        self.stages = []
+        self.started = datetime.now()
+        self._on_progress = on_progress
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0):
+        """Mät ett steg. Antal rader kan sättas i den returnerade posten under steget."""
+        record = {'stage': name, 'rows': rows, 'seconds': 0.0, 'peak_mb': None}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            record['peak_mb'] = peak_memory_mb()
+            self.stages.append(record)
+
+    def add(self, name: str, seconds: float, rows: int = 0, peak_mb: Optional[float] = None):
+        """Lägg till ett steg som mätts någon annanstans (t.ex. i en annan process)."""
+        self.stages.append({'stage': name, 'rows': rows, 'seconds': round(seconds, 4), 'peak_mb': peak_mb})
+
+    def advance(self, rows: int):
+        """Rapportera rader som är klara."""
+        self.rows_done += rows
+        if self._on_progress is not None:
+            self._on_progress(self.rows_done, self.total_rows)
+
+    def to_dict(self) -> Dict:
+        return {
+            'run': self.run,
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': round(time.perf_counter() - self._start, 4),
+            'rows': self.rows_done,
+            'stages': list(self.stages),
+        }
+
+    def log(self) -> Dict:
+        """Skriv mätvärdena som en JSON-rad till metrics-loggern. Returnerar dem."""
+        metrics = self.to_dict()
+        metrics_logger.info(json.dumps(metrics, ensure_ascii=False))
+        return metrics
+
+# Bakgrundsjobb
+JOB_QUEUED = 'Köad'
+JOB_RUNNING = 'Pågår'
+JOB_DONE = 'Klar'
+JOB_FAILED = 'Misslyckades'
+JOB_CANCELLED = 'Avbruten'
+JOB_POLL_SECONDS = 0.5       # hur ofta förloppet ritas om
+JOB_INLINE_SECONDS = 1.0     # korta jobb visas direkt utan förloppsvy
+JOB_KEEP_SECONDS = 3600      # färdiga jobb som ingen session hämtat rensas efter en timme
+
+class JobCancelled(Exception):
+    """Jobbet avbröts (kastas i jobbets tråd vid nästa förloppsrapport)."""
+
+class Job:
+    """
+    Ett bakgrundsjobb. func(job) körs i en arbetstråd och returnerar de
+    session state-värden som resultatet ska sparas som. Jobbet läser aldrig
+    session state själv - allt det behöver skickas med när det skapas.
+    """
+
+    def __init__(self, owner: str, kind: str, key, label: str, func: Callable[['Job'], Dict]):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.kind = kind
+        self.key = key
+        self.label = label
+        self.func = func
+        self.status = JOB_QUEUED
+        self.message = ''
+        self.rows_done = 0
+        self.total_rows = 0
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def progress(self) -> float:
+        if self.status == JOB_DONE:
+            return 1.0
+        return min(self.rows_done / self.total_rows, 1.0) if self.total_rows else 0.0
+
+    def report(self, rows_done: int, total_rows: int):
+        """Förloppsrapport (RunMetrics.on_progress). Avbryter jobbet om det har avbrutits."""
+        self.rows_done, self.total_rows = rows_done, total_rows
+        self.check()
+
+    def step(self, message: str):
+        """Sätt statustext för pågående steg."""
+        self.message = message
+        self.check()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+class JobManager:
+    """
+    Arbetspool för bakgrundsjobb, delad av alla sessioner på servern.
+    Köade jobb fördelas turvis mellan sessionerna (round-robin) och en session
+    får inte ta alla trådar, så en operatör med många stora jobb inte
+    svälter ut de andra. Nya jobb av samma slag i en session ersätter
+    (avbryter) sessionens tidigare jobb av det slaget.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = max(1, workers)
+        # Med flera trådar lämnas alltid minst en ledig för andra sessioner
+        self.max_running_per_owner = max(1, self.workers - 1)
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # ägare → kö av jobb (ordningen = turordningen)
+        self._running = {}            # ägare → antal pågående jobb
+        self._jobs = {}
+        self._threads = [threading.Thread(target=self._work, name=f'rfid-job-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, owner: str, kind: str, key, label: str, func: Callable[[Job], Dict]) -> Job:
+        job = Job(owner, kind, key, label, func)
+        with self._cond:
+            self._purge()
+            for other in self._jobs.values():
+                if other.owner == owner and other.kind == kind and not other.done:
+                    self._cancel(other)
+            self._jobs[job.id] = job
+            self._queues.setdefault(owner, deque()).append(job)
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def forget(self, job_id: str):
+        """Släpp ett färdigt jobb (resultatet har hämtats)."""
+        with self._cond:
+            self._jobs.pop(job_id, None)
+
+    def cancel(self, job_id: str):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.done:
+                self._cancel(job)
+
+    def queue_position(self, job: Job) -> int:
+        """Antal köade jobb före jobbet i turordningen (0 = nästa på tur)."""
+        with self._cond:
+            queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        for depth in range(max(map(len, queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    if queue[depth] is job:
+                        return position
+                    position += 1
+        return 0
+
+    def counts(self) -> Dict[str, int]:
+        with self._cond:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (JOB_QUEUED, JOB_RUNNING)}
+
+    def _cancel(self, job: Job):
+        job._cancel.set()
+        if job.status == JOB_QUEUED:
+            # Köade jobb tas bort direkt, pågående avbryts vid nästa förloppsrapport
+            self._queues[job.owner].remove(job)
+            self._finish(job, JOB_CANCELLED)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        job._done.set()
+
+    def _purge(self):
+        limit = time.time() - JOB_KEEP_SECONDS
+        for job_id in [job.id for job in self._jobs.values() if job.done and job.finished < limit]:
+            del self._jobs[job_id]
+        for owner in [owner for owner, queue in self._queues.items()
+                      if not queue and not self._running.get(owner)]:
+            del self._queues[owner]
+            self._running.pop(owner, None)
+
+    def _next(self) -> Optional[Job]:
+        """Nästa jobb: första sessionen i turordningen med köade jobb och ledig kvot."""
+        for owner, queue in self._queues.items():
+            if queue and self._running.get(owner, 0) < self.max_running_per_owner:
+                self._queues.move_to_end(owner)
+                return queue.popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next()
+                job.status = JOB_RUNNING
+                job.started = time.time()
+                self._running[job.owner] = self._running.get(job.owner, 0) + 1
+            status = JOB_DONE
+            try:
+                job.result = job.func(job)
+            except JobCancelled:
+                status = JOB_CANCELLED
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                status = JOB_FAILED
+            with self._cond:
+                self._running[job.owner] -= 1
+                if job.cancelled and status == JOB_DONE:
+                    status = JOB_CANCELLED
+                self._finish(job, status)
+                job.func = None
+                self._cond.notify_all()
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """Delad arbetspool för bakgrundsjobb (alla sessioner)."""
+    return JobManager(JOB_WORKERS)
+
+# Valideringens steg och deras beroenden (i beroendeordning).
+# Fält = kolumnmappningen steget läser, steg = tidigare steg vars resultat används.
+VALIDATION_STAGES = {
+    'RFID_RAW': {'fields': ['rfid', 'tagg_id'], 'stages': []},
+    'RFID_CLEAN': {'fields': [], 'stages': ['RFID_RAW']},
+    'Identifieringsnummer': {'fields': ['identifier'], 'stages': []},
+    'Företag': {'fields': ['company'], 'stages': []},
+    'duplicates': {'fields': [], 'stages': ['RFID_CLEAN', 'Identifieringsnummer']},
+}
+
+class ValidationPipeline:
+    """
+    Valideringen av en inläst flik som en beroendegraf av steg.
+    Varje steg cachas på sina indatakolumner och nycklarna för stegen det
+    bygger på. När mappningen ändras räknas bara de steg om som ligger
+    nedströms om den ändrade kolumnen - t.ex. bara Företag om företagskolumnen byts.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.computed = []
+        self._results = {}
+        # Ett avbrutet bakgrundsjobb kan fortfarande köra ett steg när nästa jobb startar
+        self._lock = threading.Lock()
+
+    def _key(self, stage: str, mapping: Dict[str, str], mer_table: Optional[MerTable]) -> Tuple:
+        spec = VALIDATION_STAGES[stage]
+        fields = tuple(mapping.get(field) for field in spec['fields'])
+        if stage == 'RFID_RAW' and not mapping.get('rfid') and mapping.get('tagg_id') and mer_table is not None:
+            # TAGG ID-uppslagningen beror även på MER-filen (och accepterade alias)
+            fields += mer_table.key
+        return (stage, fields, tuple(self._key(dep, mapping, mer_table) for dep in spec['stages']))
+
+    def _compute(self, stage: str, mapping: Dict[str, str], mer_table: Optional[MerTable]) -> Dict:
+        df = self.df
+        if stage == 'RFID_RAW':
+            # 2. Hantera RFID (antingen från RFID-kolumn eller via MER-index)
+            if mapping.get('rfid'):
+                return {'RFID_RAW': df[mapping['rfid']], 'unmatched': None}
+            if mer_table is None:
+                raise ValueError("MER-fil saknas men krävs för TAGG ID matchning")
+            # Matcha TAGG ID mot MER-filens tabell (normaliserat till uppercase)
+            raw = compact_strings(mer_table.lookup(normalize_tagg_series(df[mapping['tagg_id']])))
+            return {'RFID_RAW': raw, 'unmatched': raw.isna() & df[mapping['tagg_id']].notna()}
+        if stage == 'RFID_CLEAN':
+            # 3. Rensa och validera RFID (hela kolumnen på en gång)
+            raw = self._results['RFID_RAW'][1]['RFID_RAW']
+            clean, valid, _ = validate_hex_series(raw)
+            return {'RFID_CLEAN': compact_strings(clean), 'RFID_VALID': valid, 'invalid': raw.notna() & ~valid}
+        if stage == 'Identifieringsnummer':
+            # 4. Hantera Identifieringsnummer
+            return {'Identifieringsnummer': compact_strings(clean_data_series(df[mapping['identifier']]))}
+        if stage == 'Företag':
+            # 5. Hantera företagsnamn (kategori - få unika värden på många rader)
+            if mapping.get('company'):
+                company = clean_data_series(df[mapping['company']]).replace('', 'Utan_foretag')
+            else:
+                company = pd.Series('Alla', index=df.index, dtype=object)
+            return {'Företag': company.astype('category')}
+        if stage == 'duplicates':
+            # 7. Dubbletter bland rader som inte är tomma
+            frame = pd.DataFrame({
+                'RFID_CLEAN': self._results['RFID_CLEAN'][1]['RFID_CLEAN'],
+                'RFID_VALID': self._results['RFID_CLEAN'][1]['RFID_VALID'],
+                'Identifieringsnummer': self._results['Identifieringsnummer'][1]['Identifieringsnummer'],
+            })
+            summary, warnings = check_duplicates(non_empty_rows(frame))
+            return {'summary': summary, 'warnings': warnings}
+        raise KeyError(stage)
+
+    def _wanted(self, stages: Optional[List[str]]) -> List[str]:
+        """Begärda steg och deras beroenden, i beroendeordning."""
+        wanted = set(stages or VALIDATION_STAGES)
+        for stage in reversed(list(VALIDATION_STAGES)):
+            if stage in wanted:
+                wanted.update(VALIDATION_STAGES[stage]['stages'])
+        return [stage for stage in VALIDATION_STAGES if stage in wanted]
+
+    def pending(self, mapping: Dict[str, str], mer_table: Optional[MerTable] = None,
+                stages: Optional[List[str]] = None) -> List[str]:
+        """Steg som måste räknas om för mappningen (övriga återanvänds)."""
+        return [stage for stage in self._wanted(stages)
+                if self._results.get(stage, (None,))[0] != self._key(stage, mapping, mer_table)]
+
+    def run(self, mapping: Dict[str, str], mer_table: Optional[MerTable] = None,
+            stages: Optional[List[str]] = None, metrics: Optional[RunMetrics] = None) -> Dict[str, Dict]:
+        """
+        Kör de begärda stegen (standard: alla) med deras beroenden.
+        Steg vars nyckel inte ändrats återanvänds. Returnerar resultat per steg.
+        """
+        wanted = self._wanted(stages)
+        with self._lock:
+            self.computed = []
+            for stage in wanted:
+                key = self._key(stage, mapping, mer_table)
+                cached = self._results.get(stage)
+                if cached is None or cached[0] != key:
+                    if metrics is None:
+                        self._results[stage] = (key, self._compute(stage, mapping, mer_table))
+                    else:
+                        with metrics.stage(stage, rows=len(self.df)):
+                            self._results[stage] = (key, self._compute(stage, mapping, mer_table))
+                        metrics.advance(len(self.df))
+                    self.computed.append(stage)
+            return {stage: self._results[stage][1] for stage in wanted}
+
+def stage_columns(results: Dict[str, Dict]) -> Dict[str, pd.Series]:
+    """Resultatkolumnerna (RESULT_COLUMNS) från valideringsstegen."""
+    columns = {}
+    for stage in ['RFID_CLEAN', 'Identifieringsnummer', 'Företag']:
+        columns.update({name: values for name, values in results[stage].items() if name in RESULT_COLUMNS})
+    return columns
+
+def stage_issues(df: pd.DataFrame, mapping: Dict[str, str],
+                 results: Dict[str, Dict]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Fel och varningar från valideringsstegen (utan dubbletter). Returnerar (fel, varningar)."""
+    identifiers = df[mapping['identifier']]
+    rfid_raw = results['RFID_RAW']['RFID_RAW']
+    errors = []
+    
+    unmatched = results['RFID_RAW']['unmatched']
+    if unmatched is not None:
+        errors.append(issue_frame(
+            df[unmatched], PROBLEM_UNMATCHED_TAGG,
+            **{'TAGG ID': df.loc[unmatched, mapping['tagg_id']],
+               'Identifieringsnummer': _with_default(identifiers[unmatched], 'Saknas')}
+        ))
+    
+    invalid = results['RFID_CLEAN']['invalid']
+    errors.append(issue_frame(
+        df[invalid], PROBLEM_INVALID_HEX,
+        RFID=rfid_raw[invalid],
+        Identifieringsnummer=_with_default(identifiers[invalid], 'Saknas')
+    ))
+    
+    # Varna om Identifieringsnummer saknas
+    missing_id = results['Identifieringsnummer']['Identifieringsnummer'] == ''
+    if mapping.get('company'):
+        missing_company = _with_default(df.loc[missing_id, mapping['company']], 'N/A')
+    else:
+        missing_company = 'N/A'
+    missing_rfid = results['RFID_CLEAN']['RFID_CLEAN'][missing_id]
+    warnings = issue_frame(
+        df[missing_id], PROBLEM_MISSING_ID,
+        RFID=missing_rfid.where(missing_rfid != '', 'Saknas'),
+        Företag=missing_company
+    )
+    
+    return concat_issues(errors), concat_issues([warnings])
+
+def suggest_unmatched(errors: pd.DataFrame, mer_table: Optional[MerTable]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Förslag för TAGG ID som saknas i MER-filen. Felraderna får kolumnen Förslag
+    med det bästa förslaget. Returnerar (fel, alla förslag).
+    """
+    unmatched = (errors['Problem'] == PROBLEM_UNMATCHED_TAGG) if len(errors) > 0 else pd.Series(dtype=bool)
+    if mer_table is None or not unmatched.any():
+        return errors, pd.DataFrame(columns=SUGGESTION_COLUMNS)
+    normalized = normalize_tagg_series(errors.loc[unmatched, 'TAGG ID'])
+    suggestions = mer_table.suggest(normalized)
+    best = suggestions.drop_duplicates('TAGG ID').set_index('TAGG ID')['Förslag']
+    errors = errors.copy()
+    errors['Förslag'] = _with_default(normalized.map(best), 'Inget förslag')
+    return errors, suggestions
+
+def non_empty_rows(frame: pd.DataFrame) -> pd.DataFrame:
+    """6. Ta bort tomma rader (där både RFID och Identifieringsnummer saknas)."""
+    return frame[~((frame['RFID_CLEAN'] == '') & (frame['Identifieringsnummer'] == ''))]
+
+def validate_frame(df: pd.DataFrame, mapping: Dict[str, str], mer_table: Optional[MerTable] = None,
+                   metrics: Optional[RunMetrics] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Rensa och validera rader enligt kolumnmappningen (hela filen eller ett block).
+    df ändras inte. Dubblettkontroll görs separat med check_duplicates.
+    Returnerar (df_filtered, fel, varningar) där df_filtered bara har RESULT_COLUMNS
+    och fel och varningar är DataFrames.
+    """
+    results = ValidationPipeline(df).run(mapping, mer_table, ['RFID_CLEAN', 'Identifieringsnummer', 'Företag'],
+                                         metrics=metrics)
+    errors, warnings = stage_issues(df, mapping, results)
+    return non_empty_rows(pd.DataFrame(stage_columns(results))[RESULT_COLUMNS]), errors, warnings
+
+# Typ av dubblettgrupp
+DUPLICATE_REPEAT = 'Upprepning'
+DUPLICATE_CONFLICT = 'Konflikt'
+
+def _joined_unique(keys: pd.Series, values: pd.Series) -> pd.Series:
+    """Unika värden per nyckel i förekomstordning, kommaseparerade (index: nyckel)."""
+    pairs = pd.DataFrame({'key': keys, 'value': values}).drop_duplicates()
+    return pairs.groupby('key', sort=True)['value'].agg(', '.join)
+
+def check_duplicates(df_filtered: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Analysera duplicerade giltiga RFID i ett hash/groupby-pass.
+    Skiljer på upprepningar (samma RFID, samma identifieringsnummer) och
+    konflikter (samma RFID, olika identifieringsnummer).
+    Returnerar (en rad per dubblettgrupp, varningar per rad)
+    """
+    context = [col for col in [SOURCE_ROW, SHEET_COLUMN] if col in df_filtered.columns]
+    valid = df_filtered.loc[df_filtered['RFID_VALID'], ['RFID_CLEAN', 'Identifieringsnummer'] + context]
+    dup_rows = valid[valid['RFID_CLEAN'].duplicated(keep=False)].sort_values(by='RFID_CLEAN', kind='stable')
+    dup_rows = dup_rows.assign(Rad=dup_rows[SOURCE_ROW] if SOURCE_ROW in context else dup_rows.index + 2)
+    
+    grouped = dup_rows.groupby('RFID_CLEAN', sort=True)
+    group = grouped.ngroup().to_numpy()
+    summary = grouped.agg(**{
+        'Antal': ('Rad', 'size'),
+        'Första rad': ('Rad', 'first'),
+    })
+    different = grouped['Identifieringsnummer'].nunique().to_numpy()
+    ids = dup_rows['Identifieringsnummer'].fillna('').astype(str).replace('', 'Saknas')
+    summary['Identifieringsnummer'] = _joined_unique(dup_rows['RFID_CLEAN'], ids)
+    if SHEET_COLUMN in context:
+        summary['Flikar'] = _joined_unique(dup_rows['RFID_CLEAN'], dup_rows[SHEET_COLUMN])
+    summary['Typ'] = np.where(different > 1, DUPLICATE_CONFLICT, DUPLICATE_REPEAT)
+    summary = summary.rename_axis('RFID').reset_index()
+    summary.insert(0, 'Grupp', range(1, len(summary) + 1))
+    
+    # Varningar per rad - grupp och typ hämtas från samma gruppering
+    conflict = different[group] > 1
+    problem = pd.Series(PROBLEM_DUPLICATE, index=dup_rows.index, dtype=object)
+    problem[conflict] = PROBLEM_DUPLICATE_CONFLICT
+    warnings = issue_frame(
+        dup_rows, problem,
+        RFID=dup_rows['RFID_CLEAN'],
+        Identifieringsnummer=dup_rows['Identifieringsnummer'],
+        Grupp=group + 1
+    )
+    
+    return summary, concat_issues([warnings])
+
+# Uppskattat antal rader i största fliken för att validera flikar i separata processer
+PROCESS_POOL_SHEET_ROWS = 50000
+
+def excel_sheet_rows(data: bytes) -> Dict[str, int]:
+    """Uppskattat antal datarader per flik (från flikens dimension, utan att läsa data)."""
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        return {ws.title: max((ws.max_row or 1) - 1, 0) for ws in wb.worksheets}
+    finally:
+        wb.close()
+
+def _resolve_mer_table(mer) -> Optional[MerTable]:
+    """MER-tabell som objekt (trådar) eller referens (index, hash, alias) från MerTable.ref (processer)."""
+    if isinstance(mer, tuple):
+        return _worker_mer_table(*mer)
+    return mer
+
+def validate_sheet(data: bytes, sheet_name: str, mapping: Optional[Dict[str, str]],
+                   mer=None, per_sheet_detect: bool = False) -> Dict:
+    """
+    Läs och validera en flik. Körs i en tråd eller i en separat process.
+    Med per_sheet_detect auto-detekteras kolumnerna i fliken och den
+    gemensamma mappningen används om detekteringen inte är komplett.
+    """
+    result = {'sheet': sheet_name, 'mapping': mapping, 'rows': 0, 'message': None}
+    start = time.perf_counter()
+    try:
+        if per_sheet_detect:
+            preview = read_input_preview(data, 'excel', sheet_name)
+            preview.columns = preview.columns.str.strip()
+            detected = auto_detect_columns(preview)
+            if detected.get('rfid'):
+                detected['tagg_id'] = None
+            if not mapping_problems(detected):
+                mapping = detected
+        if mapping is None:
+            raise ValueError("Ingen kolumnmappning")
+        result['mapping'] = mapping
+        
+        # Bara de mappade kolumnerna läses
+        df = read_input_columns(data, 'excel', mapped_columns(mapping), sheet_name)
+        result['rows'] = len(df)
+        
+        problems = mapping_problems(mapping)
+        missing = [col for col in mapped_columns(mapping) if col not in df.columns]
+        if missing:
+            problems.append(f"Kolumner saknas i fliken: {', '.join(missing)}")
+        if problems:
+            raise ValueError('; '.join(problems))
+        
+        mer_table = _resolve_mer_table(mer) if mapping.get('tagg_id') else None
+        if mapping.get('tagg_id') and (mer_table is None or len(mer_table) == 0):
+            raise ValueError("MER-fil saknas men krävs för TAGG ID matchning")
+        
+        df_filtered, errors, warnings = validate_frame(df, mapping, mer_table)
+        result['df'] = df_filtered.assign(**{
+            SOURCE_ROW: df_filtered.index + 2,
+            SHEET_COLUMN: sheet_name,
+        })
+        for issues in (errors, warnings):
+            if len(issues) > 0:
+                issues.insert(0, SHEET_COLUMN, sheet_name)
+        result['errors'] = errors
+        result['warnings'] = warnings
+    except Exception as e:
+        result['message'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    result['peak_mb'] = peak_memory_mb()
+    return result
+
+def validate_workbook_sheets(data: bytes, sheet_names: List[str], mapping: Optional[Dict[str, str]],
+                             mer=None, per_sheet_detect: bool = False, parallel: bool = True,
+                             metrics: Optional[RunMetrics] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Validera flera flikar samtidigt och slå ihop resultatet med en källflikskolumn.
+    Stora flikar körs i en processpool (en MER-tabell skickas då som referens),
+    annars i trådar. Flikar som inte kan valideras blir fel. Dubbletter
+    kontrolleras av anroparen med check_duplicates över det sammanslagna resultatet.
+    Med metrics registreras tid och rader per flik när varje flik blir klar.
+    Returnerar (df_filtered, fel, varningar, översikt per flik)
+    """
+    sheet_rows = excel_sheet_rows(data)
+    if metrics is not None:
+        metrics.total_rows += sum(sheet_rows.get(name, 0) for name in sheet_names)
+    use_processes = (parallel and len(sheet_names) > 1
+                     and max(sheet_rows.get(name, 0) for name in sheet_names) > PROCESS_POOL_SHEET_ROWS)
+    if use_processes and isinstance(mer, MerTable) and mer.ref is not None:
+        mer = mer.ref
+    
+    workers = max(1, min(len(sheet_names), os.cpu_count() or 1)) if parallel else 1
+    executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor(max_workers=workers) as pool:
+        futures = {pool.submit(validate_sheet, data, name, mapping, mer, per_sheet_detect): name
+                   for name in sheet_names}
+        finished = {}
+        for future in as_completed(futures):
+            result = future.result()
+            finished[futures[future]] = result
+            if metrics is not None:
+                metrics.add(f"{SHEET_COLUMN} {result['sheet']}", result['seconds'],
+                            result['rows'], result['peak_mb'])
+                metrics.advance(sheet_rows.get(result['sheet'], result['rows']))
+    results = [finished[name] for name in sheet_names]
+    
+    done = [result for result in results if result['message'] is None]
+    if done:
+        df_filtered = compact_result(pd.concat([result['df'] for result in done], ignore_index=True))
+    else:
+        df_filtered = pd.DataFrame(columns=RESULT_COLUMNS + [SOURCE_ROW, SHEET_COLUMN]).astype({'RFID_VALID': bool})
+    
+    failed = pd.DataFrame([{SHEET_COLUMN: result['sheet'], 'Rad': None,
+                            'Problem': PROBLEM_SHEET_FAILED, 'Meddelande': result['message']}
+                           for result in results if result['message'] is not None])
+    errors = concat_issues([failed] + [result['errors'] for result in done])
+    warnings = concat_issues([result['warnings'] for result in done])
+    
+    overview = pd.DataFrame([{
+        SHEET_COLUMN: result['sheet'],
+        'Rader': result['rows'],
+        'Mappning': ', '.join(f"{key}={col}" for key, col in (result['mapping'] or {}).items() if col),
+        'Status': result['message'] or 'OK',
+    } for result in results])
+    return df_filtered, errors, warnings, overview
+
+def validate_excel_stream(data: bytes, sheet_name: str, mapping: Dict[str, str],
+                          mer_table: Optional[MerTable] = None,
+                          chunk_size: int = STREAM_CHUNK_ROWS,
+                          on_chunk: Optional[Callable[[int], None]] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Validera en Excel-flik blockvis utan att läsa in hela arbetsboken.
+    Endast de mappade kolumnerna läses och bara resultatkolumnerna behålls,
+    så minnet begränsas av blockstorleken. on_chunk anropas med antal lästa rader.
+    Returnerar (df_filtered, fel, varningar) som validate_frame.
+    """
+    parts = []
+    errors = []
+    warnings = []
+    rows_done = 0
+    
+    for chunk in iter_excel_chunks(data, sheet_name, mapped_columns(mapping), chunk_size):
+        filtered, chunk_errors, chunk_warnings = validate_frame(chunk, mapping, mer_table)
+        parts.append(filtered)
+        errors.append(chunk_errors)
+        warnings.append(chunk_warnings)
+        rows_done += len(chunk)
+        if on_chunk is not None:
+            on_chunk(rows_done)
+    
+    if not parts:
+        df_filtered = pd.DataFrame(columns=RESULT_COLUMNS).astype({'RFID_VALID': bool})
+    else:
+        # Blockens företagskategorier skiljer sig - slå ihop till en gemensam
+        df_filtered = compact_result(pd.concat(parts))
+    return df_filtered, concat_issues(errors), concat_issues(warnings)
+
+class CompanyCsv(NamedTuple):
+    """En genererad CSV-fil för ett företag."""
+    company: str
+    filename: str
+    data: bytes
+    rows: int
+
+def encode_company_csv(company_data: pd.DataFrame) -> bytes:
+    """Skriv RFID;Identifieringsnummer direkt till bytes (semikolon, UTF-8 BOM)."""
+    buffer = io.BytesIO()
+    company_data.to_csv(buffer, index=False, sep=';', encoding='utf-8-sig')
+    return buffer.getvalue()
+
+def company_frames(df_valid: pd.DataFrame) -> List[Tuple[str, str, pd.DataFrame]]:
+    """
+    Dela upp giltiga rader per företag i ett groupby-pass.
+    Returnerar [(företag, filnamn, RFID;Identifieringsnummer utan dubbletter)]
+    """
+    groups = []
+    for company, group in df_valid.groupby('Företag', sort=False, observed=True):
+        company_data = group[['RFID_CLEAN', 'Identifieringsnummer']]
+        company_data.columns = ['RFID', 'Identifieringsnummer']
+        
+        # Ta bort duplicat (behåll första)
+        company_data = company_data.drop_duplicates(subset=['RFID'], keep='first')
+        
+        # Generera filnamn
+        if company == 'Alla':
+            filename = "output.csv"
+        else:
+            filename = f"{sanitize_filename(company)}.csv"
+        
+        groups.append((company, filename, company_data))
+    return groups
+
+def build_company_csvs(df_valid: pd.DataFrame) -> Dict[str, CompanyCsv]:
+    """
+    Skapa en CSV-fil per företag från giltiga rader.
+    Kodningen sker parallellt i trådar. Returnerar {filnamn: CompanyCsv}
+    """
+    groups = company_frames(df_valid)
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+        encoded = pool.map(encode_company_csv, [company_data for _, _, company_data in groups])
+        return {
+            filename: CompanyCsv(company, filename, data, len(company_data))
+            for (company, filename, company_data), data in zip(groups, encoded)
+        }
+
+def export_manifest(csv_files: Dict[str, CompanyCsv]) -> List[Dict]:
+    """Manifest över exporterade filer: filnamn, företag, rader och SHA-256."""
+    return [
+        {'file': company_csv.filename, 'company': company_csv.company, 'rows': company_csv.rows,
+         'sha256': file_hash(company_csv.data)}
+        for company_csv in csv_files.values()
+    ]
+
+def write_export_zip(csv_files: Dict[str, CompanyCsv], fileobj) -> List[Dict]:
+    """
+    Skriv alla CSV-filer och manifest.json till en ZIP-fil, en fil i taget.
+    fileobj kan vara en fil, en buffert eller en ström. Returnerar manifestet.
+    """
+    manifest = export_manifest(csv_files)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for company_csv in csv_files.values():
+            archive.writestr(company_csv.filename, company_csv.data)
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
+
+# Deltaexport: kolumn och ändringstyper i delta-CSV:erna
+DELTA_COLUMN = 'Ändring'
+DELTA_ADDED = 'Tillagd'
+DELTA_CHANGED = 'Ändrad'
+DELTA_REMOVED = 'Borttagen'
+DELTA_ORDER = {DELTA_ADDED: 0, DELTA_CHANGED: 1, DELTA_REMOVED: 2}
+
+def compute_delta(previous: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """
+    Jämför två listor (RFID;Identifieringsnummer, unika RFID) med en hash-join på RFID.
+    Returnerar tillagda, ändrade och borttagna rader med kolumnen Ändring.
+    Borttagna rader har sitt tidigare Identifieringsnummer.
+    """
+    merged = current.merge(previous, on='RFID', how='outer', suffixes=('', '_tidigare'), indicator=True)
+    state = merged['_merge']
+    changes = pd.Series(None, index=merged.index, dtype=object)
+    changes[state == 'left_only'] = DELTA_ADDED
+    changes[(state == 'both')
+            & (merged['Identifieringsnummer'] != merged['Identifieringsnummer_tidigare'])] = DELTA_CHANGED
+    changes[state == 'right_only'] = DELTA_REMOVED
+    delta = pd.DataFrame({
+        'RFID': merged['RFID'],
+        'Identifieringsnummer': merged['Identifieringsnummer'].where(
+            state != 'right_only', merged['Identifieringsnummer_tidigare']),
+        DELTA_COLUMN: changes,
+    })[changes.notna()]
+    order = delta[DELTA_COLUMN].map(DELTA_ORDER).to_numpy().argsort(kind='stable')
+    return delta.iloc[order].reset_index(drop=True)
+
+# Bloom-filtrets andel falskt positiva (de slås upp i SQLite och filtreras bort där)
+BLOOM_ERROR_RATE = 0.001
+BLOOM_MIN_CAPACITY = 100000
+# ASCII-tecken → HEX-siffra (255 = inte HEX)
+HEX_NIBBLES = np.full(256, 255, dtype=np.uint8)
+HEX_NIBBLES[np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)] = np.arange(16, dtype=np.uint8)
+
+def _mix64(keys: np.ndarray) -> np.ndarray:
+    """splitmix64 - sprider bitarna i ett 64-bitars tal jämnt."""
+    z = keys + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+def hash64(values: pd.Series) -> np.ndarray:
+    """
+    64-bitars hash per värde. Rensade RFID (8 HEX-tecken) tolkas direkt som tal,
+    vilket är mycket snabbare än att hasha strängar; övriga värden hashas av pandas.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    if STRING_DTYPE is not None:
+        # Längderna räknas betydligt snabbare på Arrow-strängar
+        values = values.astype(STRING_DTYPE)
+    strings = values.to_numpy(dtype=object)
+    hashes = np.empty(len(values), dtype=np.uint64)
+    other = np.ones(len(values), dtype=bool)
+    hex_rows = np.flatnonzero(values.str.len().fillna(0).to_numpy() == 8)
+    if len(hex_rows) > 0:
+        raw = ''.join(strings[hex_rows]).encode('ascii', 'replace')
+        nibbles = HEX_NIBBLES[np.frombuffer(raw, dtype=np.uint8)].reshape(-1, 8)
+        is_hex = (nibbles != 255).all(axis=1)
+        # Två HEX-siffror per byte, fyra byte läses som ett 32-bitars tal
+        packed = (nibbles[is_hex, ::2] << 4) | nibbles[is_hex, 1::2]
+        keys = np.ascontiguousarray(packed).view('>u4').ravel().astype(np.uint64)
+        hashes[hex_rows[is_hex]] = _mix64(keys)
+        other[hex_rows[is_hex]] = False
+    if other.any():
+        hashes[other] = pd.util.hash_pandas_object(pd.Series(strings[other], dtype=object), index=False).to_numpy()
+    return hashes
+
+class BloomFilter:
+    """
+    Vektoriserat Bloom-filter för strängar (en hel kolumn per anrop).
+    Kan ge falskt positiva men aldrig falskt negativa.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = max(capacity, 1)
+        # Storleken avrundas uppåt till en tvåpotens så att positionerna kan maskas i stället för modulo
+        self.size = 1 << math.ceil(math.log2(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        # Antal hashfunktioner för önskad felfrekvens (den större tabellen ger bara lägre frekvens)
+        self.hashes = max(1, math.ceil(-math.log2(error_rate)))
+        self.count = 0
+        self._bits = np.zeros(self.size, dtype=bool)
+
+    def _positions(self, values: pd.Series) -> np.ndarray:
+        """Bitpositioner per värde (rader) och hashfunktion (kolumner)."""
+        # Dubbelhashning: de k positionerna härleds från de två halvorna av en 64-bitars hash
+        hashes = hash64(values)
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (h1[:, None] + steps * h2[:, None]) & np.uint64(self.size - 1)
+
+    def add(self, values: pd.Series):
+        if len(values) > 0:
+            self._bits[self._positions(values).ravel()] = True
+            self.count += len(values)
+
+    def might_contain(self, values: pd.Series) -> np.ndarray:
+        """Bool-array: True om värdet kan finnas, False om det säkert saknas."""
+        if len(values) == 0:
+            return np.zeros(0, dtype=bool)
+        return self._bits[self._positions(values)].all(axis=1)
+
+class ExportStore:
+    """
+    Senast provisionerade RFID-lista per företag i SQLite - grunden för deltaexport
+    och det globala RFID-registret (RFID → företag, Identifieringsnummer, exporttid).
+    Vid sparning skrivs bara ändringarna mot den lagrade listan. Ett Bloom-filter
+    i minnet gör att RFID som aldrig exporterats inte behöver slås upp på disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        # Batchläget kan skriva från flera processer - vänta på låset i stället för att ge upp
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS exported_cards (
+                company TEXT NOT NULL,
+                rfid TEXT NOT NULL,
+                identifier TEXT,
+                PRIMARY KEY (company, rfid)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS exported_companies (
+                company TEXT PRIMARY KEY,
+                rows INTEGER,
+                sha256 TEXT,
+                exported_at TEXT
+            );
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(exported_cards)")]
+        if 'exported_at' not in columns:
+            # Lagringar från före registret saknar exporttid per kort
+            with self._conn:
+                self._conn.execute("ALTER TABLE exported_cards ADD COLUMN exported_at TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS exported_cards_rfid ON exported_cards (rfid)")
+        self._bloom = None
+        self._bloom_version = None
+        # Räknas upp vid varje sparning (för cachade deltan)
+        self.revision = 0
+
+    def _data_version(self) -> int:
+        """Ändras när en annan anslutning (t.ex. batchläget) har skrivit till databasen."""
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    @property
+    def version(self) -> Tuple[int, int]:
+        """Ändras vid varje sparning, även från andra processer (för memoiserad validering)."""
+        with self._lock:
+            return self.revision, self._data_version()
+
+    @property
+    def bloom(self) -> BloomFilter:
+        """Bloom-filter över alla registrerade RFID. Byggs om när andra processer skrivit."""
+        with self._lock:
+            version = self._data_version()
+            if self._bloom is None or self._bloom_version != version:
+                rfids = pd.Series(
+                    [row[0] for row in self._conn.execute("SELECT rfid FROM exported_cards")], dtype=object
+                )
+                self._bloom = BloomFilter(max(2 * len(rfids), BLOOM_MIN_CAPACITY))
+                self._bloom.add(rfids)
+                self._bloom_version = version
+            return self._bloom
+
+    def registered(self, rfids: pd.Series) -> pd.DataFrame:
+        """
+        Slå upp en hel kolumn i registret. Bloom-filtret sållar bort RFID som
+        säkert saknas; bara övriga slås upp i SQLite.
+        Returnerar RFID, Företag, Identifieringsnummer och Exporterad per träff.
+        """
+        unique = pd.Series(pd.unique(rfids.dropna()), dtype=object)
+        candidates = unique[self.bloom.might_contain(unique)].tolist()
+        rows = []
+        with self._lock:
+            # SQLite begränsar antalet parametrar per fråga
+            for start in range(0, len(candidates), 900):
+                chunk = candidates[start:start + 900]
+                rows.extend(self._conn.execute(
+                    "SELECT rfid, company, identifier, exported_at FROM exported_cards "
+                    f"WHERE rfid IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return pd.DataFrame(rows, columns=['RFID', 'Företag', 'Identifieringsnummer', 'Exporterad'],
+                            dtype=object)
+
+    def previous(self, company: str) -> pd.DataFrame:
+        """Företagets senast provisionerade lista (tom om företaget inte exporterats)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rfid, identifier FROM exported_cards WHERE company = ?", (company,)
+            ).fetchall()
+        return pd.DataFrame(rows, columns=['RFID', 'Identifieringsnummer'], dtype=object)
+
+    def last_export(self, company: str) -> Optional[Dict]:
+        """Rader, SHA-256 och tidpunkt för företagets senaste provisionering (None om ingen)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rows, sha256, exported_at FROM exported_companies WHERE company = ?", (company,)
+            ).fetchone()
+        return dict(zip(['rows', 'sha256', 'exported_at'], row)) if row else None
+
+    def save(self, company: str, current: pd.DataFrame, sha256: str = '') -> pd.DataFrame:
+        """Gör current till företagets provisionerade lista. Returnerar deltat som skrevs."""
+        with self._lock:
+            bloom = self.bloom
+            delta = compute_delta(self.previous(company), current)
+            removed = delta[DELTA_COLUMN] == DELTA_REMOVED
+            now = datetime.now().isoformat(timespec='seconds')
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM exported_cards WHERE company = ? AND rfid = ?",
+                    ((company, rfid) for rfid in delta.loc[removed, 'RFID'])
+                )
+                self._conn.executemany(
+                    "INSERT INTO exported_cards (company, rfid, identifier, exported_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(company, rfid) DO UPDATE SET identifier = excluded.identifier, "
+                    "exported_at = excluded.exported_at",
+                    ((company, rfid, identifier, now) for rfid, identifier
+                     in delta.loc[~removed, ['RFID', 'Identifieringsnummer']].itertuples(index=False))
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO exported_companies (company, rows, sha256, exported_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (company, len(current), sha256, now)
+                )
+            # Borttagna RFID ligger kvar i filtret - de filtreras bort vid uppslagningen
+            bloom.add(delta.loc[~removed, 'RFID'])
+            if bloom.count > bloom.capacity:
+                self._bloom = None
+            self._bloom_version = self._data_version()
+            self.revision += 1
+        return delta
+
+@st.cache_resource
+def get_export_store() -> ExportStore:
+    """Delad lagring av provisionerade listor för hela servern."""
+    return ExportStore(os.path.join(DATA_DIR, 'export_store.sqlite'))
+
+def build_delta_csvs(df_valid: pd.DataFrame, store: ExportStore) -> Tuple[Dict[str, CompanyCsv], pd.DataFrame]:
+    """
+    Delta per företag mot den senast provisionerade listan i store. Företag utan
+    ändringar får en delta-fil med bara rubrikraden; företag som saknas i exporten jämförs inte.
+    Returnerar ({filnamn: CompanyCsv} med RFID;Identifieringsnummer;Ändring, översikt per företag)
+    """
+    delta_files = {}
+    summary = []
+    for company, filename, company_data in company_frames(df_valid):
+        last = store.last_export(company)
+        delta = compute_delta(store.previous(company), company_data)
+        counts = delta[DELTA_COLUMN].value_counts()
+        summary.append({
+            'Företag': company,
+            'Senast provisionerad': last['exported_at'] if last else 'Aldrig',
+            'Rader tidigare': last['rows'] if last else 0,
+            'Rader nu': len(company_data),
+            'Tillagda': int(counts.get(DELTA_ADDED, 0)),
+            'Ändrade': int(counts.get(DELTA_CHANGED, 0)),
+            'Borttagna': int(counts.get(DELTA_REMOVED, 0)),
+        })
+        delta_name = f"{os.path.splitext(filename)[0]}_delta.csv"
+        delta_files[delta_name] = CompanyCsv(company, delta_name, encode_company_csv(delta), len(delta))
+    return delta_files, pd.DataFrame(summary)
+
+def registry_conflicts(df_filtered: pd.DataFrame, store: ExportStore) -> pd.DataFrame:
+    """
+    Varningar för giltiga RFID som redan exporterats för ett annat företag
+    (enligt det globala registret). En rad per RFID och tidigare företag.
+    """
+    valid = df_filtered[df_filtered['RFID_VALID']]
+    registered = store.registered(valid['RFID_CLEAN'])
+    if len(registered) == 0:
+        return concat_issues([])
+    rows = valid.assign(_pos=np.arange(len(valid)), Företag=valid['Företag'].astype(object)).merge(
+        registered, left_on='RFID_CLEAN', right_on='RFID', suffixes=('', '_tidigare')
+    )
+    rows = rows[rows['Företag'] != rows['Företag_tidigare']].sort_values('_pos', kind='stable')
+    rows.index = valid.index[rows['_pos'].to_numpy()]
+    return issue_frame(
+        rows, PROBLEM_REGISTRY_CONFLICT,
+        RFID=rows['RFID_CLEAN'],
+        Identifieringsnummer=rows['Identifieringsnummer'],
+        Företag=rows['Företag'],
+        **{'Tidigare företag': rows['Företag_tidigare'],
+           'Tidigare Identifieringsnummer': rows['Identifieringsnummer_tidigare'],
+           'Exporterad': rows['Exporterad']}
+    )
+
+def save_provisioned(df_valid: pd.DataFrame, store: ExportStore, csv_files: Dict[str, CompanyCsv]):
+    """Spara exportens listor som provisionerade (jämförelsegrund för nästa deltaexport)."""
+    for company, filename, company_data in company_frames(df_valid):
+        store.save(company, company_data, file_hash(csv_files[filename].data))
+
+MAPPING_KEYS = ['rfid', 'tagg_id', 'identifier', 'company']
+
+def mapping_problems(mapping: Dict[str, str]) -> List[str]:
+    """Kontrollera att en kolumnmappning är komplett. Returnerar felmeddelanden."""
+    problems = []
+    if not mapping.get('rfid') and not mapping.get('tagg_id'):
+        problems.append("Du måste välja antingen RFID/HEX-nummer eller TAGG ID kolumn")
+    if not mapping.get('identifier'):
+        problems.append("Du måste välja Regnummer/Referens kolumn")
+    return problems
+
+def header_signature(columns) -> str:
+    """Rubrikradens signatur: hash av kolumnnamnen (trimmade, gemener, sorterade)."""
+    names = sorted({str(column).strip().casefold() for column in columns})
+    return hashlib.sha1('\x1f'.join(names).encode('utf-8')).hexdigest()[:16]
+
+class MappingProfiles:
+    """
+    Sparade kolumnmappningar (JSON-fil, kan redigeras för hand). En ny fil
+    matchas mot profilerna på rubrikraden: först exakt signatur, annars den
+    profil vars mappade kolumner alla finns i filen och som delar flest
+    kolumner med filen.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> List[Dict]:
+        """Alla profiler (läses om varje gång - filen kan ha ändrats av en annan process)."""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f).get('profiles', [])
+
+    def save(self, name: str, columns, mapping: Dict[str, str]) -> Dict:
+        """Spara (eller ersätt) en profil med samma namn."""
+        profile = {
+            'name': name,
+            'signature': header_signature(columns),
+            'columns': [str(column).strip() for column in columns],
+            'mapping': {field: column for field, column in mapping.items() if column},
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            profiles = [existing for existing in self.load() if existing['name'] != name] + [profile]
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'profiles': profiles}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        return profile
+
+    def match(self, columns) -> Optional[Dict]:
+        """Profilen som passar rubrikraden, eller None."""
+        profiles = self.load()
+        signature = header_signature(columns)
+        for profile in reversed(profiles):
+            if profile.get('signature') == signature:
+                return profile
+        header = {str(column).strip().casefold() for column in columns}
+        candidates = [
+            (len(header & {column.casefold() for column in profile.get('columns', [])}), position, profile)
+            for position, profile in enumerate(profiles)
+            if all(column.casefold() in header for column in profile['mapping'].values())
+        ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: candidate[:2])[2]
+
+@st.cache_resource
+def get_mapping_profiles() -> MappingProfiles:
+    """Sparade mappningsprofiler (delas med inkorgsbevakningen)."""
+    return MappingProfiles(os.path.join(DATA_DIR, 'mapping_profiles.json'))
+
+def _json_value(value):
+    """Konvertera ett cellvärde till en JSON-vänlig Python-typ."""
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if hasattr(value, 'item'):
+        # numpy-skalärer
+        return value.item()
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def records_to_json(records: List[Dict]) -> List[Dict]:
+    """Gör fel-/varningsrader JSON-säkra (NaN blir null, numpy-typer blir Python-typer)."""
+    return [{key: _json_value(value) for key, value in record.items()} for record in records]
+
+def show_instructions():
+    """Visa instruktioner på startsidan."""
+    st.title("🔌 RFID CSV Konverterare")
+    st.markdown(f"<h3 style='color: {CHARGENODE_GREEN};'>ChargeNode - RFID Data Formatting Tool</h3>", 
+                unsafe_allow_html=True)
+    
+    st.markdown("---")
+    
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        st.markdown("""
+        ### 📋 Om programmet
+        
+        Detta verktyg hjälper dig att konvertera Excel-filer med RFID-data till standardiserat 
+        CSV-format för ChargeNodes laddstolpar.
+        
+        ### ⚙️ Funktioner
+        
+        - ✅ Konvertera RFID-data från olika Excel-format
+        - ✅ Hantera både HEX-nummer och TAGG ID
+        - ✅ Validera och rensa data automatiskt
+        - ✅ Dela upp per företag (om flera finns)
+        - ✅ Detektera och rapportera fel
+        
+        ### 📊 Stödda format
+        
+        **Indatafiler:**
+        - Excel (.xlsx) med en eller flera flikar
+        - CSV/TXT (avgränsare och teckenkodning gissas), TSV eller Parquet - även för MER-filen
+        - RFID-nummer (HEX) eller TAGG ID
+        - Regnummer/Referens (Identifieringsnummer)
+        - Företagsnamn (valfritt)
+        
+        **Utdataformat:**
+        ```
+        RFID;Identifieringsnummer
+        1A2B3C4D;ABC123
+        5E6F7890;XYZ789
+        ```
+        """)
+    
+    with col2:
+        st.info("""
+        **💡 Tips**
+        
+        1. Förbered din Excel-fil
+        2. Se till att data är i rätt kolumner
+        3. Kontrollera företagsnamn om det finns flera
+        4. Följ stegen i sidomenyn
+        """)
+        
+        st.success("""
+        **📥 CSV-format**
+        
+        - Semikolon (;) som separator
+        - UTF-8 encoding
+        - Två kolumner: RFID & Identifieringsnummer
+        """)
+
+def main():
+    # Ladda custom CSS
+    load_custom_css()
+    
+    # Sidebar navigation
+    st.sidebar.markdown(f"""
+        <div style='padding: 1rem 0; text-align: center; border-bottom: 2px solid {CHARGENODE_GREEN};'>
+            <h2 style='color: {CHARGENODE_GREEN}; margin: 0;'>ChargeNode</h2>
+            <p style='color: {CHARGENODE_DARK}; margin: 0; font-size: 0.9rem;'>RFID CSV Konverterare</p>
+        </div>
+    """, unsafe_allow_html=True)
+    st.sidebar.markdown("")
+    
+    # Session state initiering
+    if 'step' not in st.session_state:
+        st.session_state.step = 'instructions'
+    if 'df_main' not in st.session_state:
+        st.session_state.df_main = None
+    if 'df_mer' not in st.session_state:
+        st.session_state.df_mer = None
+    if 'column_mapping' not in st.session_state:
+        st.session_state.column_mapping = {}
+    
+    # Navigation
+    menu_options = {
+        '📋 Instruktioner': 'instructions',
+        '📤 Ladda upp fil': 'upload',
+        '🗺️ Kolumnmappning': 'mapping',
+        '✅ Validering': 'validation',
+        '📥 Resultat': 'result'
+    }
+    
+    st.sidebar.markdown("### Navigation")
+    selected = st.sidebar.radio(
+        "Välj steg:",
+        list(menu_options.keys()),
+        index=list(menu_options.values()).index(st.session_state.step),
+        label_visibility="collapsed"
+    )
+    st.session_state.step = menu_options[selected]
+    
+    # Resultat från bakgrundsjobb som blivit klara sedan förra omritningen
+    collect_finished_jobs()
+    
+    # Visa rätt steg
+    if st.session_state.step == 'instructions':
+        show_instructions()
+    elif st.session_state.step == 'upload':
+        upload_step()
+    elif st.session_state.step == 'mapping':
+        mapping_step()
+    elif st.session_state.step == 'validation':
+        validation_step()
+    elif st.session_state.step == 'result':
+        result_step()
+    
+    render_job_sidebar()
+    
+    # Minnesanvändning för sessionen (efter steget, så att siffrorna är aktuella)
+    usage = session_memory()
+    st.sidebar.markdown("---")
+    st.sidebar.caption(f"💾 Sessionens minne: {usage.sum() / 1024 / 1024:.1f} MB")
+    if len(usage) > 0:
+        with st.sidebar.expander("Minnesfördelning"):
+            st.dataframe(
+                (usage.sort_values(ascending=False) / 1024 / 1024).round(2).rename('MB'),
+                use_container_width=True
+            )
+
+def object_nbytes(value, seen: set) -> int:
+    """Ungefärlig minnesanvändning för ett värde i session state (delade objekt räknas en gång)."""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return frame_nbytes(value)
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, ValidationPipeline):
+        return object_nbytes(vars(value), seen)
+    if isinstance(value, dict):
+        return sum(object_nbytes(item, seen) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(object_nbytes(item, seen) for item in value)
+    return 0
+
+def session_memory() -> pd.Series:
+    """Byte per nyckel i session state (bara nycklar som håller data)."""
+    seen = set()
+    usage = {key: object_nbytes(st.session_state[key], seen) for key in list(st.session_state.keys())}
+    return pd.Series({key: size for key, size in usage.items() if size > 0}, dtype='int64')
+
+def upload_step():
+    st.title("📤 Ladda upp fil")
+    
+    st.markdown("""
+    Ladda upp din fil som innehåller RFID-data: Excel (.xlsx), CSV/TSV eller Parquet.
+    """)
+    
+    uploaded_file = st.file_uploader(
+        "Välj fil",
+        type=INPUT_TYPES,
+        help="Excel (.xlsx), CSV eller TXT (avgränsare och teckenkodning gissas), TSV eller Parquet"
+    )
+    
+    if uploaded_file is not None:
+        try:
+            # Läs filen (hashen beräknas en gång per uppladdning)
+            data = uploaded_file.getvalue()
+            kind = input_kind(uploaded_file.name)
+            if st.session_state.get('main_file_id') != uploaded_file.file_id:
+                st.session_state.main_file_id = uploaded_file.file_id
+                st.session_state.main_file_hash = file_hash(data)
+            data_hash = st.session_state.main_file_hash
+            
+            sheet_names, _ = input_sheet_names(data, data_hash, kind)
+            
+            st.success(f"✅ Fil uppladdad: {uploaded_file.name}")
+            
+            # Visa tillgängliga flikar (bara Excel har flikar)
+            if kind == 'excel':
+                st.markdown("### 📑 Tillgängliga flikar")
+            all_sheets = False
+            if len(sheet_names) > 1:
+                all_sheets = st.checkbox(
+                    f"📚 Processera alla {len(sheet_names)} flikar",
+                    value=st.session_state.get('all_sheets_mode', False),
+                    help="Alla flikar valideras parallellt och slås ihop till ett resultat med "
+                         "källflik per rad. Dubbletter kontrolleras över alla flikar."
+                )
+            st.session_state.all_sheets_mode = all_sheets
+            st.session_state.all_sheets_source = (
+                {'data': data, 'sheets': sheet_names} if all_sheets else None
+            )
+            
+            stream_mode = False
+            if kind == 'excel':
+                sheet_name = st.selectbox(
+                    "Flik för förhandsgranskning och mappning" if all_sheets else "Välj flik att processera",
+                    sheet_names
+                )
+                
+                stream_mode = st.checkbox(
+                    "🚀 Strömmande inläsning (mycket stora filer)",
+                    value=st.session_state.get('stream_mode', False) and not all_sheets,
+                    disabled=all_sheets,
+                    help="Läser bara de första raderna för förhandsgranskning. Valideringen läser "
+                         "sedan filen blockvis och endast de mappade kolumnerna."
+                )
+                st.session_state.stream_mode = stream_mode
+            else:
+                sheet_name = TABLE_SHEET
+            
+            if stream_mode:
+                # Läs bara början av fliken - resten strömmas i valideringssteget
+                df, total_rows = read_excel_preview(data, sheet_name, PREVIEW_ROWS)
+                st.session_state.stream_source = {'data': data, 'sheet': sheet_name, 'rows': total_rows}
+                st.session_state.projected_source = None
+                row_info = f"ca {total_rows}" if total_rows is not None else "okänt"
+            else:
+                # Fas ett: rubrikrad och förhandsgranskning (från cache om samma fil och flik redan lästs).
+                # Valideringen läser sedan bara de mappade kolumnerna.
+                start = time.perf_counter()
+                cache = get_parse_cache()
+                preview_key = (data_hash, sheet_name, 'preview')
+                cached_preview = cache.get(preview_key)
+                sheet_hit = cached_preview is not None
+                if not sheet_hit:
+                    cached_preview = (read_input_preview(data, kind, sheet_name),
+                                      input_row_count(data, kind, sheet_name))
+                    cache.put(preview_key, cached_preview, frame_nbytes(cached_preview[0]))
+                df, total_rows = cached_preview[0].copy(deep=False), cached_preview[1]
+                parse_seconds = time.perf_counter() - start
+                st.session_state.stream_source = None
+                st.session_state.projected_source = {'data': data, 'kind': kind, 'sheet': sheet_name}
+                row_info = f"ca {total_rows}" if total_rows is not None else "okänt"
+                
+                st.caption(
+                    f"{'⚡ Cache-träff' if sheet_hit else '📖 Inläst från fil'} på {parse_seconds:.2f} s "
+                    f"(läsare: {df.attrs.get('parser', kind)}, rubrikrad och {len(df)} rader - "
+                    f"valideringen läser bara de mappade kolumnerna) | "
+                    f"Cache: {len(cache)} poster, {cache.size / 1024 / 1024:.1f} MB, "
+                    f"{cache.hits} träffar / {cache.misses} missar"
+                )
+            
+            # Spara i session state
+            st.session_state.df_main = df
+            st.session_state.selected_sheet = sheet_name
+            
+            # Visa förhandsgranskning
+            st.markdown("### 👀 Förhandsgranskning")
+            st.info(f"**Antal rader:** {row_info} | **Antal kolumner:** {len(df.columns)}")
+            st.dataframe(df.head(10), use_container_width=True)
+            
+            # Nästa-knapp
+            if st.button("➡️ Fortsätt till Kolumnmappning", type="primary"):
+                st.session_state.step = 'mapping'
+                st.rerun()
+                
+        except Exception as e:
+            st.error(f"❌ Fel vid uppladdning av fil: {str(e)}")
+    else:
+        st.info("👆 Vänligen ladda upp en fil för att fortsätta")
+
+# Antal värden per kolumn som profileras vid auto-detektering
+PROFILE_SAMPLE_ROWS = 500
+
+# Nyckelord i kolumnnamn per fält
+HEADER_KEYWORDS = {
+    'rfid': ['hex', 'rfid', 'card', 'kort'],
+    'tagg_id': ['rfid', 'tagg', 'visible'],
+    'identifier': ['reg', 'licens', 'plate', 'referens', 'identifiering'],
+    'company': ['företag', 'company', 'customer', 'name', 'namn', 'anläggning'],
+}
+
+# Lägsta säkerhet för att ett fält ska auto-detekteras.
+# Identifierare och företag kan som tidigare detekteras enbart på kolumnnamnet.
+DETECT_THRESHOLDS = {'rfid': 0.5, 'tagg_id': 0.5, 'identifier': 0.25, 'company': 0.25}
+
+# Svenska regnummer (ABC123 / ABC12A) samt andra vanliga nordiska format
+PLATE_PATTERN = r'[A-ZÅÄÖ]{2,3}[ -]?\d{2,4}[A-Z]?|[A-Z]{3} ?\d{2}[A-Z\d]'
+
+def profile_columns(df: pd.DataFrame, sample_size: int = PROFILE_SAMPLE_ROWS) -> pd.DataFrame:
+    """
+    Profilera alla kolumner på ett begränsat urval värden per kolumn.
+    Urvalen från alla kolumner läggs i en gemensam Series så att varje
+    regex-test körs en gång för alla kolumner samtidigt. Kostnaden beror
+    bara på antal kolumner och urvalsstorlek, inte på antal rader.
+    Returnerar en rad per kolumn med säkerhet 0-1 för rfid, tagg_id, identifier och company.
+    """
+    # Läs som mest ett fast antal rader, även om många värden saknas.
+    # Flyttal, datum och booleska kolumner kan aldrig matcha något mönster och hoppas över.
+    head = df.head(sample_size * 4)
+    samples = {}
+    for pos in range(len(df.columns)):
+        col = head.iloc[:, pos]
+        if (pd.api.types.is_float_dtype(col) or pd.api.types.is_bool_dtype(col)
+                or pd.api.types.is_datetime64_any_dtype(col)):
+            continue
+        samples[pos] = col.dropna().head(sample_size).astype(object)
+    values = pd.concat(samples) if samples else pd.Series(dtype=object)
+    column = values.index.get_level_values(0) if len(values) > 0 else pd.Index([], dtype=int)
+    
+    text = values.astype(str).str.strip().str.upper()
+    _, hex_valid, _ = validate_hex_series(values)
+    tagg = text.str.match(r'SE-MER-[A-Z0-9]')
+    flags = pd.DataFrame({
+        'hex': hex_valid,
+        # Rena siffror (kundnummer, telefonnummer) är sämre HEX-kandidater
+        'hex_letters': hex_valid & text.str.contains(r'[A-F]', regex=True),
+        'tagg': tagg,
+        'plate': text.str.fullmatch(PLATE_PATTERN),
+        # Företagsnamn: text med bokstäver som inte är HEX eller TAGG ID
+        'wordy': text.str.contains(r'[A-ZÅÄÖ]{2}', regex=True) & ~hex_valid & ~tagg,
+    }).astype(float)
+    
+    positions = pd.RangeIndex(len(df.columns))
+    ratios = flags.groupby(column).mean().reindex(positions, fill_value=0.0)
+    counts = text.groupby(column).size().reindex(positions, fill_value=0)
+    distinct = text.groupby(column).nunique().reindex(positions, fill_value=0)
+    
+    # Regnummer som ABC123 är också giltig HEX - dra av för regnummerlika värden
+    letter_share = (ratios['hex_letters'] / ratios['hex']).where(ratios['hex'] > 0, 0.0)
+    hex_score = ratios['hex'] * (0.5 + 0.5 * letter_share) * (1 - ratios['plate'])
+    # Låg kardinalitet (många rader per värde) talar för företagsnamn
+    repeat = (1 - (distinct - 1) / (counts - 1).clip(lower=1)).clip(lower=0).where(counts > 0, 0.0)
+    company_score = ratios['wordy'] * repeat
+    
+    names = [str(col).lower() for col in df.columns]
+    header = {field: pd.Series([float(any(keyword in name for keyword in keywords)) for name in names])
+              for field, keywords in HEADER_KEYWORDS.items()}
+    
+    return pd.DataFrame({
+        'Kolumn': list(df.columns),
+        'rfid': 0.75 * hex_score + 0.25 * header['rfid'],
+        'tagg_id': 0.75 * ratios['tagg'] + 0.25 * header['tagg_id'],
+        'identifier': 0.75 * ratios['plate'] + 0.25 * header['identifier'],
+        'company': 0.75 * company_score + 0.25 * header['company'],
+    })
+
+def rank_candidates(profile: pd.DataFrame) -> Dict[str, List[Tuple[str, float]]]:
+    """Rangordnade kandidatkolumner (kolumn, säkerhet) per fält."""
+    ranked = {}
+    for field in MAPPING_KEYS:
+        ordered = profile.sort_values(by=field, ascending=False, kind='stable')
+        ranked[field] = [(col, round(float(score), 2))
+                         for col, score in zip(ordered['Kolumn'], ordered[field]) if score > 0]
+    return ranked
+
+def auto_detect_columns(df: pd.DataFrame, profile: Optional[pd.DataFrame] = None) -> Dict[str, str]:
+    """Försök automatiskt detektera vilka kolumner som innehåller vad."""
+    detected = {
+        'rfid': None,
+        'tagg_id': None,
+        'identifier': None,
+        'company': None
+    }
+    
+    # Trimma kolumnnamn (ta bort mellanslag i början/slut)
+    df.columns = df.columns.str.strip()
+    
+    if profile is None:
+        profile = profile_columns(df)
+    
+    # Tilldela fält i ordning efter säkerhet - varje kolumn används bara en gång
+    candidates = sorted(
+        ((score, field, col) for field, options in rank_candidates(profile).items()
+         for col, score in options),
+        key=lambda item: -item[0]
+    )
+    used = set()
+    for score, field, col in candidates:
+        if detected[field] is None and col not in used and score >= DETECT_THRESHOLDS[field]:
+            detected[field] = col
+            used.add(col)
+    
+    return detected
+
+def mapping_step():
+    st.title("🗺️ Kolumnmappning")
+    
+    if st.session_state.df_main is None:
+        st.warning("⚠️ Ingen fil uppladdad. Vänligen gå tillbaka till 'Ladda upp fil'.")
+        return
+    
+    df = st.session_state.df_main
+    # Trimma kolumnnamn
+    df.columns = df.columns.str.strip()
+    st.session_state.df_main = df
+    
+    columns = [''] + list(df.columns)
+    
+    # Auto-detektera kolumner
+    if 'auto_detected' not in st.session_state:
+        st.session_state.column_profile = profile_columns(df)
+        st.session_state.auto_detected = auto_detect_columns(df, st.session_state.column_profile)
+    
+    detected = st.session_state.auto_detected
+    
+    st.markdown("""
+    Ange vilka kolumner som innehåller respektive data.
+    """)
+    
+    # Visa auto-detekterade kolumner om några hittades
+    if any(detected.values()):
+        with st.expander("🤖 Auto-detekterade kolumner (klicka för att se)", expanded=False):
+            scores = st.session_state.column_profile.set_index('Kolumn')
+            
+            def confidence(field: str) -> str:
+                return f"(säkerhet {scores.loc[detected[field], field]:.2f})"
+            
+            if detected['rfid']:
+                st.success(f"✅ HEX-nummer: **{detected['rfid']}** {confidence('rfid')}")
+            if detected['tagg_id']:
+                st.success(f"✅ TAGG ID: **{detected['tagg_id']}** {confidence('tagg_id')}")
+            if detected['identifier']:
+                st.success(f"✅ Identifieringsnummer: **{detected['identifier']}** {confidence('identifier')}")
+            if detected['company']:
+                st.info(f"ℹ️ Företagsnamn: **{detected['company']}** {confidence('company')}")
+            
+            st.caption(f"Säkerhet per kolumn (0-1) baserat på upp till {PROFILE_SAMPLE_ROWS} värden och kolumnnamnet:")
+            st.dataframe(
+                scores.rename(columns={'rfid': 'HEX-nummer', 'tagg_id': 'TAGG ID',
+                                       'identifier': 'Identifieringsnummer', 'company': 'Företagsnamn'}).round(2),
+                use_container_width=True
+            )
+    
+    all_sheets_source = st.session_state.get('all_sheets_source')
+    if all_sheets_source:
+        st.session_state.per_sheet_detect = st.checkbox(
+            "🤖 Auto-detektera kolumner per flik",
+            value=st.session_state.get('per_sheet_detect', False),
+            help=f"Alla {len(all_sheets_source['sheets'])} flikar processeras. Varje flik får sin egen "
+                 "auto-detekterade mappning - mappningen nedan används för flikar där "
+                 "detekteringen inte är komplett."
+        )
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("#### Obligatoriska fält")
+        
+        # RFID eller TAGG ID (måste välja ett)
+        # Försök auto-detektera vad filen innehåller
+        default_match_type = 0  # RFID/HEX
+        if detected['tagg_id'] and not detected['rfid']:
+            default_match_type = 1  # TAGG ID
+        
         match_type = st.radio(
             "Matchning sker på:",
             ["RFID/HEX-nummer", "TAGG ID"],
@@ -541,16 +2959,11 @@ def mapping_step():
     st.markdown("---")
     st.markdown("### ✓ Mappningsöversikt")
     
-    mapping_valid = True
-    
-    # Kontrollera att antingen RFID eller TAGG ID är valt
-    if not st.session_state.column_mapping.get('rfid') and not st.session_state.column_mapping.get('tagg_id'):
-        st.error("❌ Du måste välja antingen RFID/HEX-nummer eller TAGG ID kolumn")
-        mapping_valid = False
-    
-    if not st.session_state.column_mapping.get('identifier'):
-        st.error("❌ Du måste välja Regnummer/Referens kolumn")
-        mapping_valid = False
+    # Kontrollera att antingen RFID eller TAGG ID samt Regnummer/Referens är valt
+    problems = mapping_problems(st.session_state.column_mapping)
+    for problem in problems:
+        st.error(f"❌ {problem}")
+    mapping_valid = len(problems) == 0
     
     # Visa mappning
     if mapping_valid:
@@ -568,6 +2981,15 @@ def mapping_step():
                 st.info(f"ℹ️ Företagsnamn: **{st.session_state.column_mapping['company']}**")
             else:
                 st.info("ℹ️ Inget företagsnamn valt")
+        
+        with st.expander("💾 Spara som mappningsprofil"):
+            st.caption("Inkorgsbevakningen (`python -m rfid_converter watch`) använder profilen "
+                       "för filer med samma rubrikrad.")
+            profile_name = st.text_input("Profilnamn", value=st.session_state.get('mapping_profile_name', ''))
+            if st.button("💾 Spara profil", disabled=not profile_name.strip()):
+                get_mapping_profiles().save(profile_name.strip(), df.columns, st.session_state.column_mapping)
+                st.session_state.mapping_profile_name = profile_name.strip()
+                st.success(f"✅ Profilen '{profile_name.strip()}' sparad")
     
     # Nästa steg - kolla om vi behöver MER-fil
     st.markdown("---")
@@ -582,36 +3004,85 @@ def mapping_step():
             """)
             
             mer_file = st.file_uploader(
-                "Ladda upp RFID MER.xlsx",
-                type=['xlsx'],
-                help="Filen ska innehålla kolumnerna 'Visible Number' och 'Key/Card number'"
+                "Ladda upp RFID MER-fil (.xlsx, .csv, .tsv eller .parquet)",
+                type=INPUT_TYPES,
+                help="Filen ska innehålla kolumnerna 'Visible Number' och 'Key/Card number' (övriga kolumner läses inte)"
             )
             
-            if mer_file is not None:
+            mer_cache = get_mer_cache()
+            if mer_file is None:
+                mer_cache.release(session_owner())
+            else:
                 try:
-                    df_mer = pd.read_excel(mer_file)
-                    
-                    # Trimma kolumnnamn
-                    df_mer.columns = df_mer.columns.str.strip()
-                    
-                    # Kontrollera att rätt kolumner finns
-                    required_cols = ['Visible Number', 'Key/Card number']
-                    missing_cols = [col for col in required_cols if col not in df_mer.columns]
+                    # Hashen beräknas en gång per uppladdning, filen läses bara om den inte finns i cachen
+                    mer_data = None
+                    if st.session_state.get('mer_file_id') != mer_file.file_id:
+                        mer_data = mer_file.getvalue()
+                        st.session_state.mer_file_hash = file_hash(mer_data)
+                        st.session_state.mer_file_id = mer_file.file_id
+                    mer_hash = st.session_state.mer_file_hash
+                    mer_index = get_mer_index()
+                    # Samma fil (byte för byte) som redan lästs in på servern - ingen ny inläsning
+                    entry = mer_cache.attach(mer_hash, session_owner())
+                    shared = entry is not None and st.session_state.get('mer_hash') != mer_hash
+                    if entry is None:
+                        # Bara de två MER-kolumnerna läses (med trimmade namn)
+                        mer_kind = input_kind(mer_file.name)
+                        if mer_data is None:
+                            mer_data = mer_file.getvalue()
+                        start = time.perf_counter()
+                        df_mer = read_input_columns(mer_data, mer_kind, MER_COLUMNS)
+                        mer_parse_seconds = time.perf_counter() - start
+                        
+                        # Kontrollera att rätt kolumner finns
+                        missing_cols = [col for col in MER_COLUMNS if col not in df_mer.columns]
+                        
+                        if missing_cols:
+                            header = read_input_preview(mer_data, mer_kind, nrows=0).columns
+                            st.error(f"❌ Följande kolumner saknas i MER-filen: {', '.join(missing_cols)}")
+                            st.info("📋 Tillgängliga kolumner i filen: " + ", ".join(header.str.strip()))
+                        else:
+                            # Spara filen i det beständiga MER-indexet (bara om den är ny)
+                            conflicts = pd.DataFrame(columns=MER_CONFLICT_COLUMNS)
+                            if not mer_index.has_source(mer_hash):
+                                conflicts = mer_index.ingest(df_mer, mer_hash, mer_file.name)
+                            parser = df_mer.attrs.get('parser')
+                            df_mer = df_mer[MER_COLUMNS]
+                            entry = mer_cache.put(MerCacheEntry(
+                                hash=mer_hash, name=mer_file.name, frame=df_mer, preview=df_mer.head(10),
+                                conflicts=conflicts, parser=parser, parse_seconds=mer_parse_seconds,
+                                nbytes=frame_nbytes(df_mer)
+                            ), session_owner())
+                    elif not mer_index.has_source(mer_hash):
+                        # Indexet saknar filen (t.ex. ny datakatalog) - läggs in från cachen utan ny inläsning
+                        mer_index.ingest(entry.frame, mer_hash, entry.name)
                     
-                    if missing_cols:
-                        st.error(f"❌ Följande kolumner saknas i MER-filen: {', '.join(missing_cols)}")
-                        st.info("📋 Tillgängliga kolumner i filen: " + ", ".join(df_mer.columns))
-                    else:
-                        st.session_state.df_mer = df_mer
+                    if entry is not None:
+                        # Mappningarna finns i MER-indexet - sessionen pekar bara på den delade förhandsgranskningen
+                        # och slår upp mot just den här filen (mer_hash)
+                        st.session_state.df_mer = entry.preview
+                        st.session_state.mer_hash = mer_hash
                         st.success("✅ MER-fil uppladdad")
+                        df_mer = entry.frame
                         
                         # Visa statistik
                         st.info(f"📊 MER-filen innehåller {len(df_mer)} TAGG ID → RFID mappningar")
+                        if shared:
+                            st.caption(f"⚡ Filen var redan inläst på servern - används av "
+                                       f"{mer_cache.refcount(mer_hash)} session(er)")
+                        else:
+                            st.caption(f"📖 Inläst på {entry.parse_seconds:.2f} s (läsare: {entry.parser})")
+                        
+                        mer_conflicts = entry.conflicts
+                        if len(mer_conflicts) > 0:
+                            st.warning(f"⚠️ {len(mer_conflicts)} TAGG ID har motstridiga RFID-mappningar "
+                                       "(senaste värdet används)")
+                            with st.expander("🔍 Visa motstridiga mappningar"):
+                                st.dataframe(mer_conflicts, use_container_width=True)
                         
                         # Visa förhandsgranskning
                         with st.expander("👀 Förhandsgranska MER-fil"):
-                            preview_mer = df_mer[['Visible Number', 'Key/Card number']].head(10)
-                            st.dataframe(preview_mer, use_container_width=True)
+                            st.dataframe(st.session_state.df_mer, use_container_width=True)
                         
                         if st.button("➡️ Fortsätt till Validering", type="primary"):
                             st.session_state.step = 'validation'
@@ -625,149 +3096,346 @@ def mapping_step():
                 st.session_state.step = 'validation'
                 st.rerun()
 
-def validation_step():
-    st.title("✅ Validering & Datarensning")
-    
-    if st.session_state.df_main is None:
-        st.warning("⚠️ Ingen fil uppladdad. Vänligen gå tillbaka till 'Ladda upp fil'.")
-        return
-    
-    df = st.session_state.df_main.copy()
-    mapping = st.session_state.column_mapping
-    
-    st.markdown("Validerar och rensar data...")
+def validation_fingerprint(mapping: Dict[str, str], mer_table: Optional[MerTable],
+                           store: ExportStore) -> Tuple:
+    """
+    Nyckel för det memoiserade valideringsresultatet: fil (hash), flik(ar),
+    kolumnmappning, MER-data och RFID-registret. Ändras bara när någon av dessa ändras.
+    """
+    state = st.session_state
+    all_sheets = state.get('all_sheets_source') is not None
+    source = (
+        state.get('main_file_hash') or id(state.df_main),
+        state.get('selected_sheet'),
+        all_sheets,
+        all_sheets and state.get('per_sheet_detect', False),
+        state.get('stream_source') is not None,
+    )
+    mer = mer_table.key if mer_table is not None else None
+    return source + (json.dumps(mapping, sort_keys=True), mer, store.version)
+
+class ValidationRequest(NamedTuple):
+    """Allt en valideringskörning behöver från sessionen (jobbet läser inte session state)."""
+    fingerprint: Tuple
+    mapping: Dict[str, str]
+    mer_table: Optional[MerTable]
+    store: ExportStore
+    df_main: Optional[pd.DataFrame]
+    source: Tuple
+    cached_pipeline: Optional[Tuple]
+    projected: Optional[Dict]
+    all_sheets_source: Optional[Dict]
+    per_sheet_detect: bool
+    stream_source: Optional[Dict]
+    parse_cache: FrameCache
+
+def validation_request(mapping: Dict[str, str], mer_table: Optional[MerTable],
+                       store: ExportStore, fingerprint: Tuple) -> ValidationRequest:
+    state = st.session_state
+    source = (state.get('main_file_hash') or id(state.df_main), state.get('selected_sheet'))
+    return ValidationRequest(
+        fingerprint=fingerprint,
+        mapping=dict(mapping),
+        mer_table=mer_table,
+        store=store,
+        df_main=state.df_main,
+        source=source,
+        cached_pipeline=state.get('validation_pipeline'),
+        projected=state.get('projected_source'),
+        all_sheets_source=state.get('all_sheets_source'),
+        per_sheet_detect=state.get('per_sheet_detect', False),
+        stream_source=state.get('stream_source'),
+        parse_cache=get_parse_cache(),
+    )
+
+def validation_pipeline(request: ValidationRequest, metrics: RunMetrics) -> Tuple[Tuple, ValidationPipeline]:
+    """
+    Sessionens valideringsgraf för den inlästa fliken (ny graf när fil eller flik byts).
+    Efter uppladdningen finns bara en förhandsgranskning - grafen får då de mappade
+    kolumnerna (fas två). Behöver mappningen en kolumn som inte lästs läses
+    kolumnerna om och grafen byggs om. Returnerar (källa, graf) att spara i sessionen.
+    """
+    source = request.source
+    cached = request.cached_pipeline
+    if cached is not None and cached[0] != source:
+        cached = None
+    projected = request.projected
+    if projected is None:
+        if cached is None:
+            cached = (source, ValidationPipeline(request.df_main))
+    else:
+        loaded = list(cached[1].df.columns) if cached is not None else []
+        needed = [col for col in mapped_columns(request.mapping) if col not in loaded]
+        if cached is None or needed:
+            columns = loaded + needed
+            with metrics.stage('column_read') as record:
+                df, _ = read_input_cached(projected['data'], source[0], projected['sheet'],
+                                          projected['kind'], columns, request.parse_cache)
+                record['rows'] = len(df)
+            missing = [col for col in columns if col not in df.columns]
+            if missing:
+                raise ValueError(f"Kolumner saknas i filen: {', '.join(missing)}")
+            cached = (source, ValidationPipeline(df))
+    return cached
+
+def run_validation(request: ValidationRequest, job: Job) -> Dict:
+    """
+    Valideringen som bakgrundsjobb. Förloppet drivs av faktiskt bearbetade rader.
+    Returnerar session state-värdena: valideringsresultatet (och valideringsgrafen).
+    """
+    mapping, mer_table = request.mapping, request.mer_table
+    metrics = RunMetrics('validation', on_progress=job.report)
+    updates = {}
+    duplicates = None
+    computed = []
     
-    with st.spinner("Processar data..."):
-        # Skapa progress bar
-        progress_bar = st.progress(0)
-        
-        # 1. Skapa arbetskolumner
-        progress_bar.progress(10)
-        
-        errors = []
-        warnings = []
-        
-        # 2. Hantera RFID (antingen från RFID-kolumn eller via MER-fil)
-        progress_bar.progress(20)
+    if request.all_sheets_source:
+        # Alla flikar parallellt - resultatet slås ihop med källflik per rad
+        job.step("Validerar flikar")
+        df_filtered, errors, warnings, sheet_overview = validate_workbook_sheets(
+            request.all_sheets_source['data'], request.all_sheets_source['sheets'], mapping, mer_table,
+            per_sheet_detect=request.per_sheet_detect, metrics=metrics
+        )
+    elif request.stream_source:
+        # Strömmande läsning - bara mappade kolumner, blockvis
+        job.step("Läser och validerar blockvis")
+        sheet_overview = None
+        metrics.total_rows = request.stream_source.get('rows') or 0
         
-        if mapping.get('rfid'):
-            # Direkt RFID
-            df['RFID_RAW'] = df[mapping['rfid']]
-        elif mapping.get('tagg_id'):
-            # Hämta RFID från MER-fil
-            if st.session_state.df_mer is None:
-                st.error("❌ MER-fil saknas men krävs för TAGG ID matchning")
-                return
+        with metrics.stage('excel_stream') as record:
+            def chunk_done(rows_done: int):
+                metrics.advance(rows_done - record['rows'])
+                record['rows'] = rows_done
             
-            df_mer = st.session_state.df_mer.copy()
-            
-            # Trimma kolumnnamn i MER-fil
-            df_mer.columns = df_mer.columns.str.strip()
-            
-            # Skapa mapping dictionary (normalisera TAGG ID till uppercase för matchning)
-            mer_mapping = {}
-            for idx, row in df_mer.iterrows():
-                tagg = str(row['Visible Number']).strip().upper()
-                rfid = str(row['Key/Card number']).strip().upper()
-                mer_mapping[tagg] = rfid
-            
-            # Matcha TAGG ID (normalisera till uppercase)
-            df['TAGG_ID_NORMALIZED'] = df[mapping['tagg_id']].apply(lambda x: str(x).strip().upper() if pd.notna(x) else '')
-            df['RFID_RAW'] = df['TAGG_ID_NORMALIZED'].map(mer_mapping)
-            
-            # Hitta omatchade
-            unmatched = df[df['RFID_RAW'].isna() & df[mapping['tagg_id']].notna()]
-            if len(unmatched) > 0:
-                st.warning(f"⚠️ {len(unmatched)} TAGG ID saknar matchning i MER-filen")
-                for idx, row in unmatched.iterrows():
-                    errors.append({
-                        'Rad': idx + 2,  # +2 för Excel-radnummer (header + 0-index)
-                        'Problem': 'TAGG ID saknas i MER-fil',
-                        'TAGG ID': row[mapping['tagg_id']],
-                        'Identifieringsnummer': row[mapping['identifier']] if not pd.isna(row[mapping['identifier']]) else 'Saknas'
-                    })
-        
-        progress_bar.progress(40)
-        
-        # 3. Rensa och validera RFID
-        df['RFID_VALID'] = False
-        df['RFID_CLEAN'] = ''
-        
-        for idx, row in df.iterrows():
-            if pd.notna(row['RFID_RAW']):
-                is_valid, clean_rfid = validate_hex(row['RFID_RAW'])
-                df.at[idx, 'RFID_VALID'] = is_valid
-                df.at[idx, 'RFID_CLEAN'] = clean_rfid
-                
-                if not is_valid:
-                    errors.append({
-                        'Rad': idx + 2,
-                        'Problem': 'Ogiltigt HEX-format',
-                        'RFID': row['RFID_RAW'],
-                        'Identifieringsnummer': row[mapping['identifier']] if not pd.isna(row[mapping['identifier']]) else 'Saknas'
-                    })
-        
-        progress_bar.progress(60)
-        
-        # 4. Hantera Identifieringsnummer
-        df['Identifieringsnummer'] = df[mapping['identifier']].apply(clean_data)
-        
-        # Varna om Identifieringsnummer saknas
-        missing_id = df[df['Identifieringsnummer'] == '']
-        if len(missing_id) > 0:
-            for idx, row in missing_id.iterrows():
-                warnings.append({
-                    'Rad': idx + 2,
-                    'Problem': 'Identifieringsnummer saknas',
-                    'RFID': row['RFID_CLEAN'] if row['RFID_CLEAN'] else 'Saknas',
-                    'Företag': row[mapping['company']] if mapping.get('company') and not pd.isna(row[mapping['company']]) else 'N/A'
-                })
-        
-        progress_bar.progress(80)
-        
-        # 5. Hantera företagsnamn
-        if mapping.get('company'):
-            df['Företag'] = df[mapping['company']].apply(clean_data)
-            df['Företag'] = df['Företag'].replace('', 'Utan_foretag')
-        else:
-            df['Företag'] = 'Alla'
-        
-        # 6. Ta bort tomma rader (där både RFID och Identifieringsnummer saknas)
-        df_filtered = df[~((df['RFID_CLEAN'] == '') & (df['Identifieringsnummer'] == ''))]
-        
-        # 7. Hitta duplicerade RFID
-        df_valid = df_filtered[df_filtered['RFID_VALID']]
-        duplicates = find_duplicates(df_valid, 'RFID_CLEAN')
+            df_filtered, errors, warnings = validate_excel_stream(
+                request.stream_source['data'], request.stream_source['sheet'], mapping, mer_table,
+                on_chunk=chunk_done
+            )
+    else:
+        # 2-7. Valideringssteg - bara steg vars indatakolumner ändrats räknas om
+        job.step("Läser mappade kolumner")
+        sheet_overview = None
+        entry = validation_pipeline(request, metrics)
+        pipeline = entry[1]
+        updates['validation_pipeline'] = entry
+        job.step("Validerar")
+        metrics.total_rows = len(pipeline.df) * len(pipeline.pending(mapping, mer_table))
+        results = pipeline.run(mapping, mer_table, metrics=metrics)
+        computed = list(pipeline.computed)
         
-        if len(duplicates) > 0:
-            st.warning(f"⚠️ {len(duplicates)} duplicerade RFID-nummer hittade")
-            
-            for rfid in duplicates['RFID_CLEAN'].unique():
-                dup_rows = df_filtered[df_filtered['RFID_CLEAN'] == rfid]
-                for idx, row in dup_rows.iterrows():
-                    warnings.append({
-                        'Rad': idx + 2,
-                        'Problem': 'Duplicerat RFID',
-                        'RFID': row['RFID_CLEAN'],
-                        'Identifieringsnummer': row['Identifieringsnummer']
-                    })
-        
-        progress_bar.progress(100)
-        
-        # Spara i session state
-        st.session_state.df_processed = df_filtered
-        st.session_state.errors = errors
-        st.session_state.warnings = warnings
+        with metrics.stage('issue_tables', rows=len(pipeline.df)):
+            df_filtered = non_empty_rows(pd.DataFrame(stage_columns(results))[RESULT_COLUMNS])
+            errors, warnings = stage_issues(pipeline.df, mapping, results)
+        duplicates = (results['duplicates']['summary'], results['duplicates']['warnings'])
+    
+    # 7. Hitta duplicerade RFID
+    job.step("Kontrollerar dubbletter och register")
+    if duplicates is None:
+        with metrics.stage('duplicates', rows=len(df_filtered)):
+            duplicates = check_duplicates(df_filtered)
+    duplicate_groups, duplicate_warnings = duplicates
+    
+    # 8. RFID som redan exporterats för ett annat företag (globala registret)
+    with metrics.stage('registry', rows=len(df_filtered)):
+        registry_warnings = registry_conflicts(df_filtered, request.store)
+    warnings = concat_issues([warnings, duplicate_warnings, registry_warnings])
+    
+    # 9. Förslag för TAGG ID som saknas i MER-filen (n-gram-index, byggs en gång per MER-data)
+    with metrics.stage('suggestions', rows=issue_counts(errors).get(PROBLEM_UNMATCHED_TAGG, 0)):
+        errors, suggestions = suggest_unmatched(errors, mer_table)
+    job.check()
+    
+    # Statistik beräknas en gång och sparas med resultatet
+    df_valid = df_filtered[df_filtered['RFID_VALID']]
+    result = {
+        'df_filtered': df_filtered,
+        'errors': errors,
+        'warnings': warnings,
+        'suggestions': suggestions,
+        'duplicate_groups': duplicate_groups,
+        'sheet_overview': sheet_overview,
+        'valid_rows': len(df_valid),
+        'unique_rfid': df_valid['RFID_CLEAN'].nunique(),
+        'company_counts': df_valid['Företag'].value_counts().loc[lambda counts: counts > 0],
+        'computed': computed,
+        'metrics': metrics.log(),
+    }
+    updates['validation_cache'] = (request.fingerprint, result)
+    return updates
+
+def session_owner() -> str:
+    """Sessionens id i jobbkön."""
+    if 'job_owner' not in st.session_state:
+        st.session_state.job_owner = uuid.uuid4().hex
+    return st.session_state.job_owner
+
+def reset_session():
+    """
+    Börja om med en ny fil. Sessionens referens till MER-filen i den delade
+    cachen släpps först - annars kan posten inte kastas förrän lånet gått ut.
+    """
+    if 'job_owner' in st.session_state:
+        get_mer_cache().release(st.session_state.job_owner)
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    st.session_state.step = 'instructions'
+
+def collect_job(job: Job):
+    """Spara ett klart jobbs resultat i sessionen och släpp jobbet."""
+    for name, value in job.result.items():
+        st.session_state[name] = value
+    st.session_state.jobs.pop(job.kind, None)
+    get_job_manager().forget(job.id)
+
+def collect_finished_jobs():
+    """Hämta resultat från jobb som blivit klara medan operatören var i ett annat steg."""
+    manager = get_job_manager()
+    for job_id in list(st.session_state.get('jobs', {}).values()):
+        job = manager.get(job_id)
+        if job is not None and job.status == JOB_DONE:
+            collect_job(job)
+
+def restart_job(kind: str):
+    st.session_state.get('jobs', {}).pop(kind, None)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress(job_id: str):
+    """Förloppet för ett jobb. Ritas om för sig själv tills jobbet är klart, sedan hela sidan."""
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    if job.status == JOB_QUEUED:
+        ahead = manager.queue_position(job)
+        st.progress(0.0, text=f"⏳ {job.label}: i kö" + (f" ({ahead} jobb före)" if ahead else ""))
+    elif job.cancelled:
+        st.progress(job.progress, text=f"⏹️ {job.label}: avbryter...")
+    else:
+        rows = f" - {job.rows_done:,} av {job.total_rows:,} rader".replace(',', ' ') if job.total_rows else ''
+        st.progress(job.progress, text=f"⚙️ {job.label}: {job.message or 'startar'}{rows}")
+    st.caption("Jobbet körs i bakgrunden - du kan byta steg, resultatet finns kvar när du kommer tillbaka.")
+    st.button("⏹️ Avbryt", key=f"cancel_{job.id}", on_click=manager.cancel, args=(job.id,),
+              disabled=job.cancelled)
+
+def session_job(kind: str, key, label: str, func: Callable[[Job], Dict]) -> bool:
+    """
+    Kör func som bakgrundsjobb för sessionen (ett jobb per slag och nyckel).
+    Korta jobb väntas in direkt. Returnerar True när resultatet finns i
+    session state, annars visas förlopp, fel eller avbrott och False returneras.
+    """
+    manager = get_job_manager()
+    jobs = st.session_state.setdefault('jobs', {})
+    job = manager.get(jobs.get(kind))
+    if job is None or job.key != key:
+        job = manager.submit(session_owner(), kind, key, label, func)
+        jobs[kind] = job.id
+    
+    if not job.wait(JOB_INLINE_SECONDS):
+        render_job_progress(job.id)
+        return False
+    if job.status == JOB_DONE:
+        collect_job(job)
+        return True
+    if job.status == JOB_FAILED:
+        st.error(f"❌ {job.label} misslyckades: {job.error}")
+    else:
+        st.info(f"⏹️ {job.label} avbröts")
+    st.button("🔄 Kör igen", key=f"restart_{kind}", on_click=restart_job, args=(kind,))
+    return False
+
+def render_job_sidebar():
+    """Sessionens pågående jobb och serverns kö i sidomenyn."""
+    manager = get_job_manager()
+    jobs = [manager.get(job_id) for job_id in st.session_state.get('jobs', {}).values()]
+    active = [job for job in jobs if job is not None and not job.done]
+    counts = manager.counts()
+    if not active and not counts[JOB_QUEUED]:
+        return
+    st.sidebar.markdown("---")
+    for job in active:
+        st.sidebar.caption(f"⚙️ {job.label}: {job.status.lower()} ({job.progress:.0%})")
+    st.sidebar.caption(f"🖥️ Servern: {counts[JOB_RUNNING]} jobb pågår, {counts[JOB_QUEUED]} i kö "
+                       f"(arbetstrådar: {manager.workers})")
+
+def validation_step():
+    st.title("✅ Validering & Datarensning")
+    
+    if st.session_state.df_main is None:
+        st.warning("⚠️ Ingen fil uppladdad. Vänligen gå tillbaka till 'Ladda upp fil'.")
+        return
+    
+    mapping = st.session_state.column_mapping
+    stream_source = st.session_state.get('stream_source')
+    all_sheets_source = st.session_state.get('all_sheets_source')
+    sheet_overview = None
+    
+    # TAGG ID slås bara upp mot sessionens egen MER-fil
+    mer_table = session_mer_table()
+    if mapping.get('tagg_id'):
+        if st.session_state.df_mer is None:
+            st.error("❌ MER-fil saknas men krävs för TAGG ID matchning")
+            return
+        if mer_table is None:
+            st.error("❌ MER-filen finns inte längre i MER-indexet - ladda upp den igen i mappningssteget")
+            return
+    elif not (all_sheets_source and st.session_state.get('per_sheet_detect')):
+        # Flikar kan detekteras som TAGG ID även om den gemensamma mappningen är HEX - annars behövs ingen tabell
+        mer_table = None
+    
+    store = get_export_store()
+    fingerprint = validation_fingerprint(mapping, mer_table, store)
+    cached = st.session_state.get('validation_cache')
+    if cached is None or cached[0] != fingerprint:
+        # Valideringen körs som bakgrundsjobb - sidan visar förloppet tills resultatet finns
+        request = validation_request(mapping, mer_table, store, fingerprint)
+        if not session_job('validation', fingerprint, "Validering",
+                           lambda job: run_validation(request, job)):
+            return
+        cached = st.session_state.validation_cache
+    result = cached[1]
+    computed = result.pop('computed', None)
+    if computed:
+        st.caption(f"🔄 Omräknade steg: {', '.join(computed)}")
+    elif computed is None:
+        st.caption("⚡ Indata, mappning och MER-data är oförändrade - visar senaste valideringen")
+    
+    df_filtered = result['df_filtered']
+    errors = result['errors']
+    warnings = result['warnings']
+    duplicate_groups = result['duplicate_groups']
+    sheet_overview = result['sheet_overview']
+    duplicate_rows = int(duplicate_groups['Antal'].sum())
+    duplicate_conflicts = int((duplicate_groups['Typ'] == DUPLICATE_CONFLICT).sum())
+    
+    unmatched_count = issue_counts(errors).get(PROBLEM_UNMATCHED_TAGG, 0)
+    if unmatched_count > 0:
+        st.warning(f"⚠️ {unmatched_count} TAGG ID saknar matchning i MER-filen")
+    if duplicate_rows > 0:
+        st.warning(f"⚠️ {duplicate_rows} duplicerade RFID-nummer hittade "
+                   f"({len(duplicate_groups)} RFID, varav {duplicate_conflicts} med olika identifieringsnummer)")
+    registry_count = issue_counts(warnings).get(PROBLEM_REGISTRY_CONFLICT, 0)
+    if registry_count > 0:
+        st.warning(f"⚠️ {registry_count} RFID har redan exporterats för ett annat företag "
+                   "(se varningarna för tidigare företag och exporttid)")
+    
+    # Spara i session state
+    st.session_state.df_processed = df_filtered
+    st.session_state.errors = errors
+    st.session_state.warnings = warnings
     
     # Visa resultat
     st.markdown("---")
     st.markdown("### 📊 Valideringsresultat")
     
+    if sheet_overview is not None:
+        with st.expander(f"📚 Flikar ({len(sheet_overview)})",
+                         expanded=bool((sheet_overview['Status'] != 'OK').any())):
+            st.dataframe(sheet_overview, use_container_width=True, hide_index=True)
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        total_rows = len(df_filtered[df_filtered['RFID_VALID']])
-        st.metric("✅ Giltiga rader", total_rows)
+        st.metric("✅ Giltiga rader", result['valid_rows'])
     
     with col2:
         st.metric("❌ Fel", len(errors))
@@ -775,6 +3443,8 @@ def validation_step():
     with col3:
         st.metric("⚠️ Varningar", len(warnings))
     
+    render_accepted_aliases()
+    
     # Visa fel
     if len(errors) > 0:
         st.markdown("### ❌ Fel som måste åtgärdas")
@@ -784,14 +3454,15 @@ def validation_step():
         </div>
         """, unsafe_allow_html=True)
         
-        df_errors = pd.DataFrame(errors)
-        st.dataframe(df_errors, use_container_width=True)
+        render_issue_table(errors, 'errors')
+        
+        if len(result['suggestions']) > 0:
+            render_suggestions(result['suggestions'])
         
         # Möjlighet att ladda ner felrapport
-        csv_errors = df_errors.to_csv(index=False, encoding='utf-8-sig')
         st.download_button(
             label="📥 Ladda ner felrapport (CSV)",
-            data=csv_errors,
+            data=issues_csv(errors, 'errors'),
             file_name="felrapport.csv",
             mime="text/csv"
         )
@@ -805,28 +3476,45 @@ def validation_step():
         </div>
         """, unsafe_allow_html=True)
         
-        df_warnings = pd.DataFrame(warnings)
-        st.dataframe(df_warnings, use_container_width=True)
+        render_issue_table(warnings, 'warnings')
+        
+        if len(duplicate_groups) > 0:
+            with st.expander(f"🔁 Dubblettanalys ({len(duplicate_groups)} RFID)"):
+                st.caption(f"**{DUPLICATE_REPEAT}:** samma RFID och samma identifieringsnummer (ofarlig). "
+                           f"**{DUPLICATE_CONFLICT}:** samma RFID med olika identifieringsnummer.")
+                # Konflikter först
+                is_conflict = duplicate_groups['Typ'] == DUPLICATE_CONFLICT
+                st.dataframe(
+                    pd.concat([duplicate_groups[is_conflict], duplicate_groups[~is_conflict]]),
+                    use_container_width=True, hide_index=True
+                )
+        
+        st.download_button(
+            label="📥 Ladda ner varningsrapport (CSV)",
+            data=issues_csv(warnings, 'warnings'),
+            file_name="varningsrapport.csv",
+            mime="text/csv"
+        )
     
     # Statistik
     st.markdown("### 📈 Statistik")
     
-    if len(df_filtered[df_filtered['RFID_VALID']]) > 0:
+    if result['valid_rows'] > 0:
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown("**RFID-information:**")
-            unique_rfid = df_filtered[df_filtered['RFID_VALID']]['RFID_CLEAN'].nunique()
-            st.write(f"- Unika RFID: {unique_rfid}")
-            st.write(f"- Totala rader: {len(df_filtered[df_filtered['RFID_VALID']])}")
-            st.write(f"- Duplicat: {len(duplicates)}")
+            st.write(f"- Unika RFID: {result['unique_rfid']}")
+            st.write(f"- Totala rader: {result['valid_rows']}")
+            st.write(f"- Duplicat: {duplicate_rows}")
         
         with col2:
             st.markdown("**Företagsfördelning:**")
-            company_counts = df_filtered[df_filtered['RFID_VALID']]['Företag'].value_counts()
-            for company, count in company_counts.items():
+            for company, count in result['company_counts'].items():
                 st.write(f"- {company}: {count} rader")
     
+    render_metrics(result['metrics'], 'validation')
+    
     # Nästa steg
     st.markdown("---")
     
@@ -838,6 +3526,168 @@ def validation_step():
     else:
         st.error("❌ Åtgärda fel innan du kan fortsätta till export.")
 
+def accept_suggestions(aliases: Dict[str, str]):
+    """
+    Acceptera förslag för sessionens MER-fil (TAGG ID → MER-ID). De gäller bara
+    sessionen och filen - valideringen körs om vid nästa omritning.
+    """
+    accepted = st.session_state.setdefault('mer_aliases', {})
+    accepted[st.session_state.mer_hash] = {**accepted.get(st.session_state.mer_hash, {}), **aliases}
+    st.toast(f"✅ {len(aliases)} förslag accepterade - TAGG ID matchas nu mot föreslaget MER-ID")
+
+def remove_aliases(tagg_ids: List[str]):
+    """Ta bort accepterade förslag för sessionens MER-fil - valideringen körs om vid nästa omritning."""
+    accepted = st.session_state.setdefault('mer_aliases', {})
+    remaining = {tagg: key for tagg, key in accepted.get(st.session_state.mer_hash, {}).items() if tagg not in tagg_ids}
+    accepted[st.session_state.mer_hash] = remaining
+    st.toast(f"🗑️ {len(tagg_ids)} accepterade förslag borttagna")
+
+def render_accepted_aliases():
+    """Förslag som accepterats för sessionens MER-fil, med ta bort-knapp per ID och för alla."""
+    aliases = st.session_state.get('mer_aliases', {}).get(st.session_state.get('mer_hash'), {})
+    if not aliases:
+        return
+    
+    with st.expander(f"✔️ Accepterade förslag ({len(aliases)})"):
+        st.caption("Accepterade förslag gäller bara den här sessionen och MER-filen. "
+                   "Ta bort ett förslag för att slå upp TAGG ID precis som i MER-filen igen.")
+        st.button(f"🗑️ Ta bort alla accepterade förslag ({len(aliases)})", on_click=remove_aliases,
+                  args=(list(aliases),), key="remove_all_aliases")
+        for tagg_id, mer_id in list(aliases.items())[:SUGGEST_UI_ROWS]:
+            col1, col2, col3 = st.columns([3, 3, 1])
+            col1.write(f"`{tagg_id}`")
+            col2.write(f"→ `{mer_id}`")
+            col3.button("🗑️", key=f"remove_alias_{tagg_id}", help="Ta bort det accepterade förslaget",
+                        on_click=remove_aliases, args=([tagg_id],))
+        if len(aliases) > SUGGEST_UI_ROWS:
+            st.caption(f"Visar {SUGGEST_UI_ROWS} av {len(aliases)} accepterade förslag.")
+
+def render_suggestions(suggestions: pd.DataFrame):
+    """Förslag för TAGG ID utan träff, med acceptera-knapp per ID och för alla säkra förslag."""
+    best = suggestions.drop_duplicates('TAGG ID')
+    safe = best[best['Orsak'] != SUGGEST_REASON_SIMILAR]
+    
+    with st.expander(f"🔎 Förslag för TAGG ID utan träff ({len(best)})", expanded=True):
+        st.caption(f"**{SUGGEST_REASON_FORMAT}** och **{SUGGEST_REASON_SUFFIX}** är säkra förslag. "
+                   f"**{SUGGEST_REASON_SIMILAR}** kan vara ett annat kort - kontrollera innan du accepterar. "
+                   "Accepterade förslag gäller bara den här sessionen och MER-filen.")
+        if len(safe) > 0:
+            st.button(
+                f"✅ Acceptera alla säkra förslag ({len(safe)})",
+                on_click=accept_suggestions,
+                args=(dict(zip(safe['TAGG ID'], safe['Förslag'])),),
+                type="primary",
+                key="accept_safe_suggestions"
+            )
+        
+        for row in best.head(SUGGEST_UI_ROWS).itertuples(index=False):
+            tagg_id, suggestion, distance, reason = row
+            col1, col2, col3, col4 = st.columns([3, 3, 3, 1])
+            col1.write(f"`{tagg_id}`")
+            col2.write(f"→ `{suggestion}`")
+            others = suggestions.loc[(suggestions['TAGG ID'] == tagg_id) & (suggestions['Förslag'] != suggestion),
+                                     'Förslag']
+            col3.caption(f"{reason} (avstånd {distance})"
+                         + (f" · även: {', '.join(others)}" if len(others) > 0 else ''))
+            col4.button("✅", key=f"accept_suggestion_{tagg_id}", help="Acceptera förslaget",
+                        on_click=accept_suggestions, args=({tagg_id: suggestion},))
+        if len(best) > SUGGEST_UI_ROWS:
+            st.caption(f"Visar {SUGGEST_UI_ROWS} av {len(best)} TAGG ID - alla förslag finns i felrapportens kolumn Förslag.")
+
+def render_metrics(metrics: Dict, key: str):
+    """Tidsåtgång, rader och minnestopp per steg för en körning, med JSON-export."""
+    with st.expander(f"⏱️ Tidsåtgång per steg ({metrics['seconds']:.2f} s)"):
+        stages = pd.DataFrame(metrics['stages'], columns=['stage', 'rows', 'seconds', 'peak_mb'])
+        stages.columns = ['Steg', 'Rader', 'Sekunder', 'Minnestopp (MB)']
+        if metrics['seconds'] > 0:
+            stages['Andel'] = (stages['Sekunder'] / metrics['seconds']).map('{:.0%}'.format)
+        st.dataframe(stages, use_container_width=True, hide_index=True)
+        st.caption(f"Körning startad {metrics['started']}. Minnestopp = processens högsta RSS efter steget.")
+        st.download_button(
+            label="📥 Ladda ner mätvärden (JSON)",
+            data=json.dumps(metrics, ensure_ascii=False, indent=2),
+            file_name=f"matvarden_{key}.json",
+            mime="application/json",
+            key=f"{key}_metrics_download"
+        )
+
+def issues_csv(issues: pd.DataFrame, key: str) -> str:
+    """Hela fel-/varningsrapporten som CSV (skapas en gång per rapport)."""
+    cached = st.session_state.get(f'{key}_csv')
+    if cached is None or cached[0] is not issues:
+        cached = (issues, issues.to_csv(index=False, encoding='utf-8-sig'))
+        st.session_state[f'{key}_csv'] = cached
+    return cached[1]
+
+def render_issue_table(issues: pd.DataFrame, key: str, page_sizes: Tuple[int, ...] = (25, 50, 100, 250)):
+    """
+    Visa fel eller varningar paginerat och filtrerbart.
+    Bara den synliga sidan skickas till webbläsaren.
+    """
+    counts = issue_counts(issues)
+    
+    # Antal per problemtyp
+    for col, (problem, count) in zip(st.columns(len(counts)), counts.items()):
+        with col:
+            st.metric(problem, count)
+    
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        problems = st.multiselect("Problemtyp", list(counts), default=list(counts), key=f"{key}_problems")
+    with col2:
+        query = st.text_input("Sök", key=f"{key}_search",
+                              placeholder="RFID, TAGG ID, Identifieringsnummer...")
+    with col3:
+        page_size = st.selectbox("Rader per sida", page_sizes, key=f"{key}_page_size")
+    
+    mask = issues['Problem'].isin(problems)
+    if query:
+        query_mask = pd.Series(False, index=issues.index)
+        for column in issues.columns.drop(['Rad', 'Problem']):
+            query_mask |= issues[column].astype(str).str.contains(query, case=False, regex=False, na=False)
+        mask &= query_mask
+    positions = mask.to_numpy().nonzero()[0]
+    total = len(positions)
+    
+    pages = max(1, -(-total // page_size))
+    # Sidnumret finns bara i session state (inget value=) och hålls inom intervallet när filtret ändras
+    page_key = f"{key}_page"
+    st.session_state[page_key] = min(max(st.session_state.get(page_key, 1), 1), pages)
+    page = st.number_input(f"Sida (av {pages})", min_value=1, max_value=pages, key=page_key)
+    
+    start = (page - 1) * page_size
+    page_positions = positions[start:start + page_size]
+    st.dataframe(issues.iloc[page_positions], use_container_width=True, hide_index=True)
+    if total > 0:
+        st.caption(f"Visar {start + 1}–{start + len(page_positions)} av {total} rader "
+                   f"({len(issues)} totalt)")
+    else:
+        st.caption("Inga rader matchar filtret")
+
+def run_export(df: pd.DataFrame, export_key: Tuple, store: ExportStore, job: Job) -> Dict:
+    """CSV-filer per företag (och delta) samt ZIP som bakgrundsjobb. Returnerar export_cache."""
+    delta_mode = export_key[0]
+    df_valid = df[df['RFID_VALID']]
+    metrics = RunMetrics('export', total_rows=len(df_valid))
+    steps = 3 if delta_mode else 2
+    job.step("Skapar CSV-filer")
+    with metrics.stage('csv_export', rows=len(df_valid)):
+        csv_files = build_company_csvs(df_valid)
+    job.report(len(df_valid), len(df_valid) * steps)
+    delta_files, delta_summary = {}, None
+    if delta_mode:
+        job.step("Jämför med senaste provisionering")
+        with metrics.stage('delta_export', rows=len(df_valid)):
+            delta_files, delta_summary = build_delta_csvs(df_valid, store)
+        job.report(len(df_valid) * 2, len(df_valid) * steps)
+    job.step("Packar ZIP")
+    with metrics.stage('zip_export', rows=len(df_valid)):
+        zip_buffer = io.BytesIO()
+        manifest = write_export_zip({**csv_files, **delta_files}, zip_buffer)
+    metrics.advance(len(df_valid))
+    return {'export_cache': (df, export_key, csv_files, delta_files, delta_summary, manifest,
+                             zip_buffer.getvalue(), metrics.log())}
+
 def result_step():
     st.title("📥 Resultat & Nedladdning")
     
@@ -846,7 +3696,7 @@ def result_step():
         return
     
     df = st.session_state.df_processed
-    df_valid = df[df['RFID_VALID']].copy()
+    df_valid = df[df['RFID_VALID']]
     
     if len(df_valid) == 0:
         st.error("❌ Inga giltiga rader att exportera.")
@@ -855,10 +3705,15 @@ def result_step():
     # Förhandsgranska data
     st.markdown("### 👀 Förhandsgranska exportdata")
     
-    preview_df = df_valid[['RFID_CLEAN', 'Identifieringsnummer', 'Företag']].copy()
-    preview_df.columns = ['RFID', 'Identifieringsnummer', 'Företag']
+    preview_columns = ['RFID_CLEAN', 'Identifieringsnummer', 'Företag']
+    if SHEET_COLUMN in df_valid.columns:
+        preview_columns.append(SHEET_COLUMN)
+    preview_df = df_valid[preview_columns].head(PREVIEW_ROWS)
+    preview_df = preview_df.rename(columns={'RFID_CLEAN': 'RFID'})
     
     st.dataframe(preview_df, use_container_width=True)
+    if len(df_valid) > PREVIEW_ROWS:
+        st.caption(f"Visar de första {PREVIEW_ROWS} av {len(df_valid)} rader")
     
     # Generera CSV-filer
     st.markdown("---")
@@ -871,55 +3726,76 @@ def result_step():
     else:
         st.info(f"📄 {len(companies)} filer kommer att genereras (en per företag)")
     
-    # Skapa CSV-filer
-    csv_files = {}
+    store = get_export_store()
+    delta_mode = st.checkbox(
+        "🔀 Deltaexport mot senast provisionerade lista",
+        value=st.session_state.get('delta_mode', False),
+        help="Jämför varje företags lista med den som senast markerades som provisionerad och skapar "
+             "en delta-CSV (RFID;Identifieringsnummer;Ändring) med tillagda, ändrade och borttagna kort "
+             "bredvid de fullständiga filerna."
+    )
+    st.session_state.delta_mode = delta_mode
     
-    for company in companies:
-        company_data = df_valid[df_valid['Företag'] == company][['RFID_CLEAN', 'Identifieringsnummer']].copy()
-        company_data.columns = ['RFID', 'Identifieringsnummer']
-        
-        # Ta bort duplicat (behåll första)
-        company_data = company_data.drop_duplicates(subset=['RFID'], keep='first')
-        
-        # Skapa CSV med semikolon och UTF-8 BOM
-        csv_buffer = io.StringIO()
-        company_data.to_csv(csv_buffer, index=False, sep=';', encoding='utf-8-sig')
-        csv_string = csv_buffer.getvalue()
-        
-        # Generera filnamn
-        if company == 'Alla':
-            filename = "output.csv"
-        else:
-            filename = f"{sanitize_filename(company)}.csv"
-        
-        csv_files[filename] = csv_string.encode('utf-8-sig')
+    # Skapa CSV-filer och ZIP (en gång per valideringsresultat och provisionering, i bakgrunden)
+    export_key = (delta_mode, store.revision if delta_mode else None)
+    export = st.session_state.get('export_cache')
+    if export is None or export[0] is not df or export[1] != export_key:
+        if not session_job('export', (id(df), export_key), "Export",
+                           lambda job: run_export(df, export_key, store, job)):
+            return
+        export = st.session_state.export_cache
+    _, _, csv_files, delta_files, delta_summary, manifest, zip_data, export_metrics = export
     
-    # Visa nedladdningsknappar
-    st.markdown("### 📥 Ladda ner filer")
+    if delta_mode:
+        st.markdown("### 🔀 Ändringar mot senaste provisionering")
+        st.dataframe(delta_summary, use_container_width=True, hide_index=True)
     
-    cols = st.columns(min(len(csv_files), 3))
+    def mark_provisioned():
+        save_provisioned(df_valid, store, csv_files)
+        st.toast(f"✅ {len(csv_files)} lista(or) sparade som provisionerade")
     
-    for idx, (filename, csv_data) in enumerate(csv_files.items()):
-        col = cols[idx % len(cols)]
+    st.button(
+        "💾 Markera exporten som provisionerad",
+        on_click=mark_provisioned,
+        help="Sparar företagens listor i RFID-registret och som jämförelsegrund för nästa "
+             "deltaexport. Gör detta när filerna har lästs in i laddarna."
+    )
+    
+    # Visa nedladdning
+    st.markdown("### 📥 Ladda ner filer")
+    
+    if len(csv_files) == 1 and not delta_files:
+        company_csv = next(iter(csv_files.values()))
+        st.markdown(f"""
+        <div style='background-color: white; padding: 1rem; border-radius: 5px; border: 1px solid {CHARGENODE_LIGHT}; margin-bottom: 1rem;'>
+            <h4 style='margin: 0; color: {CHARGENODE_GREEN};'>{company_csv.filename}</h4>
+            <p style='margin: 0.5rem 0; color: {CHARGENODE_DARK};'>{company_csv.rows} rader</p>
+        </div>
+        """, unsafe_allow_html=True)
         
-        with col:
-            # Räkna rader i filen
-            row_count = csv_data.decode('utf-8-sig').count('\n') - 1
-            
-            st.markdown(f"""
-            <div style='background-color: white; padding: 1rem; border-radius: 5px; border: 1px solid {CHARGENODE_LIGHT}; margin-bottom: 1rem;'>
-                <h4 style='margin: 0; color: {CHARGENODE_GREEN};'>{filename}</h4>
-                <p style='margin: 0.5rem 0; color: {CHARGENODE_DARK};'>{row_count} rader</p>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.download_button(
-                label=f"⬇️ Ladda ner {filename}",
-                data=csv_data,
-                file_name=filename,
-                mime="text/csv",
-                key=f"download_{filename}"
-            )
+        st.download_button(
+            label=f"⬇️ Ladda ner {company_csv.filename}",
+            data=company_csv.data,
+            file_name=company_csv.filename,
+            mime="text/csv",
+            key=f"download_{company_csv.filename}"
+        )
+    else:
+        st.download_button(
+            label=f"⬇️ Ladda ner alla {len(csv_files) + len(delta_files)} filer (ZIP)",
+            data=zip_data,
+            file_name="rfid_export.zip",
+            mime="application/zip",
+            type="primary",
+            key="download_zip"
+        )
+        st.caption("ZIP-filen innehåller en CSV per företag"
+                   f"{' och dess delta-CSV' if delta_files else ''}"
+                   " samt manifest.json (filnamn, rader och SHA-256)")
+        
+        df_manifest = pd.DataFrame(manifest)[['file', 'company', 'rows', 'sha256']]
+        df_manifest.columns = ['Fil', 'Företag', 'Rader', 'SHA-256']
+        st.dataframe(df_manifest, use_container_width=True, hide_index=True)
     
     # Sammanfattning
     st.markdown("---")
@@ -943,21 +3819,1229 @@ def result_step():
     if len(st.session_state.errors) > 0:
         st.info(f"ℹ️ {len(st.session_state.errors)} rader exkluderades på grund av fel")
     
+    render_metrics(export_metrics, 'export')
+    
     # Starta om knapp
     st.markdown("---")
     if st.button("🔄 Processera ny fil"):
-        # Rensa session state
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
-        st.session_state.step = 'instructions'
+        reset_session()
         st.rerun()
 
-if __name__ == "__main__":
-    st.set_page_config(
-        page_title="ChargeNode - RFID CSV Converter",
-        page_icon="🔌",
-        layout="wide",
-        initial_sidebar_state="expanded"
+# ---------------------------------------------------------------------------
+# Batchläge utan webbgränssnitt: python -m rfid_converter batch ...
+# ---------------------------------------------------------------------------
+
+# Exit-koder för batchläget
+EXIT_OK = 0
+EXIT_ERRORS = 1
+EXIT_FAILED = 2
+
+# MER-index per arbetsprocess (öppnas en gång per process)
+_WORKER_MER_INDEXES = {}
+
+def _worker_mer_index(path: str) -> MerIndex:
+    if path not in _WORKER_MER_INDEXES:
+        _WORKER_MER_INDEXES[path] = MerIndex(path)
+    return _WORKER_MER_INDEXES[path]
+
+def _worker_mer_table(path: str, source: str, aliases: Optional[Dict[str, str]] = None) -> Optional[MerTable]:
+    """MER-tabell för en fil i indexet, med alias ovanpå."""
+    table = _worker_mer_index(path).table(source)
+    if table is not None and aliases:
+        table = table.with_aliases(aliases)
+    return table
+
+def parse_mapping_spec(spec: Optional[str], allow_files: bool = True) -> Optional[Dict[str, str]]:
+    """
+    Tolka en mappningsspecifikation: sökväg till JSON-fil, JSON-sträng eller
+    'rfid=Kolumn,identifier=Kolumn,company=Kolumn'. None betyder auto-detektering.
+    allow_files=False för specifikationer utifrån (HTTP-API:t) - då läses inga filer.
+    """
+    if not spec:
+        return None
+    if allow_files and os.path.isfile(spec):
+        with open(spec, encoding='utf-8') as f:
+            mapping = json.load(f)
+    elif spec.lstrip().startswith('{'):
+        mapping = json.loads(spec)
+    else:
+        mapping = {}
+        for part in spec.split(','):
+            key, sep, value = part.partition('=')
+            if not sep:
+                raise ValueError(f"Ogiltig mappning: '{part}' (förväntat nyckel=kolumn)")
+            mapping[key.strip()] = value.strip()
+    
+    unknown = [key for key in mapping if key not in MAPPING_KEYS]
+    if unknown:
+        raise ValueError(f"Okända mappningsnycklar: {', '.join(unknown)}")
+    return {key: mapping.get(key) or None for key in MAPPING_KEYS}
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+    """Expandera kataloger och glob-mönster till en sorterad lista med indatafiler."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = [path for extension in INPUT_TYPES
+                       for path in glob.glob(os.path.join(item, f'*.{extension}'))]
+        else:
+            matches = glob.glob(item) or [item]
+        for path in sorted(matches):
+            # Hoppa över Excels låsfiler
+            if not os.path.basename(path).startswith('~$') and path not in paths:
+                paths.append(path)
+    return paths
+
+def _validate_single_sheet(data: bytes, kind: str, mapping: Optional[Dict[str, str]], sheet_name: Optional[str],
+                           mer, metrics: RunMetrics) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, int, Dict[str, str]]:
+    """Läs och validera en flik. Returnerar (df_filtered, fel, varningar, antal rader, mappning)."""
+    if mapping is None:
+        with metrics.stage('detect') as record:
+            preview = read_input_preview(data, kind, sheet_name or None)
+            preview.columns = preview.columns.str.strip()
+            record['rows'] = len(preview)
+            mapping = dict(auto_detect_columns(preview))
+        if mapping.get('rfid'):
+            mapping['tagg_id'] = None
+    
+    # Bara de mappade kolumnerna läses
+    with metrics.stage('parse') as record:
+        df = read_input_columns(data, kind, mapped_columns(mapping), sheet_name or None)
+        record['rows'] = len(df)
+    
+    problems = mapping_problems(mapping)
+    missing = [col for col in mapped_columns(mapping) if col not in df.columns]
+    if missing:
+        problems.append(f"Kolumner saknas i filen: {', '.join(missing)}")
+    if problems:
+        raise ValueError('; '.join(problems))
+    
+    mer_table = _resolve_mer_table(mer) if mapping.get('tagg_id') else None
+    if mapping.get('tagg_id') and (mer_table is None or len(mer_table) == 0):
+        raise ValueError("MER-fil saknas men krävs för TAGG ID matchning")
+    
+    df_filtered, errors, warnings = validate_frame(df, mapping, mer_table, metrics)
+    return df_filtered, errors, warnings, len(df), mapping
+
+def _new_report(source: str, sheet_name: Optional[str], mapping: Optional[Dict[str, str]]) -> Dict:
+    return {
+        'input': source,
+        'sheet': sheet_name,
+        'mapping': mapping,
+        'status': 'failed',
+        'errors': [],
+        'warnings': [],
+        'files': [],
+        'recorded': False,
+    }
+
+def convert_data(data: bytes, source: str, mapping: Optional[Dict[str, str]], sheet_name: Optional[str],
+                 mer=None, allow_errors: bool = False,
+                 all_sheets: bool = False, export_store_path: Optional[str] = None,
+                 delta: bool = False, record: bool = False, export: bool = True,
+                 run: str = 'batch') -> Tuple[Dict, Dict[str, CompanyCsv]]:
+    """
+    Validera en fil i minnet (source är filnamnet, filformatet tas från ändelsen)
+    och bygg CSV-filerna. mer är en MerTable eller en referens (MerTable.ref)
+    som bara slås upp om filen har TAGG ID. Med all_sheets valideras alla flikar och slås ihop
+    (mappning per flik om ingen mappning anges). Med export_store_path
+    kontrolleras RFID mot registret; med delta byggs även delta-CSV:er mot de
+    senast provisionerade listorna. De byggda listorna sparas som provisionerade
+    bara med record (som knappen i webbgränssnittet). export=False ger bara diagnostiken.
+    Returnerar (rapport, {filnamn: CompanyCsv}).
+    """
+    report = _new_report(source, sheet_name, mapping)
+    files = {}
+    metrics = RunMetrics(run)
+    try:
+        kind = input_kind(source)
+        if all_sheets and kind == 'excel':
+            # Flikarna i en fil körs i följd - filerna är redan fördelade över processer
+            df_filtered, errors, warnings, overview = validate_workbook_sheets(
+                data, excel_sheet_names(data, file_hash(data))[0], mapping, mer,
+                per_sheet_detect=mapping is None, parallel=False, metrics=metrics
+            )
+            report['sheets'] = records_to_json(overview.to_dict('records'))
+            rows = int(overview['Rader'].sum())
+        else:
+            df_filtered, errors, warnings, rows, mapping = _validate_single_sheet(
+                data, kind, mapping, sheet_name, mer, metrics
+            )
+            report['mapping'] = mapping
+        
+        with metrics.stage('duplicates', rows=len(df_filtered)):
+            duplicate_groups, duplicate_warnings = check_duplicates(df_filtered)
+        store = ExportStore(export_store_path) if export_store_path else None
+        registry_warnings = concat_issues([])
+        if store is not None:
+            with metrics.stage('registry', rows=len(df_filtered)):
+                registry_warnings = registry_conflicts(df_filtered, store)
+        warnings = concat_issues([warnings, duplicate_warnings, registry_warnings])
+        
+        if mer is not None and PROBLEM_UNMATCHED_TAGG in issue_counts(errors):
+            with metrics.stage('suggestions'):
+                errors, suggestions = suggest_unmatched(errors, _resolve_mer_table(mer))
+            report['suggestions'] = records_to_json(suggestions.to_dict('records'))
+        
+        report['errors'] = records_to_json(errors.to_dict('records'))
+        report['warnings'] = records_to_json(warnings.to_dict('records'))
+        report['error_counts'] = issue_counts(errors)
+        report['warning_counts'] = issue_counts(warnings)
+        report['duplicate_groups'] = len(duplicate_groups)
+        report['duplicate_conflicts'] = int((duplicate_groups['Typ'] == DUPLICATE_CONFLICT).sum())
+        report['rows'] = rows
+        report['valid_rows'] = int(df_filtered['RFID_VALID'].sum())
+        report['status'] = 'errors' if len(errors) > 0 else 'ok'
+        
+        # Fel blockerar export precis som i webbgränssnittet
+        df_valid = df_filtered[df_filtered['RFID_VALID']]
+        if export and (len(errors) == 0 or allow_errors) and len(df_valid) > 0:
+            with metrics.stage('csv_export', rows=len(df_valid)):
+                csv_files = build_company_csvs(df_valid)
+            delta_files = {}
+            if store is not None and delta:
+                with metrics.stage('delta_export', rows=len(df_valid)):
+                    delta_files, delta_summary = build_delta_csvs(df_valid, store)
+                report['delta'] = records_to_json(delta_summary.to_dict('records'))
+            if store is not None and record:
+                save_provisioned(df_valid, store, csv_files)
+                report['recorded'] = True
+            files = {**csv_files, **delta_files}
+            report['files'] = export_manifest(files)
+    except Exception as e:
+        report['status'] = 'failed'
+        report['message'] = str(e)
+        files = {}
+    report['metrics'] = metrics.log()
+    return report, files
+
+def convert_file(path: str, mapping: Optional[Dict[str, str]], sheet_name: Optional[str],
+                 output_dir: str, mer_index_path: Optional[str] = None,
+                 allow_errors: bool = False, all_sheets: bool = False,
+                 export_store_path: Optional[str] = None, delta: bool = False, record: bool = False,
+                 output_name: Optional[str] = None, mer_source: Optional[str] = None) -> Dict:
+    """
+    Kör hela kedjan (uppladdning → mappning → validering → resultat) för en fil
+    och skriv CSV-filerna per företag och en JSON-rapport (se convert_data).
+    TAGG ID slås upp mot MER-filen mer_source i indexet (utan den kan TAGG ID inte matchas).
+    output_name ersätter filnamnet som namn på utdatakatalogen och rapporten.
+    Returnerar rapporten.
+    """
+    stem = output_name or os.path.splitext(os.path.basename(path))[0]
+    target_dir = os.path.join(output_dir, sanitize_filename(stem) or 'fil')
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        report, files = _new_report(path, sheet_name, mapping), {}
+        report['message'] = str(e)
+    else:
+        mer = (mer_index_path, mer_source, {}) if mer_index_path and mer_source else None
+        report, files = convert_data(data, path, mapping, sheet_name, mer, allow_errors,
+                                     all_sheets, export_store_path, delta, record)
+    
+    if files:
+        os.makedirs(target_dir, exist_ok=True)
+        for company_csv in files.values():
+            with open(os.path.join(target_dir, company_csv.filename), 'wb') as f:
+                f.write(company_csv.data)
+        for entry in report['files']:
+            entry['file'] = os.path.join(target_dir, entry['file'])
+    
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, f"{sanitize_filename(stem) or 'fil'}.report.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    report['report'] = report_path
+    return report
+
+def read_mer_frame(data: bytes, filename: str) -> pd.DataFrame:
+    """Läs MER-kolumnerna ur en MER-fil (fel om någon saknas)."""
+    df_mer = read_input_columns(data, input_kind(filename), MER_COLUMNS)
+    missing_cols = [col for col in MER_COLUMNS if col not in df_mer.columns]
+    if missing_cols:
+        raise ValueError(f"Följande kolumner saknas i MER-filen: {', '.join(missing_cols)}")
+    return df_mer
+
+def read_mer_table(data: bytes, filename: str) -> Tuple[MerTable, pd.DataFrame]:
+    """
+    En MER-fil som egen uppslagstabell i minnet - det delade MER-indexet
+    ändras inte. Returnerar (tabellen, motstridiga mappningar i filen).
+    """
+    mer_index, mer_hash = MerIndex(':memory:'), file_hash(data)
+    conflicts = mer_index.ingest(read_mer_frame(data, filename), mer_hash, os.path.basename(filename))
+    return mer_index.table(mer_hash), conflicts
+
+def ingest_mer_data(data: bytes, filename: str, mer_index_path: str,
+                    owner: Optional[str] = None) -> Tuple[str, pd.DataFrame]:
+    """
+    Lägg in en MER-fil (i minnet) i MER-indexet. En fil som redan finns läses
+    inte om. Med owner låses filen för den processen (se MerIndex.pin).
+    Returnerar (filens hash, motstridiga mappningar).
+    """
+    mer_index = MerIndex(mer_index_path)
+    mer_hash = file_hash(data)
+    conflicts = pd.DataFrame(columns=MER_CONFLICT_COLUMNS)
+    if not mer_index.has_source(mer_hash):
+        conflicts = mer_index.ingest(read_mer_frame(data, filename), mer_hash, os.path.basename(filename))
+    if owner is not None:
+        mer_index.pin(mer_hash, owner)
+    return mer_hash, conflicts
+
+def ingest_mer_file(path: str, mer_index_path: str, owner: Optional[str] = None) -> Tuple[str, pd.DataFrame]:
+    """Läs en MER-fil och uppdatera MER-indexet. Returnerar (filens hash, motstridiga mappningar)."""
+    with open(path, 'rb') as f:
+        return ingest_mer_data(f.read(), path, mer_index_path, owner)
+
+def run_batch(args: argparse.Namespace) -> int:
+    """Konvertera alla angivna filer parallellt. Returnerar exit-kod."""
+    try:
+        mapping = parse_mapping_spec(args.mapping)
+    except (ValueError, OSError) as e:
+        print(f"Fel i mappning: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    
+    if (args.delta or args.record) and args.no_registry:
+        print("--delta och --record kan inte kombineras med --no-registry", file=sys.stderr)
+        return EXIT_FAILED
+    
+    if mapping and mapping.get('tagg_id') and not args.mer:
+        print("--mer krävs när mappningen använder tagg_id", file=sys.stderr)
+        return EXIT_FAILED
+    
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("Inga indatafiler hittades", file=sys.stderr)
+        return EXIT_FAILED
+    
+    # TAGG ID slås bara upp mot --mer - filen låses i indexet under körningen
+    mer_source = None
+    owner = uuid.uuid4().hex
+    if args.mer:
+        try:
+            mer_source, conflicts = ingest_mer_file(args.mer, args.mer_index, owner)
+        except Exception as e:
+            print(f"Fel vid inläsning av MER-fil: {e}", file=sys.stderr)
+            return EXIT_FAILED
+        if len(conflicts) > 0:
+            print(f"Varning: {len(conflicts)} TAGG ID har motstridiga RFID-mappningar", file=sys.stderr)
+    
+    reports = []
+    workers = max(1, min(args.workers or 1, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(convert_file, path, mapping, args.sheet, args.output,
+                        args.mer_index, args.allow_errors, args.all_sheets,
+                        None if args.no_registry else args.export_store, args.delta, args.record,
+                        mer_source=mer_source)
+            for path in paths
+        ]
+        for future in futures:
+            report = future.result()
+            reports.append(report)
+            detail = report.get('message') or (
+                f"{len(report['errors'])} fel, {len(report['warnings'])} varningar, "
+                f"{len(report['files'])} fil(er)"
+            )
+            print(f"[{report['status']}] {report['input']}: {detail}")
+    if mer_source:
+        MerIndex(args.mer_index).unpin(owner)
+    
+    if any(report['status'] == 'failed' for report in reports):
+        return EXIT_FAILED
+    if any(report['status'] == 'errors' for report in reports):
+        return EXIT_ERRORS
+    return EXIT_OK
+
+# Inkorgsbevakning
+WATCH_INTERVAL_SECONDS = 5    # avsökningsintervall
+WATCH_SETTLE_SECONDS = 10     # en fil måste vara oförändrad så här länge innan den tas in
+WATCH_DONE = 'done'
+WATCH_FAILED = 'failed'
+
+class WatchLedger:
+    """
+    Beständig logg (SQLite) över filer som inkorgsbevakningen har behandlat,
+    per innehållshash. En fil som redan finns i loggen konverteras inte igen -
+    varken efter en omstart eller om samma fil läggs i inkorgen på nytt.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS watch_files (
+                sha256 TEXT PRIMARY KEY,
+                name TEXT,
+                size INTEGER,
+                status TEXT,
+                destination TEXT,
+                profile TEXT,
+                report TEXT,
+                processed_at TEXT
+            ) WITHOUT ROWID;
+        """)
+
+    def get(self, sha256: str) -> Optional[Dict]:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM watch_files WHERE sha256 = ?", (sha256,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def record(self, sha256: str, name: str, size: int, status: str, destination: str,
+               profile: Optional[str] = None, report: Optional[str] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watch_files "
+                "(sha256, name, size, status, destination, profile, report, processed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sha256, name, size, status, destination, profile, report,
+                 datetime.now().isoformat(timespec='seconds'))
+            )
+
+class InboxWatcher:
+    """
+    Avsökning av inkorgen. En fil är färdigskriven när storlek och ändringstid är
+    oförändrade sedan förra avsökningen och filen är minst settle sekunder gammal
+    (filer som håller på att laddas upp via SFTP tas inte in halvfärdiga).
+    """
+
+    def __init__(self, inbox: str, settle: float = WATCH_SETTLE_SECONDS):
+        self.inbox = inbox
+        self.settle = settle
+        self._seen = {}
+
+    def ready(self, skip: set = frozenset(), age_only: bool = False) -> List[str]:
+        """Färdigskrivna filer (utom skip). Med age_only räcker åldern (en enda avsökning)."""
+        now = time.time()
+        current = {}
+        ready = []
+        for path in expand_inputs([self.inbox]):
+            if os.path.basename(path).startswith('.'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # flyttad eller borttagen under avsökningen
+            signature = (stat.st_size, stat.st_mtime_ns)
+            current[path] = signature
+            settled = now - stat.st_mtime >= self.settle
+            if (path not in skip and stat.st_size > 0 and settled
+                    and (age_only or self._seen.get(path) == signature)):
+                ready.append(path)
+        self._seen = current
+        return ready
+
+def profile_mapping(data: bytes, source: str, sheet_name: Optional[str],
+                    profiles_path: str) -> Tuple[Optional[Dict[str, str]], Optional[str]]:
+    """Mappning från den sparade profil som matchar filens rubrikrad. Returnerar (mappning, profilnamn)."""
+    try:
+        header = read_input_preview(data, input_kind(source), sheet_name, nrows=0).columns
+        profile = MappingProfiles(profiles_path).match(header)
+    except Exception:
+        return None, None  # konverteringen rapporterar filer som inte går att läsa
+    if profile is None:
+        return None, None
+    return {field: profile['mapping'].get(field) for field in MAPPING_KEYS}, profile['name']
+
+def watch_convert(path: str, output_name: str, options: Dict) -> Dict:
+    """
+    Konvertera en fil från inkorgen (körs i arbetspoolen). Mappningen är den
+    fasta mappningen, en sparad profil som matchar rubrikraden eller
+    auto-detektering. Returnerar rapporten med använd profil.
+    """
+    mapping = options['mapping']
+    profile = None
+    if mapping is None and options['profiles']:
+        try:
+            with open(path, 'rb') as f:
+                mapping, profile = profile_mapping(f.read(), path, options['sheet'], options['profiles'])
+        except OSError:
+            pass  # convert_file rapporterar filer som inte går att läsa
+    report = convert_file(path, mapping, options['sheet'], options['outbox'], options['mer_index'],
+                          options['allow_errors'], options['all_sheets'], options['export_store'],
+                          options['delta'], options['record'], output_name=output_name,
+                          mer_source=options['mer_source'])
+    report['profile'] = profile
+    return report
+
+def _move_file(path: str, directory: str, name: str) -> str:
+    """Flytta en fil till katalogen (även mellan filsystem). Returnerar nya sökvägen."""
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, name)
+    shutil.move(path, target)
+    return target
+
+def log_event(message: str):
+    """Tidsstämplad loggrad för de långlivade kommandona (watch och serve)."""
+    print(f"{datetime.now().isoformat(timespec='seconds')} {message}", flush=True)
+
+def run_watch(args: argparse.Namespace) -> int:
+    """Bevaka en inkorg och konvertera nya filer tills processen stoppas (eller en gång med --once)."""
+    try:
+        mapping = parse_mapping_spec(args.mapping)
+    except (ValueError, OSError) as e:
+        print(f"Fel i mappning: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if (args.delta or args.record) and args.no_registry:
+        print("--delta och --record kan inte kombineras med --no-registry", file=sys.stderr)
+        return EXIT_FAILED
+    if mapping and mapping.get('tagg_id') and not args.mer:
+        print("--mer krävs när mappningen använder tagg_id", file=sys.stderr)
+        return EXIT_FAILED
+    if not os.path.isdir(args.inbox):
+        print(f"Inkorgen finns inte: {args.inbox}", file=sys.stderr)
+        return EXIT_FAILED
+    
+    base = os.path.dirname(os.path.abspath(args.inbox))
+    outbox = args.output or os.path.join(base, 'outbox')
+    done_dir = args.done or os.path.join(base, WATCH_DONE)
+    failed_dir = args.failed or os.path.join(base, WATCH_FAILED)
+    options = {
+        'mapping': mapping,
+        'profiles': args.profiles,
+        'sheet': args.sheet,
+        'outbox': outbox,
+        'mer_index': args.mer_index,
+        'mer_source': None,   # --mer när den är inläst (utan --mer matchas inga TAGG ID)
+        'allow_errors': args.allow_errors,
+        'all_sheets': args.all_sheets,
+        'export_store': None if args.no_registry else args.export_store,
+        'delta': args.delta,
+        'record': args.record,
+    }
+    ledger = WatchLedger(args.ledger)
+    watcher = InboxWatcher(args.inbox, args.settle)
+    
+    # SIGTERM (t.ex. från systemd) stoppar som Ctrl+C: inga nya filer, pågående körs klart
+    stopping = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    
+    # --mer låses i indexet så att den inte rensas när andra MER-filer laddas upp
+    mer_index = MerIndex(args.mer_index)
+    owner = uuid.uuid4().hex
+    mer_mtime = None
+    pinned_at = 0.0
+    in_flight = {}   # future → (sökväg, hash, storlek, utdatanamn)
+    statuses = []
+    # Filer som inte kunde flyttas ligger kvar i inkorgen - de tas inte om i samma körning
+    attempted = set()
+    # --once behandlar bara filerna som låg färdiga i inkorgen vid start
+    pending = watcher.ready(age_only=True) if args.once else None
+    workers = max(1, args.workers or 1)
+    log_event(f"Bevakar {args.inbox} → {outbox} ({workers} arbetare)")
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            while True:
+                # MER-filen läses in på nytt när den ändras (oförändrat innehåll hoppas över)
+                # eller om den ändå har försvunnit ur indexet
+                missing = options['mer_source'] is not None and not mer_index.has_source(options['mer_source'])
+                if args.mer and os.path.exists(args.mer) and (os.path.getmtime(args.mer) != mer_mtime or missing):
+                    mer_mtime = os.path.getmtime(args.mer)
+                    try:
+                        options['mer_source'], conflicts = ingest_mer_file(args.mer, args.mer_index, owner)
+                        pinned_at = time.time()
+                        log_event(f"MER-index uppdaterat från {args.mer} ({len(conflicts)} motstridiga mappningar)")
+                    except Exception as e:
+                        log_event(f"Fel vid inläsning av MER-fil: {e}")
+                elif options['mer_source'] and time.time() - pinned_at >= MER_PIN_REFRESH_SECONDS:
+                    mer_index.pin(options['mer_source'], owner)
+                    pinned_at = time.time()
+                
+                if stopping.is_set():
+                    ready = []
+                elif args.once:
+                    ready = list(pending)
+                else:
+                    ready = watcher.ready({entry[0] for entry in in_flight.values()} | attempted)
+                for path in ready:
+                    if len(in_flight) >= workers:
+                        break  # begränsad kö - resten tas vid nästa avsökning
+                    if args.once:
+                        pending.remove(path)
+                    try:
+                        with open(path, 'rb') as f:
+                            sha256 = file_hash(f.read())
+                    except OSError as e:
+                        log_event(f"{path} kunde inte läsas: {e}")
+                        continue
+                    stem, extension = os.path.splitext(os.path.basename(path))
+                    output_name = f"{sanitize_filename(stem) or 'fil'}_{sha256[:8]}"
+                    
+                    previous = ledger.get(sha256)
+                    if previous is not None:
+                        # Redan behandlad (omstart efter krasch eller samma fil igen) - bara flytta
+                        directory = done_dir if previous['status'] == WATCH_DONE else failed_dir
+                        try:
+                            _move_file(path, directory, output_name + extension)
+                            log_event(f"[redan behandlad] {path} → {directory}")
+                        except OSError as e:
+                            attempted.add(path)
+                            log_event(f"[redan behandlad] {path} kunde inte flyttas: {e}")
+                        continue
+                    
+                    future = pool.submit(watch_convert, path, output_name, options)
+                    in_flight[future] = (path, sha256, os.path.getsize(path), output_name + extension)
+                    log_event(f"[start] {path}")
+                
+                finished = [future for future in in_flight if future.done()]
+                for future in finished:
+                    path, sha256, size, target_name = in_flight.pop(future)
+                    try:
+                        report = future.result()
+                    except Exception as e:
+                        report = {'status': 'failed', 'message': str(e), 'files': [], 'profile': None}
+                    written = bool(report.get('files'))
+                    status = WATCH_DONE if report['status'] == 'ok' or written else WATCH_FAILED
+                    directory = done_dir if status == WATCH_DONE else failed_dir
+                    # Loggen skrivs före flytten - en krasch däremellan ger ingen ny konvertering
+                    ledger.record(sha256, os.path.basename(path), size, status, directory,
+                                  report.get('profile'), report.get('report'))
+                    try:
+                        _move_file(path, directory, target_name)
+                    except OSError as e:
+                        # Filen ligger kvar i inkorgen - loggen visar det, och flytten provas igen
+                        # först vid nästa start (den konverteras inte om)
+                        attempted.add(path)
+                        directory = os.path.dirname(path)
+                        ledger.record(sha256, os.path.basename(path), size, status, directory,
+                                      report.get('profile'), report.get('report'))
+                        log_event(f"{path} kunde inte flyttas: {e}")
+                    statuses.append(report['status'])
+                    detail = report.get('message') or (
+                        f"{len(report['errors'])} fel, {len(report['warnings'])} varningar, "
+                        f"{len(report['files'])} fil(er)"
+                    )
+                    profile = f", profil {report['profile']}" if report.get('profile') else ''
+                    log_event(f"[{report['status']}] {path}: {detail}{profile} → {directory}")
+                
+                if not in_flight and (stopping.is_set() or (args.once and not pending)):
+                    break
+                if args.once:
+                    time.sleep(0.1)
+                else:
+                    stopping.wait(args.interval)
+        except KeyboardInterrupt:
+            log_event("Avbruten - pågående filer ligger kvar i inkorgen och tas vid nästa start")
+            pool.shutdown(wait=False, cancel_futures=True)
+            return EXIT_FAILED
+        finally:
+            mer_index.unpin(owner)
+    
+    log_event("Bevakningen stoppad")
+    if not args.once:
+        return EXIT_OK
+    # Engångskörning: exit-kod som batch
+    if 'failed' in statuses:
+        return EXIT_FAILED
+    if 'errors' in statuses:
+        return EXIT_ERRORS
+    return EXIT_OK
+
+# ---------------------------------------------------------------------------
+# HTTP-API utan webbgränssnitt: python -m rfid_converter serve ...
+# ---------------------------------------------------------------------------
+
+API_HOST = '127.0.0.1'
+API_PORT = 8502               # webbgränssnittet kör på 8501
+API_QUEUE = 16                # förfrågningar som får vänta på en ledig arbetare, resten får 503
+API_MAX_UPLOAD_MB = 200       # samma gräns som uppladdningen i webbgränssnittet
+API_MAX_PENDING_MB = 1024     # förfrågningar som tas emot eller väntar samtidigt (på disk), fler får 503
+API_READ_TIMEOUT_SECONDS = 60
+API_CHUNK_BYTES = 64 * 1024   # storlek på bitarna när ZIP-filen strömmas
+API_FORMATS = ('zip', 'json')
+API_TRUE = {'1', 'true', 'yes', 'on', 'ja'}
+
+class ApiError(Exception):
+    """Felaktig förfrågan - besvaras med HTTP-status och ett JSON-meddelande."""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+def parse_flag(value: Optional[str]) -> bool:
+    return (value or '').strip().lower() in API_TRUE
+
+def api_temp_file(prefix: str = 'rfid_api_') -> Tuple[int, str]:
+    """Tillfällig fil för en uppladdning (tas bort av servern när förfrågan är klar)."""
+    return tempfile.mkstemp(prefix=prefix)
+
+def split_form(content_type: str, body_path: str) -> Tuple[Dict[str, str], Dict[str, Tuple[str, str]]]:
+    """
+    Tolka en multipart/form-data-kropp på disk (körs i arbetspoolen). Filerna skrivs
+    till egna tillfälliga filer. Returnerar (textfält, {fält: (filnamn, sökväg)}).
+    """
+    parser = BytesFeedParser(policy=email.policy.HTTP)
+    parser.feed(f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1'))
+    with open(body_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(16 * API_CHUNK_BYTES), b''):
+            parser.feed(chunk)
+    message = parser.close()
+    if not message.is_multipart():
+        raise ValueError("Ogiltig multipart/form-data")
+    fields, uploads = {}, {}
+    try:
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if not name:
+                continue
+            payload = part.get_payload(decode=True) or b''
+            filename = part.get_filename()
+            if filename is not None:
+                fd, path = api_temp_file()
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(payload)
+                uploads[name] = (os.path.basename(filename.replace('\\', '/')), path)
+            else:
+                fields[name] = payload.decode(part.get_content_charset() or 'utf-8')
+    except BaseException:
+        for _, path in uploads.values():
+            with suppress(OSError):
+                os.remove(path)
+        raise
+    return fields, uploads
+
+def api_convert(data_path: str, source: str, mapping: Optional[Dict[str, str]],
+                options: Dict) -> Tuple[Dict, Dict[str, CompanyCsv]]:
+    """
+    Konvertera en uppladdad fil (körs i arbetspoolen, filen läses från disk så
+    att bara arbetaren har den i minnet). Mappningen väljs som i watch_convert:
+    angiven mappning, sparad profil eller auto-detektering. En MER-fil i
+    förfrågan (options['mer_upload'] = (filnamn, sökväg)) används bara för den
+    här förfrågan; annars slås TAGG ID upp mot serverns --mer.
+    """
+    with open(data_path, 'rb') as f:
+        data = f.read()
+    mer = (options['mer_index'], options['mer_source'], {}) if options['mer_source'] else None
+    mer_conflicts = None
+    if options.get('mer_upload'):
+        filename, mer_path = options['mer_upload']
+        try:
+            with open(mer_path, 'rb') as f:
+                mer, conflicts = read_mer_table(f.read(), filename)
+        except Exception as e:
+            report = _new_report(source, options['sheet'], mapping)
+            report['message'] = f"Fel vid inläsning av MER-fil: {e}"
+            return report, {}
+        mer_conflicts = len(conflicts)
+    profile = None
+    if mapping is None and options['profiles']:
+        mapping, profile = profile_mapping(data, source, options['sheet'], options['profiles'])
+    report, files = convert_data(data, source, mapping, options['sheet'], mer,
+                                 options['allow_errors'], options['all_sheets'], options['export_store'],
+                                 options['delta'], options['record'], export=options['format'] == 'zip', run='api')
+    report['profile'] = profile
+    if mer_conflicts is not None:
+        report['mer_conflicts'] = mer_conflicts
+    return report, files
+
+def _http_head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+    lines += [f'{name}: {value}' for name, value in {**headers, 'Connection': 'close'}.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+class ZipStream:
+    """
+    Skrivbar ström för zipfile som lämnar bitar till händelseloopen via en
+    begränsad kö. ZIP-filen skrivs i en tråd och skickas medan den byggs;
+    kön ger mottryck när klienten läser långsamt.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.queue = asyncio.Queue(maxsize=4)
+        self._loop = loop
+        self._buffer = bytearray()
+        self._aborted = False
+
+    def write(self, data) -> int:
+        if self._aborted:
+            raise OSError("Klienten avbröt nedladdningen")
+        self._buffer += data
+        if len(self._buffer) >= API_CHUNK_BYTES:
+            self._push(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Skicka det sista och markera slutet (None)."""
+        if self._buffer and not self._aborted:
+            self._push(bytes(self._buffer))
+        if not self._aborted:
+            self._push(None)
+
+    def abort(self):
+        """Anropas i händelseloopen: släpp en väntande skrivning och stoppa resten."""
+        self._aborted = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def _push(self, chunk: Optional[bytes]):
+        asyncio.run_coroutine_threadsafe(self.queue.put(chunk), self._loop).result()
+
+class ConversionServer:
+    """
+    Asynkron HTTP-server för konvertering utan webbgränssnitt.
+
+    POST /convert tar emot en arbetsbok (multipart-fältet file eller rå
+    kropp med ?filename=) och valfri MER-fil och mappning, och svarar med en
+    strömmad ZIP (som i result_step) eller JSON-diagnostik (format=json).
+    GET /health visar status. Anslutningarna hanteras i händelseloopen,
+    inläsning och validering körs i en begränsad processpool. Kroppen skrivs
+    till disk medan den tas emot och arbetarna läser den därifrån. Förfrågningar
+    utöver arbetare + kö, eller som tillsammans med de pågående skulle överskrida
+    max_pending_bytes, avvisas med 503.
+    """
+
+    def __init__(self, options: Dict, workers: int, queue: int = API_QUEUE,
+                 max_bytes: int = API_MAX_UPLOAD_MB * 1024 * 1024,
+                 max_pending_bytes: int = API_MAX_PENDING_MB * 1024 * 1024):
+        self.options = options
+        self.workers = workers
+        self.limit = workers + queue
+        self.max_bytes = max_bytes
+        self.max_pending_bytes = max(max_pending_bytes, max_bytes)
+        self.active = 0     # förfrågningar som laddar upp eller väntar på / använder en arbetare
+        self.pending_bytes = 0
+        self.served = 0
+        self.port = None
+        self._pool = None
+        self._loop = None
+        self._stopping = None
+        self._connections = set()
+
+    def stop(self):
+        """Stoppa servern (trådsäkert): inga nya anslutningar, pågående förfrågningar körs klart."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve(self, host: str = API_HOST, port: int = API_PORT):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                with suppress(NotImplementedError, RuntimeError):
+                    self._loop.add_signal_handler(sig, self._stopping.set)
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            self._pool = pool
+            server = await asyncio.start_server(self.handle, host, port)
+            self.port = server.sockets[0].getsockname()[1]
+            log_event(f"Lyssnar på http://{host}:{self.port} "
+                      f"({self.workers} arbetare, kö {self.limit - self.workers})")
+            async with server:
+                await self._stopping.wait()
+                server.close()
+                if self._connections:
+                    await asyncio.gather(*self._connections, return_exceptions=True)
+        log_event(f"Servern stoppad ({self.served} förfrågningar)")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(asyncio.current_task())
+        start = time.perf_counter()
+        request = {'method': '-', 'path': '-', 'source': '', 'sent': False}
+        try:
+            status = await self._respond(reader, writer, request)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = 'avbruten'
+        except Exception as e:
+            if request['sent']:
+                # Statusraden är redan skickad: bryt anslutningen utan avslutande bit så
+                # att klienten ser ett ofullständigt svar i stället för JSON mitt i ZIP-filen
+                status = f"avbruten ({type(e).__name__}: {e})"
+                writer.transport.abort()
+            else:
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+                with suppress(Exception):
+                    await self._send_json(writer, status, {'status': 'failed', 'message': str(e)})
+        finally:
+            self._connections.discard(asyncio.current_task())
+            with suppress(Exception):
+                writer.close()
+                await writer.wait_closed()
+        self.served += 1
+        source = f" {request['source']}" if request['source'] else ''
+        log_event(f"{request['method']} {request['path']} {int(status) if isinstance(status, int) else status}"
+                  f"{source} {time.perf_counter() - start:.2f}s")
+
+    async def _respond(self, reader, writer, request: Dict) -> int:
+        try:
+            method, path, query, headers = await asyncio.wait_for(self._read_head(reader),
+                                                                  API_READ_TIMEOUT_SECONDS)
+            request.update(method=method, path=path)
+            if path == '/health':
+                if method != 'GET':
+                    raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, "Använd GET", {'Allow': 'GET'})
+                return await self._send_json(writer, HTTPStatus.OK, {
+                    'status': 'ok',
+                    'workers': self.workers,
+                    'active': self.active,
+                    'queue': self.limit - self.workers,
+                    'pending_mb': round(self.pending_bytes / 1024 / 1024, 1),
+                    'served': self.served,
+                })
+            if path == '/convert':
+                if method != 'POST':
+                    raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, "Använd POST", {'Allow': 'POST'})
+                return await self._convert(reader, writer, query, headers, request)
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Okänd sökväg {path} (finns: /convert, /health)")
+        except ApiError as e:
+            if request['sent']:
+                raise
+            return await self._send_json(writer, e.status, {'status': 'failed', 'message': e.message}, e.headers)
+        except asyncio.TimeoutError:
+            if request['sent']:
+                raise
+            return await self._send_json(writer, HTTPStatus.REQUEST_TIMEOUT,
+                                         {'status': 'failed', 'message': "Förfrågan tog för lång tid att ta emot"})
+
+    async def _read_head(self, reader) -> Tuple[str, str, Dict[str, str], Dict[str, str]]:
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise ApiError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "För stora rubriker")
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Ogiltig förfrågan")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        url = urllib.parse.urlsplit(target)
+        return method.upper(), url.path, dict(urllib.parse.parse_qsl(url.query)), headers
+
+    def _content_length(self, headers: Dict[str, str]) -> int:
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise ApiError(HTTPStatus.LENGTH_REQUIRED, "Content-Length krävs (chunked stöds inte)")
+        try:
+            length = int(headers['content-length'])
+        except (KeyError, ValueError):
+            raise ApiError(HTTPStatus.LENGTH_REQUIRED, "Content-Length krävs")
+        if length > self.max_bytes:
+            raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                           f"Förfrågan är större än {self.max_bytes // (1024 * 1024)} MB")
+        return length
+
+    async def _read_body(self, reader, writer, headers: Dict[str, str], length: int) -> str:
+        """Ta emot kroppen bit för bit till en tillfällig fil. Returnerar sökvägen."""
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+        fd, path = api_temp_file()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                remaining = length
+                while remaining:
+                    chunk = await asyncio.wait_for(reader.read(min(API_CHUNK_BYTES, remaining)),
+                                                   API_READ_TIMEOUT_SECONDS)
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b'', remaining)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+    async def _convert(self, reader, writer, query, headers, request) -> int:
+        length = self._content_length(headers)
+        if self.active >= self.limit or self.pending_bytes + length > self.max_pending_bytes:
+            raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "Servern är upptagen - försök igen om en stund",
+                           {'Retry-After': '5'})
+        self.active += 1
+        self.pending_bytes += length
+        temp_files = []
+        try:
+            body_path = await self._read_body(reader, writer, headers, length)
+            temp_files.append(body_path)
+            content_type = headers.get('content-type', '')
+            if content_type.lower().startswith('multipart/form-data'):
+                try:
+                    fields, uploads = await self._loop.run_in_executor(self._pool, split_form,
+                                                                       content_type, body_path)
+                except ValueError as e:
+                    raise ApiError(HTTPStatus.BAD_REQUEST, str(e))
+                temp_files += [path for _, path in uploads.values()]
+                fields = {**query, **fields}
+            else:
+                # Rå kropp: arbetsboken direkt, filnamnet (för filformatet) i ?filename=
+                fields, uploads = query, {'file': (query.get('filename', ''), body_path)} if length else {}
+            if 'file' not in uploads:
+                raise ApiError(HTTPStatus.BAD_REQUEST, "Arbetsbok saknas (multipart-fältet file)")
+            source, data_path = uploads['file']
+            request['source'] = source
+            
+            options, mapping = self._request_options(source, fields)
+            options['mer_upload'] = uploads.get('mer')
+            if mapping and mapping.get('tagg_id') and not options['mer_upload'] and not options['mer_source']:
+                raise ApiError(HTTPStatus.BAD_REQUEST,
+                               "MER-fil krävs för TAGG ID (fältet mer, eller starta servern med --mer)")
+            report, files = await self._loop.run_in_executor(self._pool, api_convert, data_path, source,
+                                                             mapping, options)
+        finally:
+            self.active -= 1
+            self.pending_bytes -= length
+            for path in temp_files:
+                with suppress(OSError):
+                    os.remove(path)
+        
+        if report['status'] == 'failed':
+            return await self._send_json(writer, HTTPStatus.UNPROCESSABLE_ENTITY, report)
+        if options['format'] == 'json':
+            return await self._send_json(writer, HTTPStatus.OK, report)
+        if not files:
+            # Samma regel som i webbgränssnittet: fel blockerar exporten
+            report['message'] = ("Filen har fel - exporten blockeras (allow_errors=1 exporterar giltiga rader)"
+                                 if report['errors'] and not options['allow_errors']
+                                 else "Inga giltiga rader att exportera")
+            return await self._send_json(writer, HTTPStatus.UNPROCESSABLE_ENTITY, report)
+        await self._stream_zip(writer, request, files, {
+            'Content-Type': 'application/zip',
+            'Content-Disposition': 'attachment; filename="rfid_export.zip"',
+            'X-RFID-Status': report['status'],
+            'X-RFID-Errors': str(len(report['errors'])),
+            'X-RFID-Warnings': str(len(report['warnings'])),
+            'X-RFID-Valid-Rows': str(report['valid_rows']),
+            'X-RFID-Files': str(len(files)),
+        })
+        return HTTPStatus.OK
+
+    def _request_options(self, source: str, fields: Dict[str, str]) -> Tuple[Dict, Optional[Dict[str, str]]]:
+        """Kontrollera förfrågans fält. Returnerar (alternativ för api_convert, mappning)."""
+        try:
+            input_kind(source)
+            mapping = parse_mapping_spec(fields.get('mapping'), allow_files=False)
+        except ValueError as e:
+            raise ApiError(HTTPStatus.BAD_REQUEST, str(e))
+        output_format = (fields.get('format') or 'zip').lower()
+        if output_format not in API_FORMATS:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Okänt format '{output_format}' (zip eller json)")
+        delta = parse_flag(fields.get('delta'))
+        if delta and not self.options['export_store']:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "delta kräver RFID-registret (servern kör med --no-registry)")
+        record = parse_flag(fields.get('record'))
+        if record and not self.options['export_store']:
+            raise ApiError(HTTPStatus.BAD_REQUEST, "record kräver RFID-registret (servern kör med --no-registry)")
+        if record and output_format != 'zip':
+            raise ApiError(HTTPStatus.BAD_REQUEST, "record kräver format=zip (json exporterar inget)")
+        options = {
+            **self.options,
+            'sheet': fields.get('sheet') or None,
+            'all_sheets': parse_flag(fields.get('all_sheets')),
+            'allow_errors': parse_flag(fields.get('allow_errors')),
+            'delta': delta,
+            'record': record,
+            'format': output_format,
+        }
+        return options, mapping
+
+    async def _send_json(self, writer, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None) -> int:
+        body = json.dumps(payload, ensure_ascii=False, indent=2).encode('utf-8')
+        writer.write(_http_head(status, {**(headers or {}),
+                                         'Content-Type': 'application/json; charset=utf-8',
+                                         'Content-Length': str(len(body))}))
+        writer.write(body)
+        await writer.drain()
+        return status
+
+    async def _stream_zip(self, writer, request: Dict, files: Dict[str, CompanyCsv], headers: Dict[str, str]):
+        """Skicka ZIP-filen med chunked transfer encoding medan den skrivs i en tråd."""
+        writer.write(_http_head(HTTPStatus.OK, {**headers, 'Transfer-Encoding': 'chunked'}))
+        request['sent'] = True
+        stream = ZipStream(self._loop)
+        
+        def produce():
+            try:
+                write_export_zip(files, stream)
+            finally:
+                stream.close()
+        
+        producer = self._loop.run_in_executor(None, produce)
+        try:
+            while (chunk := await stream.queue.get()) is not None:
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                await writer.drain()
+            await producer  # fel i ZIP-skrivningen avbryter svaret utan avslutande bit
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            if not producer.done():
+                stream.abort()
+                await asyncio.gather(producer, return_exceptions=True)
+
+def keep_mer_pinned(mer_index_path: str, source: str, owner: str, stop: threading.Event):
+    """Förnya låset på en MER-fil tills stop sätts (långlivade processer utan egen avsökningsloop)."""
+    mer_index = MerIndex(mer_index_path)
+    while not stop.wait(MER_PIN_REFRESH_SECONDS):
+        mer_index.pin(source, owner)
+
+def run_serve(args: argparse.Namespace) -> int:
+    """Starta HTTP-API:t och kör tills processen stoppas."""
+    mer_source = None
+    owner = uuid.uuid4().hex
+    if args.mer:
+        try:
+            mer_source, conflicts = ingest_mer_file(args.mer, args.mer_index, owner)
+        except Exception as e:
+            print(f"Fel vid inläsning av MER-fil: {e}", file=sys.stderr)
+            return EXIT_FAILED
+        if len(conflicts) > 0:
+            print(f"Varning: {len(conflicts)} TAGG ID har motstridiga RFID-mappningar", file=sys.stderr)
+    
+    options = {
+        'profiles': args.profiles,
+        'mer_index': args.mer_index,
+        'mer_source': mer_source,   # för förfrågningar utan egen MER-fil
+        'export_store': None if args.no_registry else args.export_store,
+    }
+    server = ConversionServer(options, max(1, args.workers or 1), max(0, args.queue),
+                              args.max_upload_mb * 1024 * 1024, args.max_pending_mb * 1024 * 1024)
+    stop_pin = threading.Event()
+    if mer_source:
+        threading.Thread(target=keep_mer_pinned, args=(args.mer_index, mer_source, owner, stop_pin),
+                         daemon=True).start()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        log_event("Avbruten")
+    except OSError as e:
+        print(f"Servern kunde inte starta: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        stop_pin.set()
+        if mer_source:
+            MerIndex(args.mer_index).unpin(owner)
+    return EXIT_OK
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    """Kommandoradsgränssnitt: python -m rfid_converter <kommando> ..."""
+    parser = argparse.ArgumentParser(
+        prog='python -m rfid_converter',
+        description="ChargeNode RFID CSV Konverterare utan webbgränssnitt. "
+                    "Webbgränssnittet startas med 'streamlit run rfid_converter.py'."
     )
+    commands = parser.add_subparsers(dest='command', required=True)
     
-    main()
+    batch = commands.add_parser('batch', help='Konvertera en katalog eller glob med indatafiler')
+    batch.add_argument('inputs', nargs='+',
+                       help='Kataloger, glob-mönster eller filer (.xlsx, .csv, .tsv, .txt, .parquet)')
+    batch.add_argument('-m', '--mapping',
+                       help="Kolumnmappning: JSON-fil, JSON-sträng eller "
+                            "'rfid=Kolumn,identifier=Kolumn,company=Kolumn'. "
+                            "Utan mappning auto-detekteras kolumnerna per fil.")
+    batch.add_argument('--mer', help='MER-fil (.xlsx, .csv, .tsv eller .parquet) för TAGG ID → RFID')
+    batch.add_argument('--mer-index', default=os.path.join(DATA_DIR, 'mer_index.sqlite'),
+                       help='Sökväg till MER-indexet (SQLite)')
+    batch.add_argument('--sheet', help='Flik att läsa (standard: första fliken)')
+    batch.add_argument('--all-sheets', action='store_true',
+                       help='Validera alla flikar och slå ihop dem till ett resultat per fil')
+    batch.add_argument('-o', '--output', default='output', help='Utdatakatalog')
+    batch.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                       help='Antal parallella processer (standard: alla kärnor)')
+    batch.add_argument('--allow-errors', action='store_true',
+                       help='Skriv CSV-filer med giltiga rader även om filen har fel')
+    batch.add_argument('--delta', action='store_true',
+                       help='Skriv även delta-CSV:er (tillagda, ändrade och borttagna kort per företag) mot '
+                            'senast provisionerade listor')
+    batch.add_argument('--export-store', default=os.path.join(DATA_DIR, 'export_store.sqlite'),
+                       help='Sökväg till RFID-registret med provisionerade listor (SQLite). RFID kontrolleras '
+                            'mot registret.')
+    batch.add_argument('--record', action='store_true',
+                       help='Spara de skrivna listorna som provisionerade i RFID-registret '
+                            '(nästa jämförelsegrund för registret och --delta)')
+    batch.add_argument('--no-registry', action='store_true',
+                       help='Kontrollera inte mot RFID-registret')
+    batch.set_defaults(handler=run_batch)
+    
+    watch = commands.add_parser('watch', help='Bevaka en inkorg och konvertera nya filer automatiskt')
+    watch.add_argument('inbox', help='Katalog som bevakas (t.ex. SFTP-inkorgen)')
+    watch.add_argument('-o', '--output',
+                       help='Utkorg för CSV-filer och rapporter (standard: outbox bredvid inkorgen)')
+    watch.add_argument('--done', help=f'Katalog för behandlade filer (standard: {WATCH_DONE} bredvid inkorgen)')
+    watch.add_argument('--failed',
+                       help=f'Katalog för filer som inte kunde konverteras (standard: {WATCH_FAILED} bredvid inkorgen)')
+    watch.add_argument('-m', '--mapping',
+                       help='Fast kolumnmappning för alla filer (annars sparad profil eller auto-detektering)')
+    watch.add_argument('--profiles', default=os.path.join(DATA_DIR, 'mapping_profiles.json'),
+                       help='Sparade mappningsprofiler (JSON) som matchas mot filernas rubrikrad')
+    watch.add_argument('--mer', help='MER-fil för TAGG ID → RFID (läses in igen när den ändras)')
+    watch.add_argument('--mer-index', default=os.path.join(DATA_DIR, 'mer_index.sqlite'),
+                       help='Sökväg till MER-indexet (SQLite)')
+    watch.add_argument('--sheet', help='Flik att läsa (standard: första fliken)')
+    watch.add_argument('--all-sheets', action='store_true',
+                       help='Validera alla flikar och slå ihop dem till ett resultat per fil')
+    watch.add_argument('--allow-errors', action='store_true',
+                       help='Skriv CSV-filer med giltiga rader även om filen har fel')
+    watch.add_argument('--delta', action='store_true', help='Skriv även delta-CSV:er (se batch)')
+    watch.add_argument('--export-store', default=os.path.join(DATA_DIR, 'export_store.sqlite'),
+                       help='Sökväg till RFID-registret (SQLite)')
+    watch.add_argument('--record', action='store_true',
+                       help='Spara de skrivna listorna som provisionerade i RFID-registret (se batch)')
+    watch.add_argument('--no-registry', action='store_true',
+                       help='Kontrollera inte mot RFID-registret')
+    watch.add_argument('--ledger', default=os.path.join(DATA_DIR, 'watch_ledger.sqlite'),
+                       help='Logg över behandlade filer (SQLite) - samma fil konverteras inte två gånger')
+    watch.add_argument('-w', '--workers', type=int, default=min(4, os.cpu_count() or 1),
+                       help='Antal filer som konverteras samtidigt')
+    watch.add_argument('--interval', type=float, default=WATCH_INTERVAL_SECONDS,
+                       help='Sekunder mellan avsökningar av inkorgen')
+    watch.add_argument('--settle', type=float, default=WATCH_SETTLE_SECONDS,
+                       help='Sekunder en fil ska vara oförändrad innan den tas in')
+    watch.add_argument('--once', action='store_true',
+                       help='Behandla färdigskrivna filer en gång och avsluta (t.ex. från cron)')
+    watch.set_defaults(handler=run_watch)
+    
+    serve = commands.add_parser('serve', help='Starta ett lokalt HTTP-API för konvertering')
+    serve.add_argument('--host', default=API_HOST, help=f'Adress att lyssna på (standard: {API_HOST})')
+    serve.add_argument('--port', type=int, default=API_PORT, help=f'Port (standard: {API_PORT}, 0 = valfri ledig)')
+    serve.add_argument('-w', '--workers', type=int, default=min(4, os.cpu_count() or 1),
+                       help='Antal filer som valideras samtidigt (processer)')
+    serve.add_argument('--queue', type=int, default=API_QUEUE,
+                       help='Förfrågningar som får vänta på en ledig arbetare innan servern svarar 503')
+    serve.add_argument('--max-upload-mb', type=int, default=API_MAX_UPLOAD_MB,
+                       help='Största tillåtna förfrågan i MB')
+    serve.add_argument('--max-pending-mb', type=int, default=API_MAX_PENDING_MB,
+                       help='Största sammanlagda storlek i MB på förfrågningar som tas emot eller väntar '
+                            '(kropparna ligger på disk), fler får 503')
+    serve.add_argument('--mer', help='MER-fil som läses in i det delade indexet vid start och används för '
+                                     'förfrågningar utan egen MER-fil')
+    serve.add_argument('--mer-index', default=os.path.join(DATA_DIR, 'mer_index.sqlite'),
+                       help='Sökväg till MER-indexet (SQLite)')
+    serve.add_argument('--profiles', default=os.path.join(DATA_DIR, 'mapping_profiles.json'),
+                       help='Sparade mappningsprofiler som används när ingen mappning skickas')
+    serve.add_argument('--export-store', default=os.path.join(DATA_DIR, 'export_store.sqlite'),
+                       help='Sökväg till RFID-registret (SQLite)')
+    serve.add_argument('--no-registry', action='store_true',
+                       help='Kontrollera inte mot RFID-registret (och tillåt inte record)')
+    serve.set_defaults(handler=run_serve)
+    
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    if runtime.exists():
+        st.set_page_config(
+            page_title="ChargeNode - RFID CSV Converter",
+            page_icon="🔌",
+            layout="wide",
+            initial_sidebar_state="expanded"
+        )
+        
+        main()
+    else:
+        # Startad med python -m rfid_converter
+        sys.exit(main_cli())
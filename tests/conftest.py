@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Beständiga data (MER-index, registret m.m.) hamnar i en tillfällig katalog, inte i hemkatalogen
+os.environ.setdefault('RFID_CONVERTER_DATA', tempfile.mkdtemp(prefix='rfid_converter_test_'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
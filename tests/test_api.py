@@ -0,0 +1,139 @@
+import asyncio
+import glob
+import http.client
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+import pandas as pd
+import pytest
+
+import rfid_converter as rc
+
+MER = pd.DataFrame({
+    'Visible Number': ['SE-MER-000001-1', 'SE-MER-000002-2'],
+    'Key/Card number': ['00AB12CD', '0000000F'],
+}).to_csv(sep=';', index=False).encode('utf-8')
+
+FLEET = pd.DataFrame({
+    'TAGG ID': ['SE-MER-000001-1', 'SE-MER-000002-2'],
+    'Regnummer': ['ABC123', 'XYZ999'],
+    'Företag': ['Företag AB', 'Åkeri & Co'],
+}).to_csv(sep=';', index=False).encode('utf-8')
+
+MAPPING = 'tagg_id=TAGG ID,identifier=Regnummer,company=Företag'
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp('api')
+    options = {
+        'profiles': str(data_dir / 'profiles.json'),
+        'mer_index': str(data_dir / 'mer.sqlite'),
+        'mer_source': None,
+        'export_store': str(data_dir / 'store.sqlite'),
+    }
+    server = rc.ConversionServer(options, workers=1, queue=2)
+    thread = threading.Thread(target=lambda: asyncio.run(server.serve('127.0.0.1', 0)), daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while server.port is None and time.time() < deadline:
+        time.sleep(0.05)
+    yield server
+    server.stop()
+    thread.join(30)
+
+def post(server, fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(content + b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=60)
+    conn.request('POST', '/convert', body.getvalue(), {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    response = conn.getresponse()
+    return response.status, dict(response.getheaders()), response.read()
+
+def test_request_mer_is_not_stored_in_shared_index(server):
+    status, _, body = post(server, {'mapping': MAPPING, 'format': 'json'},
+                           {'file': ('flotta.csv', FLEET), 'mer': ('mer.csv', MER)})
+    report = json.loads(body)
+    assert status == 200 and report['status'] == 'ok'
+    assert report['valid_rows'] == 2 and report['mer_conflicts'] == 0
+    index = rc.MerIndex(server.options['mer_index'])
+    assert index.latest_source() is None and not index.has_source(rc.file_hash(MER))
+
+    # Nästa förfrågan utan MER-fil ser inte den förra förfrågans MER-fil
+    status, _, body = post(server, {'mapping': MAPPING, 'format': 'json'}, {'file': ('flotta.csv', FLEET)})
+    assert status == 400 and 'MER-fil krävs' in json.loads(body)['message']
+
+def test_ui_mer_files_do_not_affect_requests(server):
+    rc.MerIndex(server.options['mer_index']).ingest(
+        pd.read_csv(io.BytesIO(MER), sep=';', dtype=str), 'ui', 'ui.xlsx')
+    status, _, body = post(server, {'format': 'json'}, {'file': ('flotta.csv', FLEET)})
+    report = json.loads(body)
+    assert status == 422 and report['message'] == "MER-fil saknas men krävs för TAGG ID matchning"
+
+def test_zip_records_only_when_asked(server):
+    store = rc.ExportStore(server.options['export_store'])
+    status, headers, body = post(server, {'mapping': MAPPING},
+                                 {'file': ('flotta.csv', FLEET), 'mer': ('mer.csv', MER)})
+    assert status == 200 and headers['X-RFID-Valid-Rows'] == '2'
+    assert 'manifest.json' in zipfile.ZipFile(io.BytesIO(body)).namelist()
+    assert store.last_export('Företag AB') is None
+
+    status, _, _ = post(server, {'mapping': MAPPING, 'record': '1'},
+                        {'file': ('flotta.csv', FLEET), 'mer': ('mer.csv', MER)})
+    assert status == 200
+    assert store.last_export('Företag AB') is not None
+
+def test_bad_requests(server):
+    status, _, body = post(server, {'mapping': MAPPING, 'format': 'json', 'record': '1'},
+                           {'file': ('flotta.csv', FLEET)})
+    assert status == 400 and 'record' in json.loads(body)['message']
+    status, _, _ = post(server, {'mapping': MAPPING}, {})
+    assert status == 400
+    status, _, body = post(server, {'mapping': MAPPING, 'format': 'json'},
+                           {'file': ('flotta.csv', FLEET), 'mer': ('mer.csv', b'fel;kolumner\n1;2\n')})
+    assert status == 422 and 'MER-fil' in json.loads(body)['message']
+
+def test_uploads_are_bounded_by_bytes_and_removed(server, monkeypatch):
+    monkeypatch.setattr(server, 'max_pending_bytes', 2 * len(FLEET))
+    before = set(glob.glob(os.path.join(tempfile.gettempdir(), 'rfid_api_*')))
+    # En uppladdning som tar hela budgeten och stannar halvvägs
+    slow = socket.create_connection(('127.0.0.1', server.port), timeout=60)
+    slow.sendall(b'POST /convert?filename=flotta.csv HTTP/1.1\r\nHost: x\r\n'
+                 b'Content-Length: %d\r\n\r\n' % (2 * len(FLEET)) + FLEET[:10])
+    deadline = time.time() + 30
+    while server.pending_bytes == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    assert server.active == 1
+
+    status, headers, _ = post(server, {'format': 'json'}, {'file': ('flotta.csv', FLEET)})
+    assert status == 503 and headers['Retry-After'] == '5'
+
+    slow.close()
+    deadline = time.time() + 30
+    while server.pending_bytes and time.time() < deadline:
+        time.sleep(0.05)
+    assert server.pending_bytes == 0 and server.active == 0
+    assert set(glob.glob(os.path.join(tempfile.gettempdir(), 'rfid_api_*'))) <= before
+
+def test_zip_error_after_headers_drops_connection(server, monkeypatch):
+    def broken_zip(files, target):
+        target.write(b'PK' * 100)
+        raise OSError("disken är full")
+    monkeypatch.setattr(rc, 'write_export_zip', broken_zip)
+    # Svaret har redan börjat (200, chunked): klienten ska se ett avbrutet svar, inte JSON i kroppen
+    with pytest.raises(http.client.IncompleteRead) as e:
+        post(server, {'mapping': MAPPING}, {'file': ('flotta.csv', FLEET), 'mer': ('mer.csv', MER)})
+    assert e.value.partial.startswith(b'PK') and b'failed' not in e.value.partial
@@ -0,0 +1,78 @@
+import pandas as pd
+
+import rfid_converter as rc
+
+CSV = b'RFID;Regnummer;F\xc3\xb6retag\n00AB12CD;ABC123;F\xc3\xb6retag AB\n0000000F;XYZ999;\xc3\x85keri & Co\n'
+
+def test_frame_cache_evicts_least_recently_used():
+    cache = rc.FrameCache(max_bytes=100)
+    cache.put('a', 'A', 40)
+    cache.put('b', 'B', 40)
+    assert cache.get('a') == 'A'   # a är nu senast använd
+    cache.put('c', 'C', 40)
+    assert cache.get('b') is None and cache.get('a') == 'A' and cache.get('c') == 'C'
+    assert len(cache) == 2 and cache.size == 80
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # En ersatt post räknas bara en gång, en för stor post sparas inte
+    cache.put('a', 'A2', 50)
+    assert cache.size == 90 and cache.get('a') == 'A2'
+    cache.put('d', 'D', 101)
+    assert cache.get('d') is None and cache.size == 90
+
+def test_read_input_cached_hits_and_returns_copies():
+    cache = rc.FrameCache(max_bytes=10 * 1024 * 1024)
+    data_hash = rc.file_hash(CSV)
+    df, hit = rc.read_input_cached(CSV, data_hash, rc.TABLE_SHEET, 'csv', cache=cache)
+    assert not hit and len(df) == 2
+    df['Ny'] = 1   # anroparens ändringar når inte cachen
+
+    again, hit = rc.read_input_cached(CSV, data_hash, rc.TABLE_SHEET, 'csv', cache=cache)
+    assert hit and 'Ny' not in again.columns
+    pd.testing.assert_frame_equal(again, df.drop(columns='Ny'))
+
+    # Bara de mappade kolumnerna är en egen post
+    columns, hit = rc.read_input_cached(CSV, data_hash, rc.TABLE_SHEET, 'csv', ['RFID'], cache=cache)
+    assert not hit and list(columns.columns) == ['RFID'] and len(cache) == 2
+    assert rc.read_input_cached(CSV, data_hash, rc.TABLE_SHEET, 'csv', ['RFID'], cache=cache)[1]
+
+def mer_entry(key: str, nbytes: int = 40) -> rc.MerCacheEntry:
+    return rc.MerCacheEntry(key, f'{key}.xlsx', pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), 'openpyxl', 0.0, nbytes)
+
+def test_mer_cache_keeps_referenced_entries():
+    cache = rc.MerCache(max_bytes=100)
+    for key, owner in [('a', 's1'), ('b', 's2'), ('c', 's3')]:
+        cache.put(mer_entry(key), owner)
+    # Alla används av någon session: budgeten får överskridas hellre än att kasta dem
+    assert len(cache) == 3 and cache.size == 120
+
+    # s1 byter till c - a saknar referenser och kastas, trots att b är äldre än c
+    assert cache.attach('c', 's1') is not None
+    assert cache.refcount('a') == 0 and cache.refcount('c') == 2
+    cache.put(mer_entry('d', 10), 's4')
+    assert cache.attach('a', 's5') is None
+    assert cache.attach('b', 's2').name == 'b.xlsx' and len(cache) == 3 and cache.size == 90
+
+    # Bland poster utan referenser kastas den minst nyligen använda först (d, inte b)
+    cache.release('s2')
+    cache.release('s4')
+    cache.put(mer_entry('e', 20), 's6')
+    assert cache.attach('d', 's7') is None and cache.attach('b', 's7') is not None
+    assert cache.size == 100
+    assert (cache.hits, cache.misses) == (3, 2)
+
+def test_mer_cache_lease_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rc.time, 'time', lambda: now[0])
+    cache = rc.MerCache(max_bytes=100, lease_seconds=60)
+    cache.put(mer_entry('a', 60), 'stängd')
+    cache.put(mer_entry('b', 60), 'aktiv')
+    assert cache.refcount('a') == 1 and len(cache) == 2
+
+    # Sessionen som inte hörts av på en timme räknas som stängd och dess fil kan kastas
+    now[0] += 61
+    assert cache.refcount('a') == 0
+    cache.attach('b', 'aktiv')
+    cache.put(mer_entry('c', 30), 'ny')
+    assert cache.attach('a', 'ny') is None
+    assert cache.refcount('b') == 1 and cache.refcount('c') == 1
@@ -0,0 +1,69 @@
+import json
+
+import pandas as pd
+import pytest
+
+import rfid_converter as rc
+
+MAPPING = {'rfid': 'RFID HEX', 'tagg_id': None, 'identifier': 'Regnummer', 'company': 'Företag'}
+
+@pytest.fixture
+def workbook() -> bytes:
+    df = pd.DataFrame({
+        'RFID HEX': ['00AB12CD', '0000000F', '1234ABCD'],
+        'Regnummer': ['ABC123', 'XYZ999', 'GHI456'],
+        'Företag': ['Företag AB', 'Företag AB', 'Åkeri & Co'],
+    })
+    return df.to_csv(sep=';', index=False).encode('utf-8')
+
+def provisioned(path: str) -> set:
+    store = rc.ExportStore(path)
+    return {company for company in ['Företag AB', 'Åkeri & Co'] if store.last_export(company) is not None}
+
+def test_convert_does_not_record_by_default(workbook, tmp_path):
+    store_path = str(tmp_path / 'store.sqlite')
+    report, files = rc.convert_data(workbook, 'flotta.csv', MAPPING, None, export_store_path=store_path)
+    assert report['status'] == 'ok' and len(files) == 2
+    assert report['recorded'] is False
+    assert provisioned(store_path) == set()
+
+def test_convert_records_when_asked(workbook, tmp_path):
+    store_path = str(tmp_path / 'store.sqlite')
+    report, _ = rc.convert_data(workbook, 'flotta.csv', MAPPING, None, export_store_path=store_path, record=True)
+    assert report['recorded'] is True
+    assert provisioned(store_path) == {'Företag AB', 'Åkeri & Co'}
+
+def test_delta_without_record_keeps_baseline(workbook, tmp_path):
+    store_path = str(tmp_path / 'store.sqlite')
+    rc.convert_data(workbook, 'flotta.csv', MAPPING, None, export_store_path=store_path, delta=True)
+    report, _ = rc.convert_data(workbook, 'flotta.csv', MAPPING, None, export_store_path=store_path, delta=True)
+    # Inget har sparats, så alla kort är fortfarande tillagda
+    assert sum(row['Tillagda'] for row in report['delta']) == 3
+
+def test_batch_record_flag(workbook, tmp_path):
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'in' / 'flotta.csv').write_bytes(workbook)
+    store_path = str(tmp_path / 'store.sqlite')
+    args = ['batch', str(tmp_path / 'in'), '-o', str(tmp_path / 'out'), '-w', '1',
+            '-m', 'rfid=RFID HEX,identifier=Regnummer,company=Företag', '--export-store', store_path,
+            '--mer-index', str(tmp_path / 'mer.sqlite')]
+    assert rc.main_cli(args) == rc.EXIT_OK
+    assert provisioned(store_path) == set()
+    assert rc.main_cli(args + ['--record']) == rc.EXIT_OK
+    assert provisioned(store_path) == {'Företag AB', 'Åkeri & Co'}
+    assert rc.main_cli(args + ['--record', '--no-registry']) == rc.EXIT_FAILED
+
+def test_batch_uses_only_its_own_mer_file(tmp_path):
+    fleet = pd.DataFrame({'TAGG ID': ['SE-MER-000001-1'], 'Regnummer': ['ABC123'], 'Företag': ['Företag AB']})
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'in' / 'flotta.csv').write_bytes(fleet.to_csv(sep=';', index=False).encode('utf-8'))
+    index_path = str(tmp_path / 'mer.sqlite')
+    # En MER-fil som någon annan (t.ex. webbgränssnittet) har läst in
+    rc.MerIndex(index_path).ingest(pd.DataFrame({'Visible Number': ['SE-MER-000001-1'],
+                                                 'Key/Card number': ['00AB12CD']}), 'ui', 'ui.xlsx')
+    args = ['batch', str(tmp_path / 'in'), '-o', str(tmp_path / 'out'), '-w', '1',
+            '--mer-index', index_path, '--no-registry']
+    assert rc.main_cli(args + ['-m', 'tagg_id=TAGG ID,identifier=Regnummer,company=Företag']) == rc.EXIT_FAILED
+    assert rc.main_cli(args) == rc.EXIT_FAILED
+    report = json.loads((tmp_path / 'out' / 'flotta.report.json').read_text(encoding='utf-8'))
+    assert report['message'] == "MER-fil saknas men krävs för TAGG ID matchning"
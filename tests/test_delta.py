@@ -0,0 +1,62 @@
+import io
+
+import pandas as pd
+
+import rfid_converter as rc
+
+def cards(*pairs) -> pd.DataFrame:
+    return pd.DataFrame(pairs, columns=['RFID', 'Identifieringsnummer'], dtype=object)
+
+def valid_rows(*rows) -> pd.DataFrame:
+    """Giltiga rader: (RFID, Identifieringsnummer, Företag)."""
+    df = pd.DataFrame(rows, columns=['RFID_CLEAN', 'Identifieringsnummer', 'Företag'], dtype=object)
+    df['Företag'] = df['Företag'].astype('category')
+    return df
+
+def read_delta(company_csv: rc.CompanyCsv) -> pd.DataFrame:
+    return pd.read_csv(io.BytesIO(company_csv.data), sep=';', dtype=str, encoding='utf-8-sig')
+
+def test_compute_delta_orders_added_changed_removed():
+    previous = cards(('00000001', 'ABC123'), ('00000002', 'XYZ999'), ('00000003', 'DEF456'))
+    current = cards(('00000004', 'GHI789'), ('00000002', 'JKL000'), ('00000001', 'ABC123'))
+    delta = rc.compute_delta(previous, current)
+    assert delta.to_dict('records') == [
+        {'RFID': '00000004', 'Identifieringsnummer': 'GHI789', rc.DELTA_COLUMN: rc.DELTA_ADDED},
+        {'RFID': '00000002', 'Identifieringsnummer': 'JKL000', rc.DELTA_COLUMN: rc.DELTA_CHANGED},
+        {'RFID': '00000003', 'Identifieringsnummer': 'DEF456', rc.DELTA_COLUMN: rc.DELTA_REMOVED},
+    ]
+
+def test_compute_delta_without_baseline_adds_everything():
+    current = cards(('00000001', 'ABC123'), ('00000002', 'XYZ999'))
+    delta = rc.compute_delta(cards(), current)
+    assert delta['RFID'].tolist() == ['00000001', '00000002']
+    assert (delta[rc.DELTA_COLUMN] == rc.DELTA_ADDED).all()
+    assert rc.compute_delta(current, current).empty
+
+def test_build_delta_csvs_per_company():
+    store = rc.ExportStore(':memory:')
+    first = valid_rows(('00000001', 'ABC123', 'Företag AB'), ('00000002', 'XYZ999', 'Företag AB'),
+                       ('00000003', 'DEF456', 'Åkeri & Co'))
+
+    # Första exporten: ingen baslinje, allt är tillagt
+    files, summary = rc.build_delta_csvs(first, store)
+    assert summary.set_index('Företag')['Senast provisionerad'].tolist() == ['Aldrig', 'Aldrig']
+    assert summary['Tillagda'].tolist() == [2, 1] and summary['Rader tidigare'].tolist() == [0, 0]
+    for company, _, company_data in rc.company_frames(first):
+        store.save(company, company_data)
+
+    second = valid_rows(('00000001', 'ABC123', 'Företag AB'), ('00000004', 'GHI789', 'Företag AB'),
+                        ('00000003', 'DEF456', 'Åkeri & Co'))
+    files, summary = rc.build_delta_csvs(second, store)
+    counts = summary.set_index('Företag')[['Rader tidigare', 'Rader nu', 'Tillagda', 'Ändrade', 'Borttagna']]
+    assert counts.loc['Företag AB'].tolist() == [2, 2, 1, 0, 1]
+    assert counts.loc['Åkeri & Co'].tolist() == [1, 1, 0, 0, 0]
+
+    assert sorted(files) == ['Akeri_Co_delta.csv', 'Foretag_AB_delta.csv']
+    company_ab = read_delta(files['Foretag_AB_delta.csv'])
+    assert company_ab.values.tolist() == [['00000004', 'GHI789', rc.DELTA_ADDED],
+                                          ['00000002', 'XYZ999', rc.DELTA_REMOVED]]
+    # Oförändrat företag: bara rubrikraden
+    unchanged = files['Akeri_Co_delta.csv']
+    assert unchanged.rows == 0 and list(read_delta(unchanged).columns) == [
+        'RFID', 'Identifieringsnummer', rc.DELTA_COLUMN]
@@ -0,0 +1,42 @@
+import pandas as pd
+
+import rfid_converter as rc
+
+def rows(entries) -> pd.DataFrame:
+    """Validerade rader: (RFID, giltig, identifieringsnummer, flik)."""
+    df = pd.DataFrame(entries, columns=['RFID_CLEAN', 'RFID_VALID', 'Identifieringsnummer', rc.SHEET_COLUMN])
+    df[rc.SOURCE_ROW] = range(2, len(df) + 2)
+    return df
+
+def test_repeats_and_conflicts_are_separated():
+    summary, warnings = rc.check_duplicates(rows([
+        ('00000001', True, 'ABC123', 'Norr'),
+        ('00000002', True, 'XYZ999', 'Norr'),
+        ('00000001', True, 'ABC123', 'Syd'),
+        ('00000003', True, 'GHI456', 'Norr'),
+        ('00000002', True, 'JKL789', 'Norr'),
+        ('00000004', True, '', 'Norr'),
+        ('00000004', True, '', 'Syd'),
+        ('00000003', False, 'GHI456', 'Norr'),   # ogiltiga rader räknas inte
+    ]))
+    assert summary.to_dict('records') == [
+        {'Grupp': 1, 'RFID': '00000001', 'Antal': 2, 'Första rad': 2, 'Identifieringsnummer': 'ABC123',
+         'Flikar': 'Norr, Syd', 'Typ': rc.DUPLICATE_REPEAT},
+        {'Grupp': 2, 'RFID': '00000002', 'Antal': 2, 'Första rad': 3, 'Identifieringsnummer': 'XYZ999, JKL789',
+         'Flikar': 'Norr', 'Typ': rc.DUPLICATE_CONFLICT},
+        {'Grupp': 3, 'RFID': '00000004', 'Antal': 2, 'Första rad': 7, 'Identifieringsnummer': 'Saknas',
+         'Flikar': 'Norr, Syd', 'Typ': rc.DUPLICATE_REPEAT},
+    ]
+    by_row = warnings.set_index('Rad')
+    assert sorted(by_row.index) == [2, 3, 4, 6, 7, 8]
+    assert (by_row.loc[[2, 4, 7, 8], 'Problem'] == rc.PROBLEM_DUPLICATE).all()
+    assert (by_row.loc[[3, 6], 'Problem'] == rc.PROBLEM_DUPLICATE_CONFLICT).all()
+    assert by_row.loc[[2, 4, 3, 6, 7, 8], 'Grupp'].tolist() == [1, 1, 2, 2, 3, 3]
+
+def test_no_duplicates():
+    summary, warnings = rc.check_duplicates(rows([
+        ('00000001', True, 'ABC123', 'Norr'),
+        ('00000001', False, 'ABC123', 'Norr'),
+        ('00000002', True, 'XYZ999', 'Norr'),
+    ]))
+    assert summary.empty and warnings.empty
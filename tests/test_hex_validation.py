@@ -0,0 +1,53 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rfid_converter as rc
+
+# Känsliga fall: prefix, TAGG ID, tomma värden, avslutande radbrytning och fel längd
+VALUES = [
+    '00AB12CD', '0000000F', ' 0a1b2c3d ', '0x00FF00FF', '0X0X00FF00FF', 'ABCDEF', 'ABCDEF0123',
+    'ABCDE', 'ABCDEF01234', 'SE-MER-000123-4', 'se-mer-000001-9', 'GHIJKL', '12 34 56', '',
+    ' ', '00ab12cd\n', '\n', 'ÅÄÖ123', None, np.nan, 12345678, 1234.5,
+]
+
+def random_values(count: int, seed: int = 1) -> list:
+    alphabet = '0123456789abcdefABCDEFxX -\nGSEMR'
+    rng = random.Random(seed)
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(count)]
+
+def assert_matches_reference(values: pd.Series):
+    clean, valid, reason = rc.validate_hex_series(values)
+    for position, value in enumerate(values):
+        expected_valid, expected_clean = rc.validate_hex(value)
+        assert valid.iloc[position] == expected_valid, repr(value)
+        assert clean.iloc[position] == expected_clean, repr(value)
+        assert (reason.iloc[position] == rc.HEX_OK) == expected_valid, repr(value)
+
+@pytest.mark.parametrize('dtype', [object, 'string', 'str'])
+def test_matches_scalar_reference(dtype):
+    values = pd.Series([value if not isinstance(value, (int, float)) or pd.isna(value) else str(value)
+                        for value in VALUES] + random_values(2000), dtype=dtype)
+    assert_matches_reference(values)
+
+def test_matches_scalar_reference_for_arrow_strings():
+    pytest.importorskip('pyarrow')
+    values = pd.Series([value for value in VALUES if isinstance(value, str)] + random_values(2000) + [None],
+                       dtype='string[pyarrow]')
+    assert_matches_reference(values)
+
+def test_mixed_object_values():
+    assert_matches_reference(pd.Series(VALUES, dtype=object))
+
+def test_reason_codes():
+    _, _, reason = rc.validate_hex_series(pd.Series(['00AB12CD', None, ' ', 'SE-MER-1', 'XYZ123', 'AB'],
+                                                    dtype=object))
+    assert list(reason) == [rc.HEX_OK, rc.HEX_MISSING, rc.HEX_EMPTY, rc.HEX_TAGG_ID, rc.HEX_CHARSET,
+                            rc.HEX_LENGTH]
+
+def test_keeps_index():
+    values = pd.Series(['00AB12CD', 'bad'], index=[10, 20])
+    clean, valid, reason = rc.validate_hex_series(values)
+    assert list(clean.index) == list(valid.index) == list(reason.index) == [10, 20]
@@ -0,0 +1,52 @@
+import io
+import re
+import zipfile
+
+import pytest
+from openpyxl import Workbook
+
+import rfid_converter as rc
+
+@pytest.mark.parametrize('data, kind', [
+    (b'RFID;Regnummer\n00AB12CD;ABC123\n0000000F;XYZ999\n', 'csv'),
+    (b'RFID;Regnummer\n00AB12CD;ABC123\n0000000F;XYZ999', 'csv'),
+    (b'RFID;Regnummer\n00AB12CD;"ABC\n123"\n0000000F;"XYZ\n\n999"\n', 'csv'),
+    (b'RFID\tRegnummer\r\n00AB12CD\tABC123\r\n0000000F\tXYZ999\r\n', 'tsv'),
+    (b'RFID;Regnummer\n', 'csv'),
+])
+def test_csv_row_count_matches_parsed_rows(data, kind):
+    assert rc.input_row_count(data, kind) == len(rc.read_input(data, kind))
+
+def excel_with_dimension(rows: int, dimension) -> bytes:
+    """Arbetsbok med rubrik + rows rader där <dimension> ersatts (None tar bort den)."""
+    wb = Workbook()
+    wb.active.title = 'Data'
+    wb.active.append(['RFID', 'Regnummer'])
+    for i in range(rows):
+        wb.active.append([f'{i:08X}', f'ABC{i:03d}'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    source, target = zipfile.ZipFile(buffer), io.BytesIO()
+    with zipfile.ZipFile(target, 'w') as out:
+        for item in source.infolist():
+            content = source.read(item)
+            if item.filename == 'xl/worksheets/sheet1.xml':
+                replacement = f'<dimension ref="{dimension}"/>'.encode() if dimension else b''
+                content = re.sub(rb'<dimension ref="[^"]*"\s*/>', replacement, content)
+            out.writestr(item, content)
+    return target.getvalue()
+
+@pytest.mark.parametrize('dimension, expected', [
+    ('A1:B31', 30),     # korrekt storlek
+    (None, None),       # storlek saknas
+    ('A1:A1', None),    # inaktuell standardstorlek
+    ('A1:B3', None),    # mindre än förhandsgranskningen
+])
+def test_excel_preview_row_estimate(dimension, expected):
+    preview, total_rows = rc.read_excel_preview(excel_with_dimension(30, dimension), 'Data', nrows=5)
+    assert len(preview) == 5 and list(preview.columns) == ['RFID', 'Regnummer']
+    assert total_rows == expected
+
+def test_excel_chunks_ignore_stale_dimension():
+    chunks = list(rc.iter_excel_chunks(excel_with_dimension(30, 'A1:B3'), 'Data', ['RFID'], chunk_size=8))
+    assert sum(len(chunk) for chunk in chunks) == 30
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+import rfid_converter as rc
+
+TIMEOUT = 30
+
+def wait_for(condition):
+    deadline = time.time() + TIMEOUT
+    while not condition():
+        assert time.time() < deadline, "Tidsgränsen överskreds"
+        time.sleep(0.01)
+
+def blocking(release: threading.Event, started: list = None, progress=(0, 0)):
+    """Jobb som väntar på release och rapporterar förlopp (så att det kan avbrytas)."""
+    def func(job):
+        if started is not None:
+            started.append(job.label)
+        while not release.wait(0.01):
+            job.report(*progress)
+        return {'label': job.label}
+    return func
+
+def test_owners_take_turns_with_cancellation_and_progress():
+    manager = rc.JobManager(workers=1)
+    gate = threading.Event()
+    started = []
+    first = manager.submit('x', 'gate', None, 'gate', blocking(gate, progress=(50, 200)))
+    wait_for(lambda: first.status == rc.JOB_RUNNING and first.total_rows)
+    assert first.progress == 0.25
+
+    go = threading.Event()
+    go.set()
+    jobs = {}
+    for label in ['a1', 'a2', 'a3']:
+        jobs[label] = manager.submit('a', label, None, label, blocking(go, started))
+    for label in ['b1', 'b2']:
+        jobs[label] = manager.submit('b', label, None, label, blocking(go, started))
+    assert manager.counts() == {rc.JOB_QUEUED: 5, rc.JOB_RUNNING: 1}
+    assert manager.queue_position(jobs['a1']) == 0 and manager.queue_position(jobs['b1']) == 1
+    assert manager.queue_position(jobs['a2']) == 2
+
+    # Ett nytt jobb av samma slag ersätter sessionens köade jobb
+    replaced = jobs['a3']
+    jobs['a3'] = manager.submit('a', 'a3', None, 'a3 igen', blocking(go, started))
+    assert replaced.done and replaced.status == rc.JOB_CANCELLED and replaced.result is None
+
+    gate.set()
+    for job in [first, *jobs.values()]:
+        assert job.wait(TIMEOUT)
+    # Turvis mellan sessionerna, inte först alla jobb från a
+    assert started == ['a1', 'b1', 'a2', 'b2', 'a3 igen']
+    assert all(job.status == rc.JOB_DONE and job.progress == 1.0 for job in jobs.values())
+    assert jobs['b2'].result == {'label': 'b2'}
+    assert manager.counts() == {rc.JOB_QUEUED: 0, rc.JOB_RUNNING: 0}
+
+def test_running_job_is_cancelled_and_failures_are_reported():
+    manager = rc.JobManager(workers=2)
+    assert manager.max_running_per_owner == 1
+    never = threading.Event()
+    running = manager.submit('a', 'validate', None, 'lång', blocking(never))
+    waiting = manager.submit('a', 'export', None, 'väntar', blocking(never))
+    other = manager.submit('b', 'validate', None, 'annan', lambda job: {'ok': True})
+    # Sessionen a får inte ta båda trådarna - b:s jobb kör ändå
+    assert other.wait(TIMEOUT) and other.status == rc.JOB_DONE
+    assert waiting.status == rc.JOB_QUEUED
+
+    manager.cancel(running.id)
+    assert running.wait(TIMEOUT) and running.status == rc.JOB_CANCELLED
+    wait_for(lambda: waiting.status == rc.JOB_RUNNING)
+    manager.cancel(waiting.id)
+    assert waiting.wait(TIMEOUT) and waiting.status == rc.JOB_CANCELLED
+
+    def broken(job):
+        raise ValueError("trasig fil")
+    failed = manager.submit('b', 'validate', None, 'fel', broken)
+    assert failed.wait(TIMEOUT) and failed.status == rc.JOB_FAILED and failed.error == "trasig fil"
+    manager.forget(failed.id)
+    assert manager.get(failed.id) is None and manager.get(other.id) is other
+
+@pytest.mark.parametrize('rows_done, total_rows, expected', [(0, 0, 0.0), (25, 100, 0.25), (300, 100, 1.0)])
+def test_progress(rows_done, total_rows, expected):
+    job = rc.Job('a', 'validate', None, 'test', lambda job: {})
+    job.report(rows_done, total_rows)
+    assert job.progress == expected
+    job.status = rc.JOB_DONE
+    assert job.progress == 1.0
@@ -0,0 +1,138 @@
+import pickle
+import sqlite3
+
+import pandas as pd
+
+import rfid_converter as rc
+
+def mer_frame(pairs: dict) -> pd.DataFrame:
+    return pd.DataFrame({'Visible Number': list(pairs), 'Key/Card number': list(pairs.values())})
+
+OLD = mer_frame({'SE-MER-000001-1': 'AA000001', 'SE-MER-000002-2': 'AA000002', 'SE-MER-000003-3': 'AA000003'})
+NEW = mer_frame({'SE-MER-000001-1': 'BB000001', 'SE-MER-000002-2': 'AA000002'})
+TAGGS = pd.Series(['SE-MER-000001-1', 'SE-MER-000002-2', 'SE-MER-000003-3'])
+
+def lookup(table: rc.MerTable) -> list:
+    return table.lookup(TAGGS).tolist()
+
+def test_each_file_is_looked_up_on_its_own(tmp_path):
+    index = rc.MerIndex(str(tmp_path / 'mer.sqlite'))
+    index.ingest(OLD, 'old', 'old.xlsx')
+    conflicts = index.ingest(NEW, 'new', 'new.xlsx')
+
+    # Ett TAGG ID som tagits bort i den nya filen matchar inte längre
+    assert lookup(index.table('new'))[:2] == ['BB000001', 'AA000002']
+    assert pd.isna(lookup(index.table('new'))[2])
+    assert lookup(index.table('old')) == ['AA000001', 'AA000002', 'AA000003']
+    assert conflicts[['TAGG ID', 'Befintligt RFID', 'Nytt RFID', 'Källa']].values.tolist() == [
+        ['SE-MER-000001-1', 'AA000001', 'BB000001', 'Tidigare MER-fil']]
+
+def test_reingesting_a_known_file_keeps_its_table(tmp_path):
+    path = str(tmp_path / 'mer.sqlite')
+    index = rc.MerIndex(path)
+    index.ingest(OLD, 'old', 'old.xlsx')
+    index.ingest(NEW, 'new', 'new.xlsx')
+    assert index.latest_source() == 'new'
+
+    index.ingest(OLD, 'old', 'old.xlsx')
+    assert index.latest_source() == 'old'
+    assert lookup(index.table('old')) == ['AA000001', 'AA000002', 'AA000003']
+    assert lookup(index.table('new'))[0] == 'BB000001'
+
+def test_other_processes_see_new_files(tmp_path):
+    path = str(tmp_path / 'mer.sqlite')
+    reader = rc.MerIndex(path)
+    assert reader.table('old') is None
+    rc.MerIndex(path).ingest(OLD, 'old', 'old.xlsx')
+    assert lookup(reader.table('old')) == ['AA000001', 'AA000002', 'AA000003']
+    rc.MerIndex(path).ingest(NEW, 'new', 'new.xlsx')
+    assert reader.table('new').source == 'new'
+
+def test_old_files_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(rc, 'MER_KEEP_SOURCES', 2)
+    path = str(tmp_path / 'mer.sqlite')
+    index = rc.MerIndex(path)
+    for name in ('a', 'b', 'c'):
+        index.ingest(OLD, name, name)
+    fresh = rc.MerIndex(path)
+    assert not fresh.has_source('a')
+    assert fresh.table('a') is None
+    assert fresh.has_source('b') and fresh.has_source('c')
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(DISTINCT source) FROM mer_pairs").fetchone()[0] == 2
+
+def test_previous_single_index_format_is_replaced(tmp_path):
+    path = str(tmp_path / 'mer.sqlite')
+    with sqlite3.connect(path) as conn:
+        conn.executescript("""
+            CREATE TABLE mer_entries (tagg TEXT PRIMARY KEY, rfid TEXT NOT NULL, source TEXT, updated_at TEXT);
+            CREATE TABLE mer_sources (hash TEXT PRIMARY KEY, name TEXT, rows INTEGER, loaded_at TEXT);
+            INSERT INTO mer_entries VALUES ('SE-MER-000001-1', 'AA000001', 'old', '');
+            INSERT INTO mer_sources VALUES ('old', 'old.xlsx', 1, '');
+        """)
+    index = rc.MerIndex(path)
+    assert not index.has_source('old')
+    index.ingest(NEW, 'new', 'new.xlsx')
+    assert lookup(index.table('new'))[0] == 'BB000001'
+
+def test_ingest_mer_data_returns_source(tmp_path):
+    data = pd.DataFrame(NEW).to_csv(index=False).encode('utf-8')
+    path = str(tmp_path / 'mer.sqlite')
+    source, conflicts = rc.ingest_mer_data(data, 'mer.csv', path)
+    assert source == rc.file_hash(data)
+    again, conflicts = rc.ingest_mer_data(data, 'mer.csv', path)
+    assert again == source and len(conflicts) == 0
+    assert lookup(rc.MerIndex(path).table(source))[0] == 'BB000001'
+
+def test_table_reference_resolves_in_workers(tmp_path):
+    path = str(tmp_path / 'mer.sqlite')
+    index = rc.MerIndex(path)
+    index.ingest(OLD, 'old', 'old.xlsx')
+    table = index.table('old').with_aliases({'SE-MER-000004': 'SE-MER-000003-3'})
+    resolved = rc._resolve_mer_table(pickle.loads(pickle.dumps(table.ref)))
+    assert resolved.key == table.key
+    assert resolved.lookup(pd.Series(['SE-MER-000004'])).tolist() == ['AA000003']
+
+    memory = rc.MerIndex(':memory:')
+    memory.ingest(OLD, 'old', 'old.xlsx')
+    assert memory.table('old').ref is None
+    copy = pickle.loads(pickle.dumps(memory.table('old')))
+    assert lookup(copy) == ['AA000001', 'AA000002', 'AA000003']
+
+def test_pinned_files_are_not_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(rc, 'MER_KEEP_SOURCES', 2)
+    path = str(tmp_path / 'mer.sqlite')
+    server = rc.MerIndex(path)
+    server.ingest(OLD, 'served', 'served.xlsx')
+    server.pin('served', 'serve-1')
+
+    # Tio nya MER-filer från webbgränssnittet
+    uploads = rc.MerIndex(path)
+    for number in range(10):
+        uploads.ingest(NEW, f'ui-{number}', 'ui.xlsx')
+    worker = rc.MerIndex(path)
+    assert lookup(worker.table('served')) == ['AA000001', 'AA000002', 'AA000003']
+    assert not worker.has_source('ui-7') and worker.has_source('ui-8') and worker.has_source('ui-9')
+
+    # Ett släppt eller utgånget lås skyddar inte längre filen
+    server.unpin('serve-1')
+    uploads.ingest(NEW, 'ui-10', 'ui.xlsx')
+    assert not worker.has_source('served')
+
+    server.ingest(OLD, 'served', 'served.xlsx')
+    server.pin('served', 'serve-1')
+    monkeypatch.setattr(rc, 'MER_PIN_SECONDS', -1)
+    uploads.ingest(NEW, 'ui-11', 'ui.xlsx')
+    uploads.ingest(NEW, 'ui-12', 'ui.xlsx')
+    assert not worker.has_source('served')
+
+def test_ingest_mer_file_pins_for_owner(tmp_path, monkeypatch):
+    monkeypatch.setattr(rc, 'MER_KEEP_SOURCES', 1)
+    mer_path = tmp_path / 'mer.csv'
+    mer_path.write_bytes(OLD.to_csv(index=False).encode('utf-8'))
+    index_path = str(tmp_path / 'mer.sqlite')
+    source, _ = rc.ingest_mer_file(str(mer_path), index_path, owner='watch-1')
+    index = rc.MerIndex(index_path)
+    index.ingest(NEW, 'a', 'a.xlsx')
+    index.ingest(NEW, 'b', 'b.xlsx')
+    assert index.has_source(source) and not index.has_source('a')
@@ -0,0 +1,46 @@
+import pandas as pd
+
+import rfid_converter as rc
+
+DF = pd.DataFrame({
+    'RFID HEX': ['00AB12CD', '0000000F', '00ab12cd', 'GHIJKL', None],
+    'Regnummer': ['ABC123', 'XYZ999', 'ABC123', 'DEF456', 'GHI789'],
+    'Chassinummer': ['CH-1', 'CH-2', 'CH-3', 'CH-4', 'CH-5'],
+    'Företag': ['Företag AB', 'Åkeri & Co', 'Företag AB', None, 'Företag AB'],
+})
+
+MAPPING = {'rfid': 'RFID HEX', 'tagg_id': None, 'identifier': 'Regnummer', 'company': 'Företag'}
+
+def assert_same_results(actual, expected):
+    assert actual.keys() == expected.keys()
+    for stage in expected:
+        assert actual[stage].keys() == expected[stage].keys(), stage
+        for name, value in expected[stage].items():
+            if isinstance(value, pd.Series):
+                pd.testing.assert_series_equal(actual[stage][name], value)
+            elif isinstance(value, pd.DataFrame):
+                pd.testing.assert_frame_equal(actual[stage][name], value)
+            else:
+                assert actual[stage][name] == value, (stage, name)
+
+def test_changing_identifier_reuses_rfid_stages():
+    pipeline = rc.ValidationPipeline(DF)
+    pipeline.run(MAPPING)
+    assert pipeline.computed == list(rc.VALIDATION_STAGES)
+
+    changed = {**MAPPING, 'identifier': 'Chassinummer'}
+    assert pipeline.pending(changed) == ['Identifieringsnummer', 'duplicates']
+    results = pipeline.run(changed)
+    assert pipeline.computed == ['Identifieringsnummer', 'duplicates']
+    assert pipeline.pending(changed) == []
+
+    assert_same_results(results, rc.ValidationPipeline(DF).run(changed))
+    # Samma RFID med olika chassinummer är nu en konflikt
+    assert results['duplicates']['summary']['Typ'].tolist() == [rc.DUPLICATE_CONFLICT]
+
+def test_unchanged_mapping_computes_nothing():
+    pipeline = rc.ValidationPipeline(DF)
+    first = pipeline.run(MAPPING)
+    second = pipeline.run(MAPPING)
+    assert pipeline.computed == []
+    assert_same_results(second, first)
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+import rfid_converter as rc
+
+def random_hex(count: int, seed: int) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    return pd.Series([f'{value:08X}' for value in rng.integers(0, 2 ** 32, count)], dtype=object).drop_duplicates()
+
+def test_hash64_is_stable_and_spreads_values():
+    values = pd.Series(['00AB12CD', '00000001', '00000010', 'SE-MER-1', 'abcdef01', 'ÅÄÖ12345', 'ABC', ''],
+                       dtype=object)
+    hashes = rc.hash64(values)
+    assert hashes.dtype == np.uint64 and len(set(hashes.tolist())) == len(values)
+    # Samma värde ger samma hash oavsett strängtyp, position och index
+    shuffled = values.iloc[::-1].astype('string')
+    shuffled.index = range(100, 100 + len(values))
+    assert rc.hash64(shuffled).tolist() == hashes[::-1].tolist()
+    cards = random_hex(100000, seed=1)
+    assert len(np.unique(rc.hash64(cards))) == len(cards)
+
+def test_bloom_filter_has_no_false_negatives():
+    added, other = random_hex(20000, seed=2), random_hex(20000, seed=3)
+    other = other[~other.isin(added)]
+    bloom = rc.BloomFilter(len(added))
+    bloom.add(added)
+    assert bloom.count == len(added) and bloom.might_contain(added).all()
+    assert bloom.might_contain(other).mean() < 10 * rc.BLOOM_ERROR_RATE
+    assert len(bloom.might_contain(pd.Series([], dtype=object))) == 0
+
+def saved_store() -> rc.ExportStore:
+    store = rc.ExportStore(':memory:')
+    store.save('Företag AB', pd.DataFrame({'RFID': ['00000001', '00000002'],
+                                           'Identifieringsnummer': ['ABC123', 'XYZ999']}))
+    store.save('Åkeri & Co', pd.DataFrame({'RFID': ['00000003'], 'Identifieringsnummer': ['DEF456']}))
+    return store
+
+def test_false_positives_are_filtered_in_sqlite():
+    store = saved_store()
+    store.bloom._bits[:] = True   # alla RFID ser ut att kunna finnas
+    registered = store.registered(pd.Series(['00000001', '0000FFFF', '00000003', None]))
+    assert sorted(registered['RFID']) == ['00000001', '00000003']
+    assert registered.set_index('RFID')['Företag'].to_dict() == {'00000001': 'Företag AB',
+                                                                 '00000003': 'Åkeri & Co'}
+
+def test_registry_conflicts_between_companies():
+    store = saved_store()
+    df = pd.DataFrame({
+        'RFID_CLEAN': ['00000001', '00000003', '00000004', '00000002', 'GHIJKL'],
+        'RFID_VALID': [True, True, True, True, False],
+        'Identifieringsnummer': ['ABC123', 'NYTT01', 'GHI789', 'XYZ999', 'JKL000'],
+        'Företag': pd.Categorical(['Företag AB', 'Företag AB', 'Företag AB', 'Åkeri & Co', 'Åkeri & Co']),
+    }, index=[10, 11, 12, 13, 14])
+    conflicts = rc.registry_conflicts(df, store)
+    # Samma företag och nya RFID ger inga varningar
+    assert conflicts['RFID'].tolist() == ['00000003', '00000002']
+    assert (conflicts['Problem'] == rc.PROBLEM_REGISTRY_CONFLICT).all()
+    assert conflicts['Tidigare företag'].tolist() == ['Åkeri & Co', 'Företag AB']
+    assert conflicts['Tidigare Identifieringsnummer'].tolist() == ['DEF456', 'XYZ999']
+    assert conflicts['Rad'].tolist() == [13, 15]
+    assert rc.registry_conflicts(df, rc.ExportStore(':memory:')).empty
@@ -0,0 +1,26 @@
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+import rfid_converter as rc
+
+def reset_app():
+    import streamlit as st
+    import rfid_converter as rc
+    owner = rc.session_owner()
+    if st.button("Återställ", key='reset'):
+        rc.reset_session()
+    st.session_state.setdefault('owner', owner)
+
+def test_reset_releases_mer_cache_lease():
+    entry = rc.MerCacheEntry('reset-test', 'mer.xlsx', pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), 'openpyxl', 0.0, 0)
+    at = AppTest.from_function(reset_app)
+    at.run()
+    owner = at.session_state['owner']
+    rc.get_mer_cache().put(entry, owner)
+    rc.get_mer_cache().put(entry, 'annan session')
+    assert rc.get_mer_cache().refcount('reset-test') == 2
+
+    at.button(key='reset').click().run()
+    assert rc.get_mer_cache().refcount('reset-test') == 1
+    assert at.session_state['step'] == 'instructions'
+    assert 'job_owner' not in at.session_state
@@ -0,0 +1,59 @@
+import os
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+import rfid_converter as rc
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rfid_converter.py')
+
+MER = pd.DataFrame({
+    'Visible Number': [f'SE-MER-C{i:08d}-{"ABCD"[i % 4]}' for i in range(1, 201)],
+    'Key/Card number': [f'{i:08X}' for i in range(1, 201)],
+})
+
+def test_aliases_do_not_change_the_base_table():
+    index = rc.MerIndex(':memory:')
+    index.ingest(MER, 'h1', 'mer.xlsx')
+    base = index.table('h1')
+    table = base.with_aliases({'SE-MER-C00000002': 'SE-MER-C00000002-C'})
+    queries = pd.Series(['SE-MER-C00000002'])
+    assert table.lookup(queries).tolist() == ['00000002']
+    assert base.lookup(queries).isna().all()
+    assert index.table('h1').lookup(queries).isna().all()
+    assert table.key != base.key and base.key == index.table('h1').key
+    # Alias som pekar på ett MER-ID som inte finns i filen ignoreras
+    assert base.with_aliases({'X': 'SE-MER-SAKNAS'}).aliases == {}
+
+def test_accept_and_remove_suggestions_in_session():
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.run()
+    index = rc.get_mer_index()
+    index.ingest(MER, 'h1', 'mer.xlsx')
+    at.session_state['df_main'] = pd.DataFrame({
+        'TAGG': ['SE-MER-C00000001-B', 'SE-MER-C00000002', 'se mer c00000003-d'],
+        'Reg': ['A', 'B', 'C'],
+        'Bolag': ['Z', 'Z', 'Z'],
+    })
+    at.session_state['df_mer'] = MER
+    at.session_state['mer_hash'] = 'h1'
+    at.session_state['column_mapping'] = {'rfid': None, 'tagg_id': 'TAGG', 'identifier': 'Reg', 'company': 'Bolag'}
+    at.session_state['step'] = 'validation'
+    at.run()
+    assert not at.exception
+    assert len(at.session_state['errors']) == 2
+
+    at.button(key='accept_safe_suggestions').click().run()
+    assert len(at.session_state['errors']) == 0
+    assert set(at.session_state['mer_aliases']['h1']) == {'SE-MER-C00000002', 'SE MER C00000003-D'}
+    # Det delade indexet är orört
+    assert index.table('h1').lookup(pd.Series(['SE-MER-C00000002'])).isna().all()
+
+    at.button(key='remove_alias_SE-MER-C00000002').click().run()
+    assert list(at.session_state['mer_aliases']['h1']) == ['SE MER C00000003-D']
+    assert len(at.session_state['errors']) == 1
+
+    at.button(key='remove_all_aliases').click().run()
+    assert at.session_state['mer_aliases']['h1'] == {}
+    assert len(at.session_state['errors']) == 2
+    assert not at.exception
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import rfid_converter as rc
+
+CSV = pd.DataFrame({
+    'RFID HEX': ['00AB12CD', '0000000F'],
+    'Regnummer': ['ABC123', 'XYZ999'],
+    'Företag': ['Företag AB', 'Åkeri & Co'],
+}).to_csv(sep=';', index=False).encode('utf-8')
+
+@pytest.fixture
+def dirs(tmp_path):
+    (tmp_path / 'inbox').mkdir()
+    return tmp_path
+
+def watch(dirs, *extra) -> int:
+    return rc.main_cli([
+        'watch', str(dirs / 'inbox'), '--once', '--settle', '0', '-w', '1',
+        '-m', 'rfid=RFID HEX,identifier=Regnummer,company=Företag',
+        '--ledger', str(dirs / 'ledger.sqlite'), '--mer-index', str(dirs / 'mer.sqlite'),
+        '--export-store', str(dirs / 'store.sqlite'), '--profiles', str(dirs / 'profiles.json'), *extra
+    ])
+
+def test_once_converts_and_moves(dirs):
+    (dirs / 'inbox' / 'flotta.csv').write_bytes(CSV)
+    assert watch(dirs) == rc.EXIT_OK
+    assert os.listdir(dirs / 'inbox') == []
+    [done] = os.listdir(dirs / 'done')
+    assert done.startswith('flotta_') and done.endswith('.csv')
+    [report] = [name for name in os.listdir(dirs / 'outbox') if name.endswith('.report.json')]
+    assert json.loads((dirs / 'outbox' / report).read_text(encoding='utf-8'))['recorded'] is False
+
+    # Samma fil igen flyttas direkt utan ny konvertering
+    (dirs / 'inbox' / 'igen.csv').write_bytes(CSV)
+    assert watch(dirs) == rc.EXIT_OK
+    assert len(os.listdir(dirs / 'done')) == 2 and os.listdir(dirs / 'inbox') == []
+    assert len([name for name in os.listdir(dirs / 'outbox') if name.endswith('.report.json')]) == 1
+
+def test_once_ends_when_file_cannot_be_moved(dirs, monkeypatch, capsys):
+    (dirs / 'inbox' / 'flotta.csv').write_bytes(CSV)
+
+    def refuse(path, directory, name):
+        raise PermissionError(13, 'Permission denied', directory)
+
+    monkeypatch.setattr(rc, '_move_file', refuse)
+    result = {}
+    runner = threading.Thread(target=lambda: result.setdefault('code', watch(dirs)), daemon=True)
+    runner.start()
+    runner.join(60)
+    assert not runner.is_alive(), "--once avslutades inte"
+    assert result['code'] == rc.EXIT_OK
+    assert 'kunde inte flyttas' in capsys.readouterr().out
+    assert os.listdir(dirs / 'inbox') == ['flotta.csv']
+    entry = rc.WatchLedger(str(dirs / 'ledger.sqlite')).get(rc.file_hash(CSV))
+    assert entry['status'] == rc.WATCH_DONE and entry['destination'] == str(dirs / 'inbox')
+
+    # Nästa körning konverterar inte om filen, den flyttas bara
+    monkeypatch.undo()
+    assert watch(dirs) == rc.EXIT_OK
+    assert os.listdir(dirs / 'inbox') == [] and len(os.listdir(dirs / 'done')) == 1
+    assert len([name for name in os.listdir(dirs / 'outbox') if name.endswith('.report.json')]) == 1